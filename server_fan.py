@@ -15,6 +15,8 @@ Script provides following functionalities:
 - Script can receive commands from `local MQTT broker` and from
   `Blynk mobile app` in order to change its behaviour during runnig, e.g.,
   turn on or off the fan, change fan trigger temperatures, etc.
+- Script can act as a coordinator of a fleet of nodes, i.e., aggregate
+  temperatures published by them and alert on nodes gone silent.
 
 """
 __version__ = "0.5.0"
@@ -33,6 +35,15 @@ import os.path
 import sys
 import argparse
 import logging
+import logging.handlers
+import queue
+import functools
+import threading
+import collections
+import json
+import glob
+import types
+import abc
 # Third party modules
 import gbj_pythonlib_sw.config as modConfig
 import gbj_pythonlib_sw.mqtt as modMQTT
@@ -40,7 +51,8 @@ import gbj_pythonlib_sw.statfilter as modFilter
 import gbj_pythonlib_sw.timer as modTimer
 import gbj_pythonlib_sw.trigger as modTrigger
 import gbj_pythonlib_hw.orangepi as modOrangePi
-import BlynkLib as modBlynk
+# Blynk library is imported lazily at its setup as modBlynk
+# Standard library modules of optional features are imported lazily by them
 
 
 ###############################################################################
@@ -62,6 +74,102 @@ CMD_FAN_PERCON = "PERCON"  # Percentage of maximal temperature for fan on
 CMD_FAN_PERCOFF = "PERCOFF"  # Percentage of maximal temperature for fan off
 
 
+###############################################################################
+# Script constants - Fan control and sampling modes
+###############################################################################
+CONTROL_HYSTERESIS = "hysteresis"  # Fan switched by temperature limits
+CONTROL_PREDICTIVE = "predictive"  # Fan switched on by temperature trend
+TRIGGERS_SAMPLE = "sample"  # Fan limits evaluated at every sample
+TRIGGERS_PRESCALE = "prescale"  # Fan limits evaluated by prescaled timer
+SAMPLING_FIXED = "fixed"  # Temperature measured at fixed period
+REPLAY_ORIGINAL = "original"  # Spooled messages replayed to their topics
+REPLAY_SPOOL = "spool"  # Spooled messages replayed to the spool topic
+SAMPLING_ADAPTIVE = "adaptive"  # Measurement period adapted to temperature
+FILTER_FACTOR = 0.2  # Default smoothing factor of filters at configured period
+FILTER_EXPONENTIAL = "exponential"  # Exponential smoothing
+FILTER_MEDIAN = "median"  # Running median of a window of samples
+FILTER_KALMAN = "kalman"  # One dimensional Kalman filter
+FILTER_TRIMMED = "trimmed"  # Trimmed mean of a window of samples
+
+
+###############################################################################
+# Script constants - Runtime modes
+###############################################################################
+RUNTIME_THREADS = "threads"  # Timer threads and blocking script loop
+RUNTIME_ASYNCIO = "asyncio"  # Single asyncio event loop with coroutines
+SCHEDULER_RELATIVE = "relative"  # Timer sleeps period after previous tick
+SCHEDULER_DEADLINE = "deadline"  # Timer fires on absolute deadlines
+OVERRUN_SKIP = "skip"  # Missed deadlines are skipped
+OVERRUN_CATCHUP = "catchup"  # Missed deadlines are fired immediately
+STARTUP_SEQUENTIAL = "sequential"  # Connections before starting timers
+STARTUP_FAST = "fast"  # Fan control first, connections in background
+
+
+###############################################################################
+# Script constants - Telemetry encodings
+###############################################################################
+TELEMETRY_JSON = "json"  # Compact JSON object
+TELEMETRY_BINARY = "binary"  # Fixed binary layout
+TELEMETRY_VERSION = 1  # Version of the binary layout
+# Struct format of version, timestamps of publishing, sample, and fan
+# switching, temperature, fan state, percentages ON and OFF, number of fan
+# channels
+TELEMETRY_HEADER = "<BdddfBffB"
+# Struct format of temperature and fan state of a fan channel
+TELEMETRY_CHANNEL = "<fB"
+
+
+###############################################################################
+# Script constants - History buffer
+###############################################################################
+HISTORY_MAGIC = b"SFH1"  # Identification of the history buffer layout
+# Struct format of magic, capacity, position of the next record, number of
+# records
+HISTORY_HEADER = "<4sIII"
+# Struct format of timestamp, raw and filtered temperature, event, fan channel
+# index
+HISTORY_RECORD = "<dffBB"
+HISTORY_SAMPLE = 0  # Record of a temperature sample
+HISTORY_FAN_ON = 1  # Record of a fan switched on
+HISTORY_FAN_OFF = 2  # Record of a fan switched off
+
+
+###############################################################################
+# Script constants - Time-series store
+###############################################################################
+STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    ts REAL PRIMARY KEY, raw REAL, temp REAL) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS events (ts REAL, channel INTEGER, state INTEGER);
+CREATE INDEX IF NOT EXISTS events_ts ON events (ts);
+CREATE TABLE IF NOT EXISTS rollups (
+    resolution INTEGER, bucket INTEGER, count INTEGER,
+    temp_min REAL, temp_max REAL, temp_sum REAL, fan_on REAL,
+    PRIMARY KEY (resolution, bucket)) WITHOUT ROWID;
+"""
+STORE_MERGE_ROLLUP = """
+INSERT INTO rollups VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (resolution, bucket) DO UPDATE SET
+    count = count + excluded.count,
+    temp_min = min(coalesce(temp_min, excluded.temp_min),
+                   coalesce(excluded.temp_min, temp_min)),
+    temp_max = max(coalesce(temp_max, excluded.temp_max),
+                   coalesce(excluded.temp_max, temp_max)),
+    temp_sum = temp_sum + excluded.temp_sum,
+    fan_on = fan_on + excluded.fan_on
+"""
+STORE_QUERY_SAMPLES = """
+SELECT ts, raw, temp FROM samples WHERE ts >= ? AND ts <= ? ORDER BY ts
+"""
+STORE_QUERY_ROLLUPS = """
+SELECT bucket, temp_min, temp_max, round(temp_sum / nullif(count, 0), 3),
+    round(fan_on / ?, 4)
+FROM rollups
+WHERE resolution = ? AND bucket + resolution > ? AND bucket <= ?
+ORDER BY bucket
+"""
+
+
 ###############################################################################
 # Script constants - ThingSpeak statuses
 ###############################################################################
@@ -69,856 +177,6414 @@ STATUS_FAN_ON = "FAN-ON"
 STATUS_FAN_OFF = "FAN-OFF"
 
 
+###############################################################################
+# Script constants - Reloadable configuration
+###############################################################################
+CONFIG_TOPIC = "topic"  # Option with MQTT topic name and QoS
+CONFIG_SCHEMA = {
+    "Fan": {
+        "pin_fan_name": str,
+        "channels": str,
+        "percentage_maxtemp_on": float,
+        "percentage_maxtemp_off": float,
+        "control": (CONTROL_HYSTERESIS, CONTROL_PREDICTIVE),
+        "predict_window": float,
+        "predict_horizon": float,
+        "percentage_maxtemp_throttle": float,
+    },
+    "TimerTemperature": {
+        "period_measure": float,
+        "filter_factor": float,
+        "sampling": (SAMPLING_FIXED, SAMPLING_ADAPTIVE),
+        "period_min": float,
+        "period_max": float,
+        "sampling_band": float,
+        "sampling_step": float,
+        "prescale_publish": int,
+        "triggers": (TRIGGERS_SAMPLE, TRIGGERS_PRESCALE),
+        "debounce": int,
+        "dwell": float,
+        "prescale_triggers": int,
+        "deadband": float,
+        "deadband_perc": float,
+        "interval_min": float,
+        "heartbeat": float,
+    },
+    "MQTTtopics": {
+        "server_data_temp": CONFIG_TOPIC,
+        "server_data_spool": CONFIG_TOPIC,
+        "server_data_telemetry": CONFIG_TOPIC,
+        "server_data_history": CONFIG_TOPIC,
+        "server_data_fleet": CONFIG_TOPIC,
+        "server_command": CONFIG_TOPIC,
+        "server_command_test": CONFIG_TOPIC,
+        "server_command_history": CONFIG_TOPIC,
+        "server_command_fan": CONFIG_TOPIC,
+        "server_command_fan_percon": CONFIG_TOPIC,
+        "server_command_fan_percoff": CONFIG_TOPIC,
+        "server_status_fan": CONFIG_TOPIC,
+        "server_status_fan_percon": CONFIG_TOPIC,
+        "server_status_fan_percoff": CONFIG_TOPIC,
+        "server_status_metrics": CONFIG_TOPIC,
+        "server_status_fleet": CONFIG_TOPIC,
+    },
+    "MQTTfilters": {
+        "server_filter_data": CONFIG_TOPIC,
+        "server_filter_status": CONFIG_TOPIC,
+        "server_filter_command": CONFIG_TOPIC,
+        "server_filter_fleet": CONFIG_TOPIC,
+    },
+}
+CONFIG_SCHEMA_CHANNEL = {
+    "pin_fan_name": str,
+    "sensor": str,
+    "percentage_maxtemp_on": float,
+    "percentage_maxtemp_off": float,
+}
+
+
 ###############################################################################
 # Script global variables
 ###############################################################################
 script_run = True  # Flag about running script in a loop
+clock = time  # Source of wall and monotonic time, e.g., a virtual clock
+board_factory = None  # Factory of the GPIO board object instead of OrangePi
+fan_publisher = None  # Function publishing fan changes instead of sinks
 cmdline = None  # Object with command line arguments
 logger = None  # Object with standard logging
+log_handler = None  # Object passing log records to a queue
+log_listener = None  # Object writing queued log records to a file
 trigger = None  # Object with triggers
 filter = None  # Object with statistical smoothing and filtering
+filter_registry = {}  # Factories and parameters of filters by type names
+filters = {}  # Objects with smoothing of temperature zones by zone names
+sensors = None  # Object reading temperature zones
+fan_channels = None  # Object with fan channels evaluated in batch
+fan_actor = None  # Object serializing commands for fans
+publish_sinks = {}  # Objects publishing status updates by sink names
+predictor = None  # Object predicting temperature trend for the fan
+crossing = None  # Object detecting fan limits crossing at every sample
+sampling = None  # Object adapting period of temperature measurement
+telemetry = None  # Object encoding batched telemetry
+history = None  # Object with ring buffer of temperature history
+store = None  # Object with local time-series store
+fleet = None  # Object aggregating temperatures of nodes of the fleet
 config = None  # Object with MQTT configuration file processing
+config_snapshot = None  # Object with parsed reloadable configuration
+config_watcher = None  # Object watching changes of configuration file
 mqtt = None  # Object for MQTT broker manipulation
+mqtt_filters_snapshot = None  # Configuration snapshot of broker filters
 thingspeak = None  # Object for ThingSpeak MQTT manipulation
 pi = None  # Object with OrangePi GPIO control
+pins = None  # Object with shadow register of GPIO pin states
 blynk = None  # Object for Blynk application cooperation
+modBlynk = None  # Module of Blynk library imported at its setup
+thingspeak_bulk = None  # Object buffering ThingSpeak updates for bulk update
+spool = None  # Object spooling MQTT publishing while disconnected
+policy_temp = None  # Object with publish policy of temperature to MQTT
+policy_thingspeak = None  # Object with publish policy of ThingSpeak timer
+metrics = None  # Object with latency histograms and counters
+runtime = RUNTIME_THREADS  # Runtime mode of the script
+scheduler = SCHEDULER_RELATIVE  # Scheduling mode of timers
+overrun = OVERRUN_SKIP  # Overrun policy of deadline scheduling
+timers = {}  # Definitions of periodic timers by their names
+startup = STARTUP_SEQUENTIAL  # Startup mode of the script
+startup_begin = None  # Monotonic time of starting the script
+startup_times = {}  # Startup milestones in seconds since starting
+script_event = None  # Event waking the script loop in threads runtime
+aioloop = None  # Event loop of the asyncio runtime
+aioloop_event = None  # Event waking the script loop in asyncio runtime
+mqtt_routes = {}  # Incoming MQTT topics mapped to handlers and commands
+mqtt_routes_filters = []  # MQTT topic filters with fallback handlers
+state_lock = threading.RLock()  # Lock serializing changes of script state
 
 
 ###############################################################################
 # Helper functions
 ###############################################################################
+def config_flag(option, section, default=False):
+    """Read a boolean option from the configuration.
 
+    Arguments
+    ---------
+    option : str
+        Configuration option name.
+    section : str
+        Configuration section name.
+    default : bool
+        Value of a missing option.
+
+    Returns
+    -------
+    bool
+        Flag from values like ``1``, ``true``, ``yes``, ``on``.
+
+    """
+    value = config.option(option, section)
+    if value is None or not str(value).strip():
+        return default
+    return str(value).strip().lower() in ["1", "true", "yes", "on"]
+
+
+def topic_name(option, section):
+    """Return name of a configured MQTT topic from configuration snapshot."""
+    return config_snapshot.topic(option, section)
+
+
+def startup_mark(milestone):
+    """Record and log a startup milestone in seconds since starting."""
+    if startup_begin is None:
+        return
+    startup_times[milestone] = round(clock.monotonic() - startup_begin, 6)
+    logger.info(
+        "Startup %s in %ss",
+        milestone.replace("_", " "), startup_times[milestone])
+
+
+def script_wakeup():
+    """Wake up the script loop in order to notice the changed running flag."""
+    if script_event is not None:
+        script_event.set()
+    if aioloop is not None and aioloop_event is not None:
+        aioloop.call_soon_threadsafe(aioloop_event.set)
 
-###############################################################################
-# General actions
-###############################################################################
-def action_fan(command, value=None):
-    """Perform command for the fan.
+
+def mqtt_topic_matches(topic_filter, topic):
+    """Check whether a MQTT topic matches a topic filter with wildcards.
 
     Arguments
     ---------
-    command : str
-        Action name to be realized.
-    value
-        Any value that the action should be realized with.
+    topic_filter : str
+        MQTT topic filter with optional wildcards ``+`` and ``#``.
+    topic : str
+        MQTT topic of a received message.
+
+    Returns
+    -------
+    bool
+        Flag about matching the topic.
 
     """
-    # Controlling fan
-    if command in [CMD_FAN_ON, CMD_FAN_OFF, CMD_FAN_TOGGLE]:
-        # Suppress publishing useless command, i.e., the command changes pin
-        # state that it already has.
-        try:
-            if command == CMD_FAN_TOGGLE:
-                if pi.is_pin_on(pi.PIN_FAN):
-                    command = CMD_FAN_OFF
-                else:
-                    command = CMD_FAN_ON
-            if command == CMD_FAN_ON:
-                if pi.is_pin_on(pi.PIN_FAN):
-                    return
-                pi.pin_on(pi.PIN_FAN)
-            elif command == CMD_FAN_OFF:
-                if pi.is_pin_off(pi.PIN_FAN):
-                    return
-                pi.pin_off(pi.PIN_FAN)
-            else:
-                return
-            logger.info("Fan set to %s", command)
-        except Exception as errmsg:
-            logger.error("Fan command %s failed: %s.", command, errmsg)
-        # Publishing action
-        mqtt_publish_fan_status()
-        thingspeak_publish(fan_status=True)
-        blynk_publish_fan_status()
-    # Updating fan temperature percentage ON
-    if command == CMD_FAN_PERCON:
-        try:
-            value = abs(float(value))
-            setup_trigger_fan(fan_perc_on=value)
-            logger.info("Updated fan percentage ON=%s%%", value)
-            mqtt_publish_fan_percon()
-            blynk_publish_fan_percon()
-        except Exception:
-            logger.error("Fan command %s failed", command)
-    # Updating fan temperature percentage ON
-    if command == CMD_FAN_PERCOFF:
+    filter_levels = topic_filter.split("/")
+    topic_levels = topic.split("/")
+    for i, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if i >= len(topic_levels):
+            return False
+        if level != "+" and level != topic_levels[i]:
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+def instrumented(func):
+    """Decorate a callback or sink for measuring its latency and errors.
+
+    Arguments
+    ---------
+    func : function
+        Function to be instrumented.
+
+    Returns
+    -------
+    function
+        Wrapper recording duration of every call and raised exceptions
+        to the metrics under the name of the function. Without metrics
+        the function is just called.
+
+    """
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if metrics is None:
+            return func(*args, **kwargs)
+        start = clock.perf_counter()
+        error = False
         try:
-            value = abs(float(value))
-            setup_trigger_fan(fan_perc_off=value)
-            logger.info("Updated fan percentage OFF=%s%%", value)
-            mqtt_publish_fan_percoff()
-            blynk_publish_fan_percoff()
+            return func(*args, **kwargs)
         except Exception:
-            logger.error("Fan command %s failed", command)
-    # Updating fan temperature percentages
-    if command == RESET:
-        setup_trigger_fan(
-            fan_perc_on=pi.FAN_PERC_ON_DEF,
-            fan_perc_off=pi.FAN_PERC_OFF_DEF,
-        )
-        logger.info("Reset fan limits")
-        mqtt_publish_fan_limits()
-        blynk_publish_fan_limits()
+            error = True
+            raise
+        finally:
+            metrics.observe(name, clock.perf_counter() - start, error)
+    return wrapper
 
 
-def action_script(command):
-    """Perform command for this script itself.
+def metrics_failure(sink):
+    """Count failed publishing to a sink."""
+    if metrics is not None:
+        metrics.failure(sink)
+
+
+def runtime_callback(callback):
+    """Adapt a callback invoked from a foreign thread to the runtime mode.
 
     Arguments
     ---------
-    command : str
-        Received command to be realized: ``{"EXIT"}``.
+    callback : function
+        Callback function to be adapted.
+
+    Returns
+    -------
+    function
+        A wrapper holding the state lock in threads runtime, or a wrapper
+        scheduling the callback in the event loop in asyncio runtime, so that
+        all processing is serialized regardless of the calling thread.
 
     """
-    # Stop script
-    if command == "EXIT":
-        global script_run
-        script_run = False
+    if runtime != RUNTIME_ASYNCIO:
+        return state_locked(callback)
 
+    @functools.wraps(callback)
+    def wrapper(*args, **kwargs):
+        if aioloop is None or aioloop.is_closed():
+            return callback(*args, **kwargs)
+        aioloop.call_soon_threadsafe(
+            functools.partial(callback, *args, **kwargs))
+    return wrapper
 
-###############################################################################
-# MQTT actions
-###############################################################################
-def mqtt_publish_temp():
-    """Publish SoC temperature to a MQTT topic."""
-    if not mqtt.get_connected():
-        return
-    message = filter.result()
-    option = "server_data_temp"
-    section = mqtt.GROUP_TOPICS
-    try:
-        mqtt.publish(message, option, section)
-        logger.debug(
-            "Published temperature %s°C to MQTT topic %s.",
-            filter.result(), mqtt.topic_name(option, section))
-    except Exception as errmsg:
-        logger.error(
-            "Temperature publishing to MQTT topic option %s:[%s] failed: %s.",
-            option, section, errmsg)
 
+def state_locked(callback):
+    """Wrap a callback so that it runs holding the state lock.
 
-def mqtt_publish_fan_status():
-    """Publish fan status to the MQTT status topic."""
-    if not mqtt.get_connected():
-        return
-    cfg_option = "server_status_fan"
-    cfg_section = mqtt.GROUP_TOPICS
-    if pi.is_pin_on(pi.PIN_FAN):
-        message = STATUS_FAN_ON
-    else:
-        message = STATUS_FAN_OFF
-    try:
-        mqtt.publish(message, cfg_option, cfg_section)
-        logger.debug(
-            "Published fan status %s to MQTT topic %s.",
-            message, mqtt.topic_name(cfg_option, cfg_section),
-        )
-    except Exception as errmsg:
-        logger.error(
-            "Publishing fan status %s to MQTT topic %s failed: %s.",
-            message,
-            mqtt.topic_name(cfg_option, cfg_section),
-            errmsg,
-        )
+    Notes
+    -----
+    - Timers, the fan actor, and callbacks from foreign threads change the
+      script state only holding the lock, so that, e.g., reloading of the
+      configuration is applied at once for all of them. Blocking work, e.g.,
+      publishing to a cloud, is run outside of the lock.
 
+    """
+    @functools.wraps(callback)
+    def wrapper(*args, **kwargs):
+        with state_lock:
+            return callback(*args, **kwargs)
+    return wrapper
 
-def mqtt_publish_fan_percon():
-    """Publish fan temperature percentage ON to the MQTT status topic."""
-    if not mqtt.get_connected():
-        return
-    cfg_option = "server_status_fan_percon"
-    cfg_section = mqtt.GROUP_TOPICS
-    try:
-        mqtt.publish(str(pi.FAN_PERC_ON_CUR), cfg_option, cfg_section)
-        logger.debug(
-            "Published fan percentage ON=%s%% to MQTT topic %s.",
-            pi.FAN_PERC_ON_CUR, mqtt.topic_name(cfg_option, cfg_section))
-    except Exception as errmsg:
-        logger.error(
-            "Publishing fan percentage ON=%s%% to MQTT topic %s failed: %s.",
-            pi.FAN_PERC_ON_CUR, mqtt.topic_name(cfg_option, cfg_section),
-            errmsg)
 
+def sink_publish(sink, key, func, *args):
+    """Publish a status update to a sink by its worker or right away.
 
-def mqtt_publish_fan_percoff():
-    """Publish fan temperature percentage OFF to the MQTT status topic."""
-    if not mqtt.get_connected():
-        return
-    cfg_option = "server_status_fan_percoff"
-    cfg_section = mqtt.GROUP_TOPICS
-    try:
-        mqtt.publish(str(pi.FAN_PERC_OFF_CUR), cfg_option, cfg_section)
-        logger.debug(
-            "Published fan percentage OFF=%s%% to MQTT topic %s.",
-            pi.FAN_PERC_OFF_CUR, mqtt.topic_name(cfg_option, cfg_section))
-    except Exception as errmsg:
-        logger.error(
-            "Publishing fan percentage OFF=%s%% to MQTT topic %s failed: %s.",
-            pi.FAN_PERC_OFF_CUR, mqtt.topic_name(cfg_option, cfg_section),
-            errmsg)
+    Arguments
+    ---------
+    sink : str
+        Name of the sink, i.e., ``mqtt``, ``thingspeak``, ``blynk``, ``spool``.
+    key : str, tuple
+        Key of the published state, newer update of which replaces a pending
+        one, or None for an event.
+    func : function
+        Publishing function.
+    args : tuple
+        Positional arguments of the publishing function.
 
+    Notes
+    -----
+    - Without the worker of the sink the function is called in the current
+      thread.
 
-def mqtt_publish_fan_limits():
-    """Publish fan temperature percentages to the MQTT status topic."""
-    mqtt_publish_fan_percon()
-    mqtt_publish_fan_percoff()
+    """
+    worker = publish_sinks.get(sink)
+    if worker is None:
+        func(*args)
+    else:
+        worker.submit(key, func, *args)
 
 
-def mqtt_message_log(message):
-    """Log receiving from a MQTT topic.
+def timer_execute(definition, tick):
+    """Execute callbacks of a timer tick.
 
     Arguments
     ---------
-    message : str
-        An instance of ``MQTTMessage``.
-        This is a class with members `topic`, `payload`, `qos`, `retain`.
+    definition : dict
+        Definition of a timer with callback and prescalers.
+    tick : int
+        Ordinal number of the tick used for prescalers.
 
     Returns
     -------
-    bool
-        Flag about present message payload.
-
-    See Also
-    --------
-    gbj_pythonlib_sw.mqtt
-        Module for MQTT processing.
+    function
+        Blocking work returned by the timer callback, e.g., publishing to
+        a cloud, which should be run outside of the script state, or None.
 
     """
-    logger.debug(
-        "Message from MQTT topic %s with qos %s and retain %s",
-        message.topic, message.qos, message.retain)
-    if message.payload is None:
-        return False
-    logger.debug("%s: %s", sys._getframe(1).f_code.co_name,
-                 message.payload.decode("utf-8"))
-    return True
+    with state_lock:
+        work = definition["callback"]()
+        for prescale, prescale_callback in definition.get("prescalers", []):
+            if tick % prescale == 0:
+                prescale_callback()
+    return work
 
 
-def thingspeak_publish(fan_status=False):
-    """Publish to ThingSpeak.
+async def async_timer(name, definition):
+    """Run a periodic timer as a coroutine of the asyncio runtime.
 
     Arguments
     ---------
-    fan_status : bool
-        Flag determining whether current fan state should be published
-        as a ThingSpeak channel status.
+    name : str
+        Name of the timer for logging.
+    definition : dict
+        Definition of the timer with its schedule, callback, and prescalers.
 
     Notes
     -----
-    Data fields are published automatically.
+    - Callbacks run in the event loop and just collect values from the
+      script state. Blocking work returned by them, e.g., publishing to
+      a cloud, is run in a worker thread, so that it neither stalls the event
+      loop nor touches the script state concurrently with it.
 
     """
-    fields = {thingspeak.FIELD_TEMP: filter.result()}
-    # Changed fan state since recent publishing
-    fan_state_cur = pi.pin_state(pi.PIN_FAN)
-    if not hasattr(thingspeak, "fan_state_old"):
-        thingspeak.fan_state_old = fan_state_cur
-    if fan_state_cur != thingspeak.fan_state_old:
-        fields[thingspeak.FIELD_FAN] = fan_state_cur
-        logger.debug(
-            "Fan state change %s -> %s for ThingSpeak field%s",
-            thingspeak.fan_state_old, fan_state_cur, thingspeak.FIELD_FAN)
-        thingspeak.fan_state_old = fan_state_cur
-    # Fan status
-    status = None
-    if fan_status:
-        if pi.is_pin_on(pi.PIN_FAN):
-            status = STATUS_FAN_ON
-        else:
-            status = STATUS_FAN_OFF
-        status += ": {}°C {}".format(
-            fields[thingspeak.FIELD_TEMP],
-            time.ctime()
-            )
-    # Publication to ThingSpeak
-    try:
-        logger.debug("Publish to ThingSpeak")
-        if thingspeak.publish(fields=fields, status=status):
-            logger.debug(
-                "Published temperature %s°C to ThingSpeak field%s",
-                fields[thingspeak.FIELD_TEMP], thingspeak.FIELD_TEMP)
-            if thingspeak.FIELD_FAN in fields:
-                logger.debug(
-                    "Published fan state %s to ThingSpeak field%s",
-                    fields[thingspeak.FIELD_FAN], thingspeak.FIELD_FAN)
-            if status is not None and len(status) > 0:
-                logger.debug(
-                    "Published channel status %s to ThingSpeak",
-                    status)
-    except Exception as errmsg:
-        logger.error(
-            "Publishing to ThingSpeak failed: %s",
-            errmsg)
+    import asyncio
+    schedule = definition["schedule"]
+    schedule.start(clock.monotonic())
+    tick = 0
+    logger.debug("Coroutine of timer %s started", name)
+    while script_run:
+        await asyncio.sleep(schedule.delay(clock.monotonic()))
+        schedule.fire(clock.monotonic())
+        tick += 1
+        try:
+            work = timer_execute(definition, tick)
+            if work is not None:
+                await aioloop.run_in_executor(None, work)
+        except Exception as errmsg:
+            logger.error("Timer %s failed: %s", name, errmsg)
+        schedule.done(clock.monotonic())
 
 
-def blynk_publish_fan_status():
-    """Publish fan status to Blynk mobile application."""
-    global blynk
-    if blynk is None:
-        return
-    if pi.is_pin_on(pi.PIN_FAN):
-        fan_status = ON
-        led_value = 255
-    else:
-        fan_status = OFF
-        led_value = 0
-    try:
-        blynk.virtual_write(blynk.VPIN_FAN_LED, led_value)
-        logger.debug("Published fan status %s to Blynk.", fan_status)
-    except Exception:
-        logger.error("Publishing fan status to Blynk failed.")
+def timers_report():
+    """Log lateness statistics of all timers."""
+    for name, definition in timers.items():
+        schedule = definition["schedule"]
+        logger.info(
+            "Timer %s: ticks = %s, lateness p50 = %s, p99 = %s, skipped = %s",
+            name, schedule.ticks, schedule.percentile(0.5),
+            schedule.percentile(0.99), schedule.skipped)
 
 
-def blynk_publish_fan_percon():
-    """Publish fan temperature percentage ON to Blynk mobile application."""
-    global blynk
-    if blynk is None:
-        return
-    try:
-        blynk.virtual_write(blynk.VPIN_FAN_PERCON, pi.FAN_PERC_ON_CUR)
-        logger.debug("Published fan percentages ON=%s%% to Blynk.",
-                     pi.FAN_PERC_ON_CUR)
-    except Exception:
-        logger.error("Publishing fan percentage ON to Blynk failed.")
+def timers_stop():
+    """Stop all timer threads."""
+    modTimer.stop_timers()
+    for definition in timers.values():
+        if definition.get("timer") is not None:
+            definition["timer"].stop()
 
 
-def blynk_publish_fan_percoff():
-    """Publish fan temperature percentage OFF to Blynk mobile application."""
-    global blynk
-    if blynk is None:
-        return
-    try:
-        blynk.virtual_write(blynk.VPIN_FAN_PERCOFF, pi.FAN_PERC_OFF_CUR)
-        logger.debug("Published fan percentages OFF=%s%% to Blynk.",
-                     pi.FAN_PERC_OFF_CUR)
-    except Exception:
-        logger.error("Publishing fan percentage OFF to Blynk failed.")
+###############################################################################
+# Helper classes
+###############################################################################
+class ConfigSnapshot(object):
+    """Immutable snapshot of reloadable configuration options parsed once.
 
+    Arguments
+    ---------
+    config : object
+        Configuration object of the script.
 
-def blynk_publish_fan_limits():
-    """Publish fan temperature percentages to Blynk mobile application."""
-    blynk_publish_fan_percon()
-    blynk_publish_fan_percoff()
+    Raises
+    ------
+    ValueError
+        Invalid value of a reloadable option.
 
+    Notes
+    -----
+    - Options of sections in the schema are converted to their types and
+      MQTT topics are resolved to names and QoS, so that hot paths do not
+      parse the configuration.
+    - The snapshot cannot be modified. Changes are applied by swapping it
+      for a new one.
 
-###############################################################################
-# Callback functions
-###############################################################################
-def cbTimer_temp_measure(*arg, **kwargs):
-    """Measure current CPU temperature."""
-    # blynk_publish()
-    exec_last = kwargs.pop("exec_last", False)
-    logger.debug(
-        "Measured temperature %s°C",
-        filter.result(pi.measure_temperature())
-    )
-    if exec_last:
-        # global script_run
-        # script_run = False
-        pass
+    """
 
+    __slots__ = ("config", "options", "topics")
+
+    def __init__(self, config):
+        sections = dict(CONFIG_SCHEMA)
+        channels = config.option("channels", "Fan") or ""
+        for name in channels.split(","):
+            if name.strip():
+                sections["Fan:" + name.strip()] = CONFIG_SCHEMA_CHANNEL
+        options = {}
+        topics = {}
+        for section, schema in sections.items():
+            for option, kind in schema.items():
+                value = config.option(option, section)
+                if value is None:
+                    continue
+                value = self._convert(value, kind, option, section)
+                options[(section, option)] = value
+                if kind == CONFIG_TOPIC:
+                    topics[(section, option)] = value
+        object.__setattr__(self, "config", config)
+        object.__setattr__(self, "options", types.MappingProxyType(options))
+        object.__setattr__(self, "topics", types.MappingProxyType(topics))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Configuration snapshot is immutable")
+
+    @staticmethod
+    def _convert(value, kind, option, section):
+        """Convert an option value to its type from the schema."""
+        value = str(value).strip()
+        try:
+            if kind == CONFIG_TOPIC:
+                parts = [part.strip() for part in value.split(",")]
+                qos = int(parts[1]) if len(parts) > 1 and parts[1] else 0
+                if not parts[0] or qos not in [0, 1, 2]:
+                    raise ValueError(value)
+                return (parts[0], qos)
+            if isinstance(kind, tuple):
+                if value.lower() not in kind:
+                    raise ValueError(value)
+                return value.lower()
+            return kind(value)
+        except ValueError:
+            raise ValueError(
+                "Invalid value {} of option {}:[{}]".format(
+                    value, option, section))
+
+    def value(self, option, section, default=None):
+        """Return typed value of an option or the default one."""
+        return self.options.get((section, option), default)
+
+    def topic(self, option, section):
+        """Return name of a topic or None."""
+        topic = self.topics.get((section, option))
+        return topic[0] if topic else None
+
+    def qos(self, option, section):
+        """Return QoS of a topic."""
+        topic = self.topics.get((section, option))
+        return topic[1] if topic else 0
+
+    def changed(self, other):
+        """Return set of sections with changed options against a snapshot."""
+        keys = set(self.options) | set(other.options)
+        return set(
+            section for section, option in keys
+            if self.options.get((section, option))
+            != other.options.get((section, option)))
+
+
+class ConfigWatcher(object):
+    """Watcher of changes of a configuration file.
 
-def cbTimer_temp_publish(*arg, **kwargs):
-    """Publish current CPU temperature."""
-    logger.debug(
-        "Publish temperature %s°C",
-        filter.result()
-    )
-    mqtt_publish_temp()
+    Arguments
+    ---------
+    path : str
+        Path to the configuration file.
+    callback : function
+        Function called without arguments after the file has changed.
+    delay : float
+        Time period in seconds for settling a burst of changes.
 
+    Notes
+    -----
+    - The folder of the file is watched by inotify, so that editors saving
+      the file by renaming a temporary one are noticed as well.
+    - Where inotify is not available, the modification time of the file is
+      polled every second.
 
-def cbTimer_temp_triggers(*arg, **kwargs):
-    """Execute CPU temperature triggers."""
-    trigger.exec_triggers(filter.result(), ids=["fanon", "fanoff"])
+    """
 
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    EVENT = "iIII"  # Struct format of the inotify event header
+
+    def __init__(self, path, callback, delay=0.5):
+        self.path = os.path.abspath(path)
+        self.callback = callback
+        self.delay = delay
+        self._stop = threading.Event()
+        self._fd = None
+        self._thread = threading.Thread(
+            target=self._run, name="ConfigWatcher", daemon=True)
+
+    def start(self):
+        """Start watching in a thread."""
+        try:
+            self._fd = self._inotify()
+        except (OSError, AttributeError) as errmsg:
+            logger.debug("Inotify not available, polling: %s", errmsg)
+            self._fd = None
+        self._thread.start()
+
+    def stop(self):
+        """Stop watching."""
+        self._stop.set()
+
+    def _inotify(self):
+        """Create an inotify instance watching the folder of the file."""
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(
+            ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        folder = os.path.dirname(self.path).encode()
+        if libc.inotify_add_watch(fd, folder, mask) < 0:
+            os.close(fd)
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+        return fd
+
+    def _changed_inotify(self):
+        """Wait for events of the file and return flag about a change."""
+        import select
+        import struct
+        ready, _, _ = select.select([self._fd], [], [], 1.0)
+        if not ready:
+            return False
+        name = os.path.basename(self.path).encode()
+        changed = False
+        try:
+            data = os.read(self._fd, 4096)
+        except BlockingIOError:
+            return False
+        event = struct.Struct(self.EVENT)
+        offset = 0
+        while offset + event.size <= len(data):
+            _, _, _, length = event.unpack_from(data, offset)
+            offset += event.size
+            if data[offset:offset + length].rstrip(b"\0") == name:
+                changed = True
+            offset += length
+        return changed
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+            return (stat.st_mtime, stat.st_size)
+        except OSError:
+            return None
+
+    def _run(self):
+        last = self._stat()
+        while not self._stop.is_set():
+            if self._fd is None:
+                if self._stop.wait(1.0):
+                    break
+                current = self._stat()
+                changed = current is not None and current != last
+                last = current
+            else:
+                changed = self._changed_inotify()
+            if not changed:
+                continue
+            # Settle a burst of events from a single save
+            if self._stop.wait(self.delay):
+                break
+            if self._fd is not None:
+                while self._changed_inotify_pending():
+                    pass
+            last = self._stat()
+            try:
+                self.callback()
+            except Exception as errmsg:
+                logger.error("Configuration reload failed: %s", errmsg)
+        if self._fd is not None:
+            os.close(self._fd)
+
+    def _changed_inotify_pending(self):
+        """Drain pending events without waiting."""
+        import select
+        ready, _, _ = select.select([self._fd], [], [], 0)
+        if not ready:
+            return False
+        try:
+            os.read(self._fd, 4096)
+        except BlockingIOError:
+            return False
+        return True
 
-def cbTimer_thingspeak(*arg, **kwargs):
-    """Publish to ThingSpeak."""
-    thingspeak_publish()
 
+class FilterExponential(modFilter.StatFilterExponential):
+    """Exponential filter of the library extended by the batch interface."""
 
-def cbTrigger_fan(*args, **kwargs):
-    """Execute command for the fan."""
-    command = kwargs.pop("cmd", None)
-    if command is None:
-        return
-    action_fan(command)
+    def batch(self, values):
+        """Filter a sequence of samples and return all filtered values."""
+        result = self.result
+        return [result(value) for value in values]
 
 
-def cbMqtt_on_connect(client, userdata, flags, rc):
-    """Process actions when the broker responds to a connection request.
+class StreamFilter(abc.ABC):
+    """Base of smoothing filters with streaming and batch interface.
 
     Arguments
     ---------
-    client : object
-        MQTT client instance for this callback.
-    userdata
-        The private user data.
-    flags : dict
-        Response flags sent by the MQTT broker.
-    rc : int
-        The connection result (result code).
+    decimals : int
+        Number of decimals of filtered values.
 
-    See Also
-    --------
-    gbj_pythonlib_sw.mqtt._on_connect()
-        Description of callback arguments for proper utilizing.
+    Notes
+    -----
+    - Method ``result`` has the same interface as the one of library
+      filters, so that all filters are interchangeable.
+    - Subclasses implement the update by a sample in ``_update`` and clear
+      their state in ``reset``.
 
     """
-    if rc == 0:
-        logger.debug("Connected to %s: %s", str(mqtt), userdata)
-        setup_mqtt_filters()
-        mqtt_publish_fan_status()
-        mqtt_publish_fan_limits()
-    else:
-        logger.error("Connection to MQTT broker failed: %s", userdata)
 
+    def __init__(self, decimals=3):
+        self.decimals = decimals
+        self.reset()
 
-def cbMqtt_on_disconnect(client, userdata, rc):
-    """Process actions when the client disconnects from the broker.
+    @abc.abstractmethod
+    def _update(self, value):
+        """Register a sample and return the filtered value."""
+
+    def reset(self):
+        """Forget all samples."""
+        self._result = None
+
+    def result(self, value=None):
+        """Register a sample if provided and return the filtered value."""
+        if value is not None:
+            self._result = self._update(float(value))
+        if self._result is None:
+            return None
+        return round(self._result, self.decimals)
+
+    def batch(self, values):
+        """Filter a sequence of samples and return all filtered values.
+
+        Notes
+        -----
+        - Samples are processed in a local loop without a method call per
+          sample, which is faster than streaming them one by one.
+
+        """
+        update = self._update
+        decimals = self.decimals
+        result = self._result
+        results = []
+        append = results.append
+        for value in values:
+            if value is not None:
+                result = update(float(value))
+            append(None if result is None else round(result, decimals))
+        self._result = result
+        return results
+
+
+class FilterMedian(StreamFilter):
+    """Running median of a sliding window of samples.
 
     Arguments
     ---------
-    client : object
-        MQTT client instance for this callback.
-    userdata
-        The private user data.
-    rc : int
-        The connection result (result code).
+    window : int
+        Number of recent samples in the window.
 
-    See Also
-    --------
-    gbj_pythonlib_sw.mqtt._on_connect()
-        Description of callback arguments for proper utilizing.
+    Notes
+    -----
+    - The lower half of the window is kept in a max-heap, the upper half in
+      a min-heap, and samples leaving the window are removed lazily when
+      they get on the top of a heap, so that an update costs O(log n).
+    - Heaps are rebuilt from the window when samples pending removal
+      outnumber the window, which bounds memory and keeps the amortized
+      cost of an update O(log n).
 
     """
-    logger.warning("Disconnected from %s: %s", str(mqtt), userdata)
 
+    def __init__(self, window=5, decimals=3):
+        self.window = max(int(window), 1)
+        super(FilterMedian, self).__init__(decimals)
+
+    def reset(self):
+        """Forget all samples."""
+        super(FilterMedian, self).reset()
+        self._samples = collections.deque()  # Samples in the window
+        self._low = []  # Negated samples of the lower half
+        self._high = []  # Samples of the upper half
+        self._low_size = 0  # Number of valid samples in the lower half
+        self._high_size = 0  # Number of valid samples in the upper half
+        self._removed = collections.Counter()  # Samples pending removal
+
+    def _prune(self, heap, sign):
+        """Pop samples pending removal from the top of a heap."""
+        import heapq
+        removed = self._removed
+        while heap and removed[sign * heap[0]]:
+            removed[sign * heapq.heappop(heap)] -= 1
+
+    def _rebuild(self):
+        """Rebuild heaps from samples in the window."""
+        import heapq
+        ordered = sorted(self._samples)
+        middle = (len(ordered) + 1) // 2
+        self._low = [-value for value in ordered[:middle]]
+        self._high = ordered[middle:]
+        heapq.heapify(self._low)
+        self._low_size = len(self._low)
+        self._high_size = len(self._high)
+        self._removed.clear()
+
+    def _update(self, value):
+        import heapq
+        if not self._low or value <= -self._low[0]:
+            heapq.heappush(self._low, -value)
+            self._low_size += 1
+        else:
+            heapq.heappush(self._high, value)
+            self._high_size += 1
+        self._samples.append(value)
+        if len(self._samples) > self.window:
+            old = self._samples.popleft()
+            self._removed[old] += 1
+            if old <= -self._low[0]:
+                self._low_size -= 1
+                self._prune(self._low, -1)
+            else:
+                self._high_size -= 1
+                self._prune(self._high, 1)
+        # The lower half has the same or one sample more than the upper one
+        if self._low_size > self._high_size + 1:
+            heapq.heappush(self._high, -heapq.heappop(self._low))
+            self._low_size -= 1
+            self._high_size += 1
+            self._prune(self._low, -1)
+        elif self._low_size < self._high_size:
+            heapq.heappush(self._low, -heapq.heappop(self._high))
+            self._low_size += 1
+            self._high_size -= 1
+            self._prune(self._high, 1)
+        if len(self._low) + len(self._high) > 2 * self.window:
+            self._rebuild()
+        if self._low_size > self._high_size:
+            return -self._low[0]
+        return (self._high[0] - self._low[0]) / 2.0
+
+
+class FilterKalman(StreamFilter):
+    """One dimensional Kalman filter of a slowly changing temperature.
 
-def cbMqtt_on_subscribe(client, userdata, mid, granted_qos):
-    """Process actions when the broker responds to a subscribe request.
+    Arguments
+    ---------
+    process_noise : float
+        Variance of the temperature change between samples in °C².
+    measurement_noise : float
+        Variance of the measurement noise in °C².
+
+    """
+
+    def __init__(self, process_noise=0.01, measurement_noise=1.0,
+                 decimals=3):
+        self.process_noise = max(float(process_noise), 0.0)
+        self.measurement_noise = max(float(measurement_noise), 1e-6)
+        super(FilterKalman, self).__init__(decimals)
+
+    def reset(self):
+        """Forget all samples."""
+        super(FilterKalman, self).reset()
+        self._estimate = None  # Estimated temperature
+        self._variance = None  # Variance of the estimate
+
+    def _update(self, value):
+        if self._estimate is None:
+            self._estimate = value
+            self._variance = self.measurement_noise
+            return value
+        variance = self._variance + self.process_noise
+        gain = variance / (variance + self.measurement_noise)
+        self._variance = (1.0 - gain) * variance
+        self._estimate += gain * (value - self._estimate)
+        return self._estimate
+
+
+class FilterTrimmedMean(StreamFilter):
+    """Mean of a sliding window of samples without the extreme ones.
 
     Arguments
     ---------
-    client : object
-        MQTT client instance for this callback.
-    userdata
-        The private user data.
-    mid : int
-        The message ID from the subscribe request.
-    granted_qos : int
-        The list of integers that give the QoS level the broker has granted
-        for each of the different subscription requests.
+    window : int
+        Number of recent samples in the window.
+    trim : float
+        Fraction of the lowest and of the highest samples left out.
+
+    Notes
+    -----
+    - The window is kept sorted by bisection, so that it is not sorted
+      again at every sample.
 
     """
-    # logger.debug("Subscribed to MQTT topic with message id %d", mid)
-    pass
 
+    def __init__(self, window=5, trim=0.2, decimals=3):
+        self.window = max(int(window), 1)
+        self.trim = max(min(float(trim), 0.49), 0.0)
+        super(FilterTrimmedMean, self).__init__(decimals)
+
+    def reset(self):
+        """Forget all samples."""
+        super(FilterTrimmedMean, self).reset()
+        self._samples = collections.deque()  # Samples in the window
+        self._sorted = []  # Samples in the window in ascending order
+
+    def _update(self, value):
+        import bisect
+        self._samples.append(value)
+        bisect.insort(self._sorted, value)
+        if len(self._samples) > self.window:
+            old = self._samples.popleft()
+            del self._sorted[bisect.bisect_left(self._sorted, old)]
+        count = len(self._sorted)
+        cut = int(count * self.trim)
+        kept = self._sorted[cut:count - cut]
+        return sum(kept) / len(kept)
+
+
+class SensorReader(object):
+    """Reader of temperature sensor files kept open between readings.
 
-def cbMqtt_on_message(client, userdata, message):
-    """Process actions when a non-filtered message has been received.
+    Arguments
+    ---------
+    zones : list of tuple
+        Pairs of zone name and path to its sysfs temperature file, e.g.,
+        thermal zone ``temp`` or hwmon ``temp*_input`` file.
+    scale : float
+        Multiplier of read raw values, sysfs files provide millidegrees.
+
+    Notes
+    -----
+    - Files are opened once and reread from their beginning by ``pread``,
+      so that a reading of all zones costs just one syscall per zone.
+    - A zone with a failed reading provides ``None`` and is counted.
+
+    """
+
+    def __init__(self, zones, scale=0.001):
+        self.names = [name for name, _ in zones]
+        self.paths = [path for _, path in zones]
+        self.scale = scale
+        self.errors = 0  # Counter of failed readings
+        self._fds = [os.open(path, os.O_RDONLY) for path in self.paths]
+
+    def __len__(self):
+        return len(self._fds)
+
+    def read(self):
+        """Read current temperatures of all zones in one pass.
+
+        Returns
+        -------
+        list of float
+            Temperatures of zones in order of their names.
+
+        """
+        values = []
+        for fd in self._fds:
+            try:
+                values.append(int(os.pread(fd, 32, 0)) * self.scale)
+            except (OSError, ValueError):
+                self.errors += 1
+                values.append(None)
+        return values
+
+    def close(self):
+        """Close all sensor files."""
+        for fd in self._fds:
+            os.close(fd)
+        self._fds = []
+
+
+class PinShadow(object):
+    """Shadow register of GPIO pin states in front of the GPIO object.
 
     Arguments
     ---------
-    client : object
-        MQTT client instance for this callback.
-    userdata
-        The private user data.
-    message : object
-        An instance of ``MQTTMessage``.
-        This is a class with members `topic`, `payload`, `qos`, `retain`.
+    gpio : object
+        GPIO object with methods ``pin_on``, ``pin_off``, ``pin_state``.
+    interval : float
+        Time period in seconds for reconciling the shadow register with the
+        hardware. Zero means reading the hardware at every state query.
 
     Notes
     -----
-    - The topic that the client subscribes to and the message does not match
-      an existing topic filter callback.
-    - Use message_callback_add() to define a callback that will be called for
-      specific topic filters. This function serves as fallback when none
-      topic filter matched.
+    - Every write updates the shadow register, so that queries of pin states
+      are answered without hardware access.
+    - Reconciliation reads all shadowed pins and detects pins changed
+      externally, i.e., not by this script.
 
     """
-    if not mqtt_message_log(message):
-        return
 
+    def __init__(self, gpio, interval=10.0):
+        self.gpio = gpio
+        self.interval = interval
+        self.reads = 0  # Counter of hardware reads
+        self.external = 0  # Counter of pins changed externally
+        self._states = {}
+        self._reconciled = clock.monotonic()
+        self._lock = threading.Lock()
+
+    def _read(self, pin):
+        self.reads += 1
+        state = 1 if self.gpio.pin_state(pin) else 0
+        self._states[pin] = state
+        return state
+
+    def state(self, pin):
+        """Return state of a pin as 1 for switched on, otherwise 0."""
+        with self._lock:
+            if self.interval <= 0.0 or pin not in self._states:
+                return self._read(pin)
+            return self._states[pin]
+
+    def write(self, pin, state):
+        """Switch a pin on or off and update the shadow register."""
+        with self._lock:
+            if state:
+                self.gpio.pin_on(pin)
+            else:
+                self.gpio.pin_off(pin)
+            self._states[pin] = 1 if state else 0
+
+    def due(self, now):
+        """Check whether reconciliation with the hardware is due."""
+        return self.interval > 0.0 and now - self._reconciled >= self.interval
+
+    def reconcile(self, now=None):
+        """Read all shadowed pins from the hardware.
+
+        Returns
+        -------
+        list of str
+            Pins with state changed externally since their last access.
+
+        """
+        changed = []
+        with self._lock:
+            for pin, state in list(self._states.items()):
+                if self._read(pin) != state:
+                    changed.append(pin)
+            self._reconciled = clock.monotonic() if now is None else now
+        self.external += len(changed)
+        return changed
 
-def cbMqtt_on_message_data(client, userdata, message):
-    """Process server data send through a MQTT topic(s).
+
+class FanChannels(object):
+    """Fan channels with temperature limits evaluated in one batched pass.
+
+    Notes
+    -----
+    - Each channel has a fan pin, a filter of its temperature source, and
+      hysteresis limits as absolute temperatures kept in arrays, so that all
+      channels are evaluated by a single pass over the arrays.
+    - The primary fan of the script is the channel with name ``None``.
+
+    """
+
+    def __init__(self):
+        import array
+        self.names = []
+        self.pins = []
+        self.filters = []
+        self.perc_on = []  # Current percentages for fan ON
+        self.perc_off = []  # Current percentages for fan OFF
+        self.perc_on_def = []  # Default percentages for fan ON
+        self.perc_off_def = []  # Default percentages for fan OFF
+        self.limits_on = array.array("d")
+        self.limits_off = array.array("d")
+        self._indexes = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name, pin, source_filter, perc_on, perc_off):
+        """Add a fan channel with its default percentages."""
+        self._indexes[name] = len(self.names)
+        self.names.append(name)
+        self.pins.append(pin)
+        self.filters.append(source_filter)
+        self.perc_on.append(perc_on)
+        self.perc_off.append(perc_off)
+        self.perc_on_def.append(perc_on)
+        self.perc_off_def.append(perc_off)
+        self.limits_on.append(0.0)
+        self.limits_off.append(0.0)
+
+    def index(self, name):
+        """Return index of a channel by its name."""
+        return self._indexes[name]
+
+    def set_limits(self, index, perc_on, perc_off, temp_on, temp_off):
+        """Set percentages and temperature limits of a channel."""
+        self.perc_on[index] = perc_on
+        self.perc_off[index] = perc_off
+        self.limits_on[index] = temp_on
+        self.limits_off[index] = temp_off
+
+    def evaluate(self, temps, states):
+        """Evaluate limits of all channels in one pass.
+
+        Arguments
+        ---------
+        temps : list of float
+            Current temperatures of channels.
+        states : list of int
+            Current states of fan pins of channels.
+
+        Returns
+        -------
+        list of tuple
+            Pairs of channel index and fan command for channels to switch.
+
+        """
+        return [
+            (index, CMD_FAN_ON if not state else CMD_FAN_OFF)
+            for index, (temp, limit_on, limit_off, state) in enumerate(zip(
+                temps, self.limits_on, self.limits_off, states))
+            if temp is not None and (
+                (not state and temp >= limit_on)
+                or (state and temp <= limit_off))
+        ]
+
+
+class AdaptiveSampling(object):
+    """Measurement period adapted to distance to fan limits and trend.
 
     Arguments
     ---------
-    client : object
-        MQTT client instance for this callback.
-    userdata
-        The private user data.
-    message : object
-        An instance of ``MQTTMessage``.
-        This is a class with members `topic`, `payload`, `qos`, `retain`.
+    period : float
+        Configured measurement period in seconds the filter factor is set for.
+    period_min : float
+        Minimal measurement period in seconds.
+    period_max : float
+        Maximal measurement period in seconds.
+    band : float
+        Distance to the nearest fan limit in °C, below which the period
+        shortens linearly down to the minimal one.
+    step : float
+        Maximal change of temperature in °C expected within a period.
+
+    Notes
+    -----
+    - The period is shortened immediately, but prolonged at most twice
+      per sample, so that it backs off toward the maximal one gradually.
+    - The factor of exponential filters is recalculated for the current
+      period, so that the smoothing time constant stays the same.
 
     """
-    if not mqtt_message_log(message):
-        return
-    # CPU Temperature
-    if message.topic == mqtt.topic_name("server_data_temp"):
-        value = float(message.payload)
-        logger.debug("Received temperature %s°C", value)
-    # Unexpected data
-    else:
-        logger.warning(
-            "Received unknown data %s from topic %s",
-            message.payload.decode("utf-8"), message.topic)
 
+    def __init__(self, period, period_min, period_max, band=5.0, step=0.5):
+        self.period_base = period
+        self.period_min = period_min
+        self.period_max = period_max
+        self.band = band
+        self.step = step
+        self.period = period
+        self._last = None
 
-def cbMqtt_on_message_command(client, userdata, message):
-    """Process server command at receiving a message from the command topic(s).
+    def factor(self, factor=FILTER_FACTOR):
+        """Return filter factor for the current period."""
+        return round(
+            1.0 - (1.0 - factor) ** (self.period / self.period_base), 6)
+
+    def update(self, now, value, distance):
+        """Calculate the next measurement period.
+
+        Arguments
+        ---------
+        now : float
+            Current monotonic time.
+        value : float
+            Current filtered temperature.
+        distance : float
+            Distance of the temperature to the nearest fan limit in °C.
+
+        Returns
+        -------
+        float
+            New measurement period in seconds.
+
+        """
+        if self.band > 0.0:
+            ratio = min(max(distance / self.band, 0.0), 1.0)
+        else:
+            ratio = 1.0
+        period = self.period_min + (self.period_max - self.period_min) * ratio
+        if self._last is not None and now > self._last[0]:
+            rate = abs(value - self._last[1]) / (now - self._last[0])
+            if rate > 0.0:
+                period = min(period, self.step / rate)
+        self._last = (now, value)
+        period = min(period, 2.0 * self.period)
+        self.period = round(
+            max(min(period, self.period_max), self.period_min), 3)
+        return self.period
+
+
+class FanActor(object):
+    """Single owner of fans realizing queued commands in batches.
 
     Arguments
     ---------
-    client : object
-        MQTT client instance for this callback.
-    userdata
-        The private user data.
-    message : object
-        An instance of ``MQTTMessage``.
-        This is a class with members `topic`, `payload`, `qos`, `retain`.
+    capacity : int
+        Maximal number of queued commands, further ones are dropped.
+    window : float
+        Time period in seconds for collecting commands into a batch after
+        the first one.
+    switch_interval : float
+        Minimal time period in seconds between switchings of a fan.
 
     Notes
     -----
-    - The topic that the client subscribes to and the message match the topic
-      filter for server commands.
+    - Commands are coalesced per fan channel, so that a batch switches a fan
+      at most once and updates its percentages at most once.
+    - A switching too early after the previous one is deferred until the
+      interval elapses, unless a newer command supersedes it.
+    - State of fans is published once after each applied batch.
 
     """
-    if not mqtt_message_log(message):
-        return
-    # Command
-    command = message.payload.decode("utf-8")
-    if message.topic == mqtt.topic_name("server_command"):
-        logger.debug(
-            "Received general command %s from topic %s",
-            command, message.topic)
-        action_script(command)
-    # Test data
-    elif message.topic == mqtt.topic_name("server_command_test"):
-        logger.debug(
-            "Received test command %s from topic %s",
-            command, message.topic)
-    # Fan control
-    elif message.topic == mqtt.topic_name("server_command_fan"):
-        logger.debug(
-            "Received fan command %s from topic %s",
-            command, message.topic)
-        action_fan(command)
-    elif message.topic in [mqtt.topic_name("server_command_fan_percon"),
-                           mqtt.topic_name("server_command_fan_percoff"),
-                           ]:
-        command = message.topic.split("/").pop().upper()
-        logger.debug(
-            "Received fan command %s with value %s from topic %s",
-            command, message.payload.decode("utf-8"), message.topic)
-        action_fan(command, message.payload.decode("utf-8"))
-    # Unexpected data
-    else:
-        logger.warning(
-            "Received unknown command %s from topic %s",
-            message.payload.decode("utf-8"), message.topic)
 
+    def __init__(self, capacity=100, window=0.0, switch_interval=0.0):
+        self.window = window
+        self.switch_interval = switch_interval
+        self.dropped = 0  # Counter of commands dropped at full queue
+        self.coalesced = 0  # Counter of commands merged into batches
+        self.deferred = 0  # Counter of deferred switchings
+        self._queue = queue.Queue(maxsize=capacity)
+        self._desired = {}  # Deferred states of fans by channel names
+        self._switched = {}  # Times of last switchings by channel names
+        self._busy = 0
+        self._idle = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="FanActor", daemon=True)
+
+    def start(self):
+        """Start the actor thread."""
+        self._thread.start()
+
+    def stop(self):
+        """Stop the actor thread."""
+        self._stop.set()
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+
+    def submit(self, name, command, value=None):
+        """Queue a command for a fan channel."""
+        with self._idle:
+            self._busy += 1
+        try:
+            self._queue.put_nowait((name, command, value))
+        except queue.Full:
+            self._done(1)
+            self.dropped += 1
+            logger.warning("Fan command %s dropped, queue is full", command)
+
+    def wait(self, timeout=1.0):
+        """Wait until all queued commands are realized."""
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._busy, timeout)
+
+    def _done(self, count):
+        with self._idle:
+            self._busy -= count
+            if not self._busy:
+                self._idle.notify_all()
+
+    def _collect(self, timeout):
+        """Collect a batch of queued commands."""
+        try:
+            item = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return []
+        batch = [item]
+        deadline = clock.monotonic() + self.window
+        while True:
+            try:
+                remaining = deadline - clock.monotonic()
+                if remaining > 0.0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                return batch
+
+    def _timeout(self, now):
+        """Return time in seconds until the nearest deferred switching."""
+        if not self._desired:
+            return None
+        return max(0.0, min(
+            self._switched.get(name, now) + self.switch_interval - now
+            for name in self._desired))
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._collect(self._timeout(clock.monotonic()))
+            commands = [item for item in batch if item is not None]
+            if commands:
+                self.coalesced += len(commands) - 1
+            try:
+                with state_lock:
+                    self._apply(commands)
+            except Exception as errmsg:
+                logger.error("Fan actor failed: %s", errmsg)
+            self._done(len(commands))
+
+    def _apply(self, commands):
+        now = clock.monotonic()
+        changes = fan_coalesce(commands, self._desired)
+        # Deferred switchings without newer commands
+        for name, state in self._desired.items():
+            changes.setdefault(name, {}).setdefault("state", state)
+        self._desired = {}
+        published = []
+        for name, change in changes.items():
+            allowed = now - self._switched.get(name, -self.switch_interval) \
+                >= self.switch_interval
+            if change.get("state") is not None and not allowed:
+                if change["state"] != fan_state(name):
+                    self._desired[name] = change["state"]
+                    self.deferred += 1
+            switched, updated = fan_apply(name, change, allowed)
+            if switched:
+                self._switched[name] = now
+            if switched or updated:
+                published.append((name, switched, updated))
+        if published:
+            runtime_callback(fan_publish_batch)(published)
+
+
+class PublishSink(object):
+    """Worker publishing status updates to a single sink from its own queue.
 
-def cbBlynk_on_connect():
-    """Process actions when the script is connected to Blynk cloud."""
-    # Update mobile application
-    blynk_publish_fan_status()
-    blynk_publish_fan_limits()
-    logger.debug("Blynk mobile application synchronized")
+    Arguments
+    ---------
+    name : str
+        Name of the sink used for logging and metrics.
+    capacity : int
+        Maximal number of pending updates, further ones are dropped.
+    timeout : float
+        Time period in seconds considered as the maximal duration of
+        a publishing to the sink.
 
+    Notes
+    -----
+    - Updates with the same key are coalesced, so that a pending update is
+      replaced by the newer one at its position in the queue and only the
+      latest value of a state is published.
+    - Updates without a key are events queued in order of submitting.
+    - A failed publishing is logged and counted, and the worker continues
+      with next updates, so that a failing sink does not affect others.
+    - A publishing exceeding the timeout cannot be interrupted, but it is
+      logged and counted, while new updates of states are still coalesced.
 
-###############################################################################
-# Setup functions
-###############################################################################
-def setup_cmdline():
-    """Define command line arguments."""
-    config_file = os.path.splitext(os.path.abspath(__file__))[0] + ".ini"
-    log_folder = "/var/log"
+    """
 
-    parser = argparse.ArgumentParser(
-        description="Tester, version " + __version__
-    )
-    # Position arguments
-    parser.add_argument(
-        "config",
-        type=argparse.FileType("r"),
-        nargs="?",
-        default=config_file,
-        help="Configuration INI file, default: " + config_file
-    )
-    # Options
-    parser.add_argument(
-        "-V", "--version",
-        action="version",
-        version="%(prog)s " + __version__,
-        help="Current version of the script."
-    )
-    parser.add_argument(
-        "-v", "--verbose",
-        choices=["debug", "warning", "info", "error", "critical"],
-        default="warning",
-        help="Level of logging to console."
+    def __init__(self, name, capacity=100, timeout=5.0):
+        self.name = name
+        self.timeout = timeout
+        self.published = 0  # Counter of published updates
+        self.replaced = 0  # Counter of updates replaced by newer ones
+        self.dropped = 0  # Counter of updates dropped at full queue
+        self.failed = 0  # Counter of failed publishings
+        self.timeouts = 0  # Counter of publishings exceeding the timeout
+        self._capacity = capacity
+        self._pending = collections.OrderedDict()
+        self._events = 0  # Sequence number of updates without a key
+        self._busy = False
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread = threading.Thread(
+            target=self._run, name="Sink-" + name, daemon=True)
+
+    def __len__(self):
+        """Return number of pending updates."""
+        return len(self._pending)
+
+    def start(self):
+        """Start the worker thread."""
+        self._thread.start()
+
+    def stop(self):
+        """Stop the worker thread."""
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+
+    def submit(self, key, func, *args):
+        """Queue an update realized by a publishing function.
+
+        Arguments
+        ---------
+        key : str, tuple
+            Key of a state or None for an event.
+        func : function
+            Publishing function called by the worker thread.
+        args : tuple
+            Positional arguments of the publishing function.
+
+        """
+        with self._cond:
+            if key is None:
+                self._events += 1
+                key = (None, self._events)
+            if key in self._pending:
+                self.replaced += 1
+            elif len(self._pending) >= self._capacity:
+                self.dropped += 1
+                logger.warning(
+                    "Update %s for sink %s dropped, queue is full",
+                    func.__name__, self.name)
+                return
+            self._pending[key] = (func, args)
+            self._cond.notify_all()
+
+    def wait(self, timeout=1.0):
+        """Wait until all pending updates are published."""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not self._pending and not self._busy, timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+                self._cond.wait_for(lambda: self._pending or self._stop)
+                if self._stop:
+                    return
+                _, (func, args) = self._pending.popitem(last=False)
+                self._busy = True
+            start = clock.monotonic()
+            try:
+                func(*args)
+                self.published += 1
+            except Exception as errmsg:
+                self.failed += 1
+                logger.error(
+                    "Publishing %s to sink %s failed: %s",
+                    func.__name__, self.name, errmsg)
+                metrics_failure(self.name)
+            duration = clock.monotonic() - start
+            if duration > self.timeout:
+                self.timeouts += 1
+                logger.warning(
+                    "Publishing %s to sink %s took %.3fs over timeout %ss",
+                    func.__name__, self.name, duration, self.timeout)
+
+
+class Telemetry(object):
+    """Encoding of all current values into a single telemetry message.
+
+    Arguments
+    ---------
+    encoding : str
+        Encoding of the message, either compact JSON or fixed binary layout.
+    per_topic : bool
+        Flag about publishing temperature to its own topic as well.
+
+    Notes
+    -----
+    - Values are temperature, fan state, and fan percentages of the primary
+      fan, temperatures and states of fan channels, and timestamps of
+      publishing, of the recent sample, and of the recent fan switching.
+    - The JSON object has keys ``ts``, ``ts_temp``, ``ts_fan``, ``temp``,
+      ``fan``, ``percon``, ``percoff``, and ``channels`` with pairs of
+      temperature and fan state by channel names.
+    - The binary layout is the little-endian header ``TELEMETRY_HEADER``
+      followed by ``TELEMETRY_CHANNEL`` for every fan channel in order of
+      their configuration. Missing temperature is NaN, missing timestamp 0.
+
+    """
+
+    def __init__(self, encoding=TELEMETRY_JSON, per_topic=True):
+        self.encoding = encoding
+        self.per_topic = per_topic
+        self.sampled = None  # Timestamp of the recent sample
+        self.switched = None  # Timestamp of the recent fan switching
+
+    def encode(self, values):
+        """Encode a dictionary of values into a message payload."""
+        if self.encoding == TELEMETRY_JSON:
+            return json.dumps(values, separators=(",", ":"))
+        import struct
+        channels = values["channels"]
+
+        def number(value):
+            return float("nan") if value is None else value
+
+        payload = [struct.pack(
+            TELEMETRY_HEADER,
+            TELEMETRY_VERSION, values["ts"], values["ts_temp"] or 0.0,
+            values["ts_fan"] or 0.0, number(values["temp"]), values["fan"],
+            values["percon"], values["percoff"], len(channels))]
+        for temp, state in channels.values():
+            payload.append(
+                struct.pack(TELEMETRY_CHANNEL, number(temp), state))
+        return b"".join(payload)
+
+    @staticmethod
+    def decode(payload):
+        """Decode a binary message payload into a dictionary.
+
+        Notes
+        -----
+        - Fan channels are decoded as a list in order of their configuration,
+          because the binary layout does not contain their names.
+
+        Raises
+        ------
+        ValueError
+            The payload is truncated or of an unsupported version.
+
+        """
+        import struct
+        try:
+            header = struct.unpack_from(TELEMETRY_HEADER, payload)
+        except struct.error as errmsg:
+            raise ValueError("Invalid telemetry: {}".format(errmsg))
+        if header[0] != TELEMETRY_VERSION:
+            raise ValueError(
+                "Unsupported telemetry version {}".format(header[0]))
+        values = dict(zip(
+            ["ts", "ts_temp", "ts_fan", "temp", "fan", "percon", "percoff"],
+            header[1:-1]))
+        size = struct.calcsize(TELEMETRY_HEADER)
+        size_channel = struct.calcsize(TELEMETRY_CHANNEL)
+        try:
+            values["channels"] = [
+                list(struct.unpack_from(
+                    TELEMETRY_CHANNEL, payload, size + i * size_channel))
+                for i in range(header[-1])
+            ]
+        except struct.error as errmsg:
+            raise ValueError("Invalid telemetry: {}".format(errmsg))
+        return values
+
+
+class CrossingDetector(object):
+    """Debounce of fan limits crossings detected at every sample.
+
+    Arguments
+    ---------
+    debounce : int
+        Number of consecutive samples beyond a limit needed for switching.
+    dwell : float
+        Minimal time period in seconds between switchings of a fan.
+
+    Notes
+    -----
+    - Fans are identified by channel indexes or by ``None`` for the primary
+      fan without channels.
+
+    """
+
+    def __init__(self, debounce=1, dwell=0.0):
+        self.debounce = debounce
+        self.dwell = dwell
+        self.suppressed = 0  # Counter of crossings suppressed by dwell
+        self._pending = {}
+        self._switched = {}
+
+    def confirm(self, candidates, now):
+        """Confirm crossings debounced over samples.
+
+        Arguments
+        ---------
+        candidates : list of tuple
+            Pairs of fan index and fan command for limits crossed at the
+            current sample.
+        now : float
+            Current monotonic time.
+
+        Returns
+        -------
+        list of tuple
+            Pairs of fan index and fan command for fans to switch.
+
+        """
+        confirmed = []
+        pending = {}
+        for index, command in candidates:
+            last_command, count = self._pending.get(index, (command, 0))
+            count = count + 1 if last_command == command else 1
+            if count < self.debounce:
+                pending[index] = (command, count)
+                continue
+            switched = self._switched.get(index)
+            if switched is not None and now - switched < self.dwell:
+                pending[index] = (command, count)
+                self.suppressed += 1
+                continue
+            self._switched[index] = now
+            confirmed.append((index, command))
+        # Samples back within limits reset debouncing
+        self._pending = pending
+        return confirmed
+
+
+class FanPredictor(object):
+    """Forecast of temperature from its trend and throttling statistics.
+
+    Arguments
+    ---------
+    window : float
+        Time period in seconds of the sliding window of samples.
+    horizon : float
+        Time period in seconds of the forecast.
+
+    Notes
+    -----
+    - The slope is estimated by least squares with sums updated
+      incrementally at adding and evicting a sample.
+    - A throttle event is a rise of temperature to the throttle limit.
+      An avoided throttle event is a predictive switch of the fan on, after
+      which the temperature has not reached the throttle limit until the fan
+      has been switched off again.
+
+    """
+
+    def __init__(self, window=30.0, horizon=20.0):
+        self.window = window
+        self.horizon = horizon
+        self.throttle_events = 0  # Counter of throttle events
+        self.throttle_avoided = 0  # Counter of avoided throttle events
+        self.switches = 0  # Counter of predictive switches of fan on
+        self._samples = collections.deque()
+        self._origin = None
+        self._sums = [0.0, 0.0, 0.0, 0.0]  # Sums of t, v, t*t, t*v
+        self._throttling = False
+        self._episode = False  # Flag about running predictive switch
+        self._episode_failed = False
+
+    def _recalculate(self):
+        """Recalculate sums against the oldest sample for precision."""
+        self._origin = self._samples[0][0] if self._samples else None
+        self._sums = [0.0, 0.0, 0.0, 0.0]
+        for now, value in self._samples:
+            self._accumulate(now - self._origin, value, 1)
+
+    def _accumulate(self, t, value, sign):
+        self._sums[0] += sign * t
+        self._sums[1] += sign * value
+        self._sums[2] += sign * t * t
+        self._sums[3] += sign * t * value
+
+    def update(self, now, value):
+        """Add a sample at the current monotonic time."""
+        if value is None:
+            return
+        if self._origin is None:
+            self._origin = now
+        self._samples.append((now, value))
+        self._accumulate(now - self._origin, value, 1)
+        while self._samples[0][0] < now - self.window:
+            old, old_value = self._samples.popleft()
+            self._accumulate(old - self._origin, old_value, -1)
+        if now - self._origin > 100 * self.window:
+            self._recalculate()
+
+    def slope(self):
+        """Return temperature slope in degrees per second."""
+        count = len(self._samples)
+        if count < 2:
+            return 0.0
+        sum_t, sum_v, sum_tt, sum_tv = self._sums
+        denominator = count * sum_tt - sum_t * sum_t
+        if denominator <= 1e-9:
+            return 0.0
+        return (count * sum_tv - sum_t * sum_v) / denominator
+
+    def forecast(self):
+        """Return temperature forecast at the horizon."""
+        if not self._samples:
+            return None
+        return self._samples[-1][1] + self.slope() * self.horizon
+
+    def switched(self):
+        """Register a predictive switch of the fan on."""
+        self.switches += 1
+        self._episode = True
+        self._episode_failed = False
+
+    def account(self, value, fan_on, throttle_limit):
+        """Account throttle events for a sample and current fan state."""
+        if value is None:
+            return
+        if value >= throttle_limit:
+            if not self._throttling:
+                self.throttle_events += 1
+                self._episode_failed = True
+            self._throttling = True
+        else:
+            self._throttling = False
+        if self._episode and not fan_on:
+            if not self._episode_failed:
+                self.throttle_avoided += 1
+            self._episode = False
+
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """Logging handler passing records to a bounded queue without blocking.
+
+    Arguments
+    ---------
+    maxsize : int
+        Capacity of the queue of log records.
+
+    Notes
+    -----
+    - Records are dropped and counted when the queue is full, so that
+      a slow log storage never stalls the calling thread.
+
+    """
+
+    def __init__(self, maxsize):
+        super(LogQueueHandler, self).__init__(queue.Queue(maxsize))
+        self.dropped = 0  # Counter of dropped records
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class Metrics(object):
+    """Latency histograms, call and error counters, and gauges.
+
+    Arguments
+    ---------
+    buckets : tuple of float
+        Upper bounds of histogram buckets in seconds.
+
+    Notes
+    -----
+    - Recording a call is a bisection in buckets and a few increments under
+      a lock, so that metrics can stay on in production.
+    - Gauges are functions evaluated only at rendering metrics.
+
+    """
+
+    BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+               0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    PREFIX = "server_fan"
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self._histograms = {}  # Bucket counts, sum, max, count, errors
+        self._failures = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, duration, error=False):
+        """Record a call duration in seconds and its error flag."""
+        import bisect
+        index = bisect.bisect_left(self.buckets, duration)
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = {
+                    "buckets": [0] * (len(self.buckets) + 1),
+                    "sum": 0.0, "max": 0.0, "count": 0, "errors": 0}
+            histogram["buckets"][index] += 1
+            histogram["sum"] += duration
+            histogram["count"] += 1
+            if duration > histogram["max"]:
+                histogram["max"] = duration
+            if error:
+                histogram["errors"] += 1
+
+    def failure(self, sink):
+        """Count a failed publishing to a sink."""
+        with self._lock:
+            self._failures[sink] = self._failures.get(sink, 0) + 1
+
+    def gauge(self, name, func):
+        """Register a function returning a current value or None."""
+        self._gauges[name] = func
+
+    def quantile(self, name, quantile):
+        """Estimate a quantile of durations by the upper bucket bound."""
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None or not histogram["count"]:
+                return None
+            rank = quantile * histogram["count"]
+            total = 0
+            for index, count in enumerate(histogram["buckets"]):
+                total += count
+                if total >= rank:
+                    break
+        if index < len(self.buckets):
+            return self.buckets[index]
+        return histogram["max"]
+
+    def gauges(self):
+        """Evaluate registered gauges omitting unavailable ones."""
+        values = {}
+        for name, func in self._gauges.items():
+            try:
+                value = func()
+            except Exception:
+                value = None
+            if value is not None:
+                values[name] = value
+        return values
+
+    def summary(self):
+        """Return compact summary of metrics for publishing."""
+        with self._lock:
+            result = {
+                "callbacks": {name: {
+                    "count": histogram["count"],
+                    "errors": histogram["errors"],
+                    "mean": round(histogram["sum"] / histogram["count"], 6),
+                    "max": round(histogram["max"], 6),
+                } for name, histogram in self._histograms.items()},
+                "failures": dict(self._failures),
+            }
+        for name in result["callbacks"]:
+            result["callbacks"][name]["p99"] = self.quantile(name, 0.99)
+        result["gauges"] = self.gauges()
+        return result
+
+    def prometheus(self):
+        """Render metrics in Prometheus text exposition format."""
+        prefix = self.PREFIX
+        lines = [
+            "# HELP {}_callback_seconds Latency of callbacks and sinks."
+            .format(prefix),
+            "# TYPE {}_callback_seconds histogram".format(prefix),
+        ]
+        with self._lock:
+            histograms = {name: dict(histogram, buckets=list(
+                histogram["buckets"]))
+                for name, histogram in self._histograms.items()}
+            failures = dict(self._failures)
+        for name, histogram in sorted(histograms.items()):
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",),
+                                    histogram["buckets"]):
+                total += count
+                lines.append(
+                    '{}_callback_seconds_bucket{{name="{}",le="{}"}} {}'
+                    .format(prefix, name, bound, total))
+            lines.append('{}_callback_seconds_sum{{name="{}"}} {}'.format(
+                prefix, name, histogram["sum"]))
+            lines.append('{}_callback_seconds_count{{name="{}"}} {}'.format(
+                prefix, name, histogram["count"]))
+        lines.append("# HELP {}_callback_errors_total Exceptions raised by "
+                     "callbacks and sinks.".format(prefix))
+        lines.append("# TYPE {}_callback_errors_total counter".format(prefix))
+        for name, histogram in sorted(histograms.items()):
+            lines.append('{}_callback_errors_total{{name="{}"}} {}'.format(
+                prefix, name, histogram["errors"]))
+        lines.append("# HELP {}_publish_failures_total Failed publishing "
+                     "to sinks.".format(prefix))
+        lines.append("# TYPE {}_publish_failures_total counter".format(prefix))
+        for sink, count in sorted(failures.items()):
+            lines.append('{}_publish_failures_total{{sink="{}"}} {}'.format(
+                prefix, sink, count))
+        for name, value in sorted(self.gauges().items()):
+            lines.append("# TYPE {}_{} gauge".format(prefix, name))
+            lines.append("{}_{} {}".format(prefix, name, value))
+        return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(object):
+    """HTTP request handler exposing metrics in Prometheus text format.
+
+    Notes
+    -----
+    - The handler is mixed into the base request handler of the standard
+      library at the setup of the endpoint, so that the HTTP server modules
+      are imported only if the endpoint is configured.
+
+    """
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ["/", "/metrics"]:
+            self.send_error(404)
+            return
+        body = metrics.prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TimerSchedule(object):
+    """Schedule of a periodic timer measuring lateness of its ticks.
+
+    Arguments
+    ---------
+    period : float
+        Period of the timer in seconds.
+    deadline : bool
+        Flag about firing on absolute deadlines ``start + n * period``
+        instead of sleeping the period after the previous tick.
+    overrun : str
+        Policy for deadlines missed due to long running callbacks.
+    size : int
+        Number of recent ticks kept for lateness statistics.
+
+    Notes
+    -----
+    - Lateness of a tick is measured against its absolute deadline in both
+      modes, so that in relative mode it includes accumulated drift.
+    - Overrun policy ``skip`` continues at the nearest future deadline and
+      counts the missed ones as skipped. Overrun policy ``catchup`` fires the
+      missed ticks immediately one after another, but at most
+      ``CATCHUP_MAX`` of them, the rest is skipped.
+
+    """
+
+    CATCHUP_MAX = 10
+
+    def __init__(self, period, deadline=False, overrun=OVERRUN_SKIP,
+                 size=1000):
+        self.period = period
+        self.deadline = deadline
+        self.overrun = overrun
+        self.ticks = 0  # Counter of fired ticks
+        self.skipped = 0  # Counter of skipped deadlines
+        self._lateness = collections.deque(maxlen=size)
+        self._start = None
+        self._index = 1
+        self._next = None
+
+    def start(self, now):
+        """Start the schedule at the current monotonic time."""
+        self._start = now
+        self._index = 1
+        self._next = now + self.period
+
+    def set_period(self, period):
+        """Change the period from the current tick on.
+
+        Notes
+        -----
+        - The deadlines are rebased, so that the next tick comes the new
+          period after the deadline of the current one.
+
+        """
+        if period == self.period:
+            return
+        if self._start is not None:
+            deadline = self._start + self._index * self.period
+            self._start = deadline - self._index * period
+        self.period = period
+
+    def delay(self, now):
+        """Return time in seconds to the next tick."""
+        return max(0.0, self._next - now)
+
+    def fire(self, now):
+        """Register firing a tick at the current monotonic time."""
+        self.ticks += 1
+        self._lateness.append(
+            now - (self._start + self._index * self.period))
+
+    def done(self, now):
+        """Plan the next tick after finishing callbacks of the current one."""
+        self._index += 1
+        if not self.deadline:
+            self._next = now + self.period
+            return
+        missed = int((now - self._start) / self.period) - self._index + 1
+        if missed > 0:
+            if self.overrun == OVERRUN_CATCHUP:
+                missed = max(missed - self.CATCHUP_MAX, 0)
+            self._index += missed
+            self.skipped += missed
+        self._next = self._start + self._index * self.period
+
+    def percentile(self, quantile):
+        """Return the quantile of recent lateness in seconds."""
+        if not self._lateness:
+            return None
+        values = sorted(self._lateness)
+        return round(values[int(quantile * (len(values) - 1))], 6)
+
+
+class DeadlineTimer(object):
+    """Timer thread firing on absolute deadlines of its schedule.
+
+    Arguments
+    ---------
+    name : str
+        Name of the timer thread.
+    definition : dict
+        Definition of the timer with its schedule, callback, and prescalers.
+
+    """
+
+    def __init__(self, name, definition):
+        self.name = name
+        self.definition = definition
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name=name, daemon=True)
+
+    def start(self):
+        """Start the timer thread."""
+        self._thread.start()
+
+    def stop(self):
+        """Stop the timer thread at the nearest tick."""
+        self._stop.set()
+
+    def _run(self):
+        schedule = self.definition["schedule"]
+        schedule.start(clock.monotonic())
+        tick = 0
+        while not self._stop.wait(schedule.delay(clock.monotonic())):
+            schedule.fire(clock.monotonic())
+            tick += 1
+            try:
+                work = timer_execute(self.definition, tick)
+                if work is not None:
+                    work()
+            except Exception as errmsg:
+                logger.error("Timer %s failed: %s", self.name, errmsg)
+            schedule.done(clock.monotonic())
+
+
+class ThingSpeakBulk(object):
+    """Buffer of timestamped ThingSpeak updates flushed as a bulk update.
+
+    Arguments
+    ---------
+    url : str
+        URL of the ThingSpeak bulk update endpoint of a channel.
+    write_api_key : str
+        Write API key of the channel.
+    window : float
+        Minimal time period in seconds between two bulk updates.
+    capacity : int
+        Maximal number of buffered updates.
+    timeout : float
+        Timeout in seconds of a bulk update request.
+
+    Notes
+    -----
+    - Updates in the same second are coalesced into one update unless one
+      of them is protected and both update the same fields. Otherwise the
+      newer one is shifted to the next free second, because ThingSpeak
+      accepts just one update per second, so that no fan state change is
+      lost. Just the colliding update is shifted, the following updates
+      keep their own timestamps.
+    - Updates being sent are detached from the buffer, so that new updates
+      are neither merged into them nor shifted by the overflow meanwhile.
+      New updates are timestamped after them for keeping the order.
+    - Overflow policy: at reaching the capacity the oldest update with data
+      fields only is dropped. Updates with a fan state change or a channel
+      status are never dropped by the overflow, so that they are bounded by
+      doubled capacity just as a safety limit of memory.
+    - Failed bulk update retains all updates for the next window.
+
+    """
+
+    def __init__(self, url, write_api_key, window=15.0, capacity=960,
+                 timeout=10.0):
+        self.url = url
+        self.write_api_key = write_api_key
+        self.window = window
+        self.capacity = capacity
+        self.timeout = timeout
+        self.dropped = 0  # Counter of updates dropped by overflow
+        self._updates = collections.deque()
+        self._lock = threading.Lock()
+        self._flushed = 0.0  # Monotonic time of the recent bulk update
+        self._sent = 0  # Timestamp of the recent update sent or being sent
+
+    def __len__(self):
+        with self._lock:
+            return len(self._updates)
+
+    def add(self, fields, status=None, protected=False, timestamp=None):
+        """Buffer an update of the channel.
+
+        Arguments
+        ---------
+        fields : dict
+            Values of channel fields by field numbers.
+        status : str
+            Channel status.
+        protected : bool
+            Flag about an update which should not be dropped by the overflow,
+            e.g., a fan state change.
+        timestamp : float
+            Time of the update as seconds since the epoch, defaulted to now.
+
+        """
+        timestamp = int(timestamp or clock.time())
+        update = {"field{}".format(field): value
+                  for field, value in fields.items() if value is not None}
+        if status:
+            update["status"] = status
+        protected = protected or "status" in update
+        with self._lock:
+            # Updates are kept after the sent ones and ordered by timestamps
+            timestamp = max(timestamp, self._sent + 1)
+            index = self._index(timestamp)
+            while index and self._updates[index - 1][0] == timestamp:
+                _, other_update, other_protected = self._updates[index - 1]
+                if not (protected or other_protected) \
+                        or not other_update.keys() & update.keys():
+                    other_update.update(update)
+                    self._updates[index - 1] = (
+                        timestamp, other_update, other_protected or protected)
+                    return
+                timestamp += 1
+                if index < len(self._updates) \
+                        and self._updates[index][0] == timestamp:
+                    index += 1
+            if len(self._updates) >= self.capacity and self._overflow():
+                index = self._index(timestamp)
+            self._updates.insert(index, (timestamp, update, protected))
+
+    def _index(self, timestamp):
+        """Find position after buffered updates not newer than a timestamp.
+
+        Returns
+        -------
+        int
+            Index in the buffer for inserting an update with the timestamp.
+
+        """
+        index = len(self._updates)
+        while index and self._updates[index - 1][0] > timestamp:
+            index -= 1
+        return index
+
+    def _overflow(self):
+        """Drop the oldest unprotected update or the oldest one at all.
+
+        Returns
+        -------
+        bool
+            Flag about a dropped update.
+
+        """
+        for i, (_, _, protected) in enumerate(self._updates):
+            if not protected:
+                del self._updates[i]
+                self.dropped += 1
+                return True
+        if len(self._updates) >= 2 * self.capacity:
+            self._updates.popleft()
+            self.dropped += 1
+            return True
+        return False
+
+    def due(self):
+        """Check whether the window for the next bulk update has elapsed."""
+        return clock.monotonic() - self._flushed >= self.window
+
+    def flush(self, force=False):
+        """Send buffered updates as one bulk update.
+
+        Arguments
+        ---------
+        force : bool
+            Flag about flushing regardless of the window.
+
+        Returns
+        -------
+        int
+            Number of sent updates.
+
+        """
+        if not force and not self.due():
+            return 0
+        with self._lock:
+            batch, self._updates = self._updates, collections.deque()
+            if batch:
+                self._sent = max(self._sent, batch[-1][0])
+        if not batch:
+            return 0
+        self._flushed = clock.monotonic()
+        try:
+            self._send(batch)
+        except BaseException:
+            # Failed updates precede the ones added meanwhile
+            with self._lock:
+                batch.extend(self._updates)
+                self._updates = batch
+                while len(self._updates) > self.capacity \
+                        and self._overflow():
+                    pass
+            raise
+        return len(batch)
+
+    def _send(self, batch):
+        """Send a batch of updates in a bulk update request."""
+        updates = []
+        for timestamp, update, _ in batch:
+            update = dict(update)
+            update["created_at"] = time.strftime(
+                "%Y-%m-%d %H:%M:%S +0000", time.gmtime(timestamp))
+            updates.append(update)
+        data = json.dumps({
+            "write_api_key": self.write_api_key,
+            "updates": updates,
+        }).encode("utf-8")
+        import urllib.request
+        request = urllib.request.Request(
+            self.url, data=data,
+            headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+class PublishPolicy(object):
+    """Deadband publish policy deciding about publishing a changed value.
+
+    Arguments
+    ---------
+    deadband : float
+        Absolute change of the value from recently published one, which
+        is needed for publishing.
+    deadband_perc : float
+        Change of the value in percentage of recently published one, which
+        is needed for publishing. The greater of both deadbands applies.
+    interval_min : float
+        Minimal time period in seconds between two publishings.
+    heartbeat : float
+        Maximal time period in seconds without publishing, after which the
+        value is published even if it has not changed.
+
+    Notes
+    -----
+    - Without deadbands every value is published, which is the behaviour
+      without policy.
+    - Suppressed publishings are counted in order to evaluate traffic saved.
+
+    """
+
+    def __init__(self, deadband=0.0, deadband_perc=0.0, interval_min=0.0,
+                 heartbeat=0.0):
+        self.deadband = abs(deadband)
+        self.deadband_perc = abs(deadband_perc)
+        self.interval_min = abs(interval_min)
+        self.heartbeat = abs(heartbeat)
+        self.published = 0  # Counter of allowed publishings
+        self.suppressed = 0  # Counter of suppressed publishings
+        self._value = None
+        self._time = None
+
+    def __str__(self):
+        return "deadband = {}, deadband_perc = {}%, interval_min = {}s, " \
+            "heartbeat = {}s".format(self.deadband, self.deadband_perc,
+                                     self.interval_min, self.heartbeat)
+
+    def check(self, value, now=None):
+        """Decide whether the value should be published and register it.
+
+        Arguments
+        ---------
+        value : float
+            Value intended for publishing.
+        now : float
+            Current monotonic time in seconds, defaulted to the system one.
+
+        Returns
+        -------
+        bool
+            Flag about publishing the value.
+
+        """
+        now = clock.monotonic() if now is None else now
+        if value is None:
+            return False
+        if self._time is not None:
+            elapsed = now - self._time
+            if elapsed < self.interval_min:
+                self.suppressed += 1
+                return False
+            if not (self.heartbeat and elapsed >= self.heartbeat):
+                threshold = max(
+                    self.deadband,
+                    abs(self._value) * self.deadband_perc / 100.0)
+                if threshold and abs(value - self._value) < threshold:
+                    self.suppressed += 1
+                    return False
+        self._value = value
+        self._time = now
+        self.published += 1
+        return True
+
+
+class PublishSpool(object):
+    """Persistent store-and-forward spool of MQTT publishing.
+
+    Arguments
+    ---------
+    path : str
+        Path to the append-only segment file of the spool.
+    capacity : int
+        Maximal number of spooled records.
+    sync_count : int
+        Number of appended records after which the file is synced to disk.
+    sync_period : float
+        Time period in seconds after which appended records are synced
+        to disk regardless of their number.
+    replay_rate : float
+        Number of replayed records per second.
+    replay_topic : str
+        Replaying of records to their original topics or to the spool topic.
+
+    Notes
+    -----
+    - Each record is a line of JSON with original timestamp, configuration
+      option and section of the topic, message, and state flag. Records of
+      topics derived from configured ones contain the full topic as well.
+    - State records, e.g., fan status, are compacted so that only the recent
+      one for a topic is kept, because the older ones are superseded.
+    - At reaching the capacity the spool is compacted first and then the
+      oldest records are dropped, so that the tenth of capacity is free.
+    - Records are removed from the file only after whole replay, so that
+      a crash during replay causes repeated replay rather than a loss.
+    - Appending just writes a record and reports a due sync, so that syncing
+      the file to disk can be done off the publishing thread.
+
+    """
+
+    def __init__(self, path, capacity=10000, sync_count=10, sync_period=5.0,
+                 replay_rate=10.0, replay_topic=REPLAY_ORIGINAL):
+        self.path = path
+        self.capacity = capacity
+        self.sync_count = sync_count
+        self.sync_period = sync_period
+        self.replay_rate = replay_rate
+        self.replay_topic = replay_topic
+        self.replaying = False  # Flag about running replay
+        self.dropped = 0  # Counter of records dropped by overflow
+        self._records = collections.deque()
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        self._synced = clock.monotonic()
+        self._rewrite_due = False  # Flag about records compacted in memory
+        self._load()
+        self._file = open(self.path, "a")
+
+    def __len__(self):
+        with self._lock:
+            return len(self._records)
+
+    def _load(self):
+        """Read records from the segment file left by previous run."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as segment:
+            for line in segment:
+                try:
+                    self._records.append(json.loads(line))
+                except ValueError:
+                    # Partially written record at a crash
+                    continue
+        self._compact()
+
+    def _compact(self, limit=None):
+        """Remove superseded state records and drop the oldest overflow."""
+        limit = limit or self.capacity
+        states = set()
+        records = collections.deque()
+        for record in reversed(self._records):
+            if record["state"]:
+                key = record.get("topic") or record["option"]
+                if key in states:
+                    continue
+                states.add(key)
+            records.appendleft(record)
+        while len(records) > limit:
+            records.popleft()
+            self.dropped += 1
+        self._records = records
+
+    def _rewrite(self):
+        """Replace the segment file with current records atomically."""
+        self._file.close()
+        path_tmp = self.path + ".tmp"
+        with open(path_tmp, "w") as segment:
+            for record in self._records:
+                segment.write(json.dumps(record) + "\n")
+            segment.flush()
+            os.fsync(segment.fileno())
+        os.replace(path_tmp, self.path)
+        self._file = open(self.path, "a")
+        self._unsynced = 0
+        self._synced = clock.monotonic()
+        self._rewrite_due = False
+
+    def append(self, option, section, message, state=False, timestamp=None,
+               topic=None):
+        """Store a publishing into the spool.
+
+        Arguments
+        ---------
+        option : str
+            Configuration option of the topic.
+        section : str
+            Configuration section of the topic.
+        message
+            Published message.
+        state : bool
+            Flag about a state message superseded by newer one.
+        timestamp : float
+            Time of the publishing as seconds since the epoch.
+        topic : str
+            Full name of a topic derived from the configured one.
+
+        Returns
+        -------
+        bool
+            Flag about a due sync of the file.
+
+        """
+        record = {
+            "timestamp": timestamp or clock.time(),
+            "option": option,
+            "section": section,
+            "message": message,
+            "state": state,
+        }
+        if topic:
+            record["topic"] = topic
+        with self._lock:
+            self._records.append(record)
+            if len(self._records) > self.capacity:
+                # Make a room for further records to amortize rewriting
+                self._compact(self.capacity - self.capacity // 10)
+                self._rewrite_due = True
+                return True
+            self._file.write(json.dumps(record) + "\n")
+            self._unsynced += 1
+            return self._rewrite_due or self._unsynced >= self.sync_count \
+                or clock.monotonic() - self._synced >= self.sync_period
+
+    def sync(self):
+        """Flush appended records to disk.
+
+        Notes
+        -----
+        - Records compacted at overflow are rewritten into the file.
+        - Appended records are synced by a duplicate of the file descriptor
+          outside of the lock, so that appending is not blocked meanwhile.
+
+        """
+        with self._lock:
+            if self._rewrite_due:
+                self._rewrite()
+                return
+            if not self._unsynced:
+                return
+            self._file.flush()
+            fileno = os.dup(self._file.fileno())
+            self._unsynced = 0
+            self._synced = clock.monotonic()
+        try:
+            os.fsync(fileno)
+        finally:
+            os.close(fileno)
+
+    def compact(self):
+        """Remove superseded state records before replay."""
+        with self._lock:
+            self._compact()
+
+    def peek(self, count):
+        """Return up to count the oldest records for replay."""
+        with self._lock:
+            return [self._records[i]
+                    for i in range(min(count, len(self._records)))]
+
+    def remove(self, count):
+        """Remove replayed oldest records and truncate the file when empty."""
+        with self._lock:
+            for _ in range(min(count, len(self._records))):
+                self._records.popleft()
+            if not self._records:
+                self._rewrite()
+
+    def close(self):
+        """Sync and close the spool file keeping not replayed records."""
+        with self._lock:
+            self._compact()
+            self._rewrite()
+            self._file.close()
+
+
+class HistoryBuffer(object):
+    """Fixed-size ring buffer of temperature samples and fan events.
+
+    Arguments
+    ---------
+    path : str
+        Path to the file mapped into memory, so that the history survives
+        restarts. Without it the buffer is kept in anonymous memory.
+    capacity : int
+        Maximal number of records, the oldest ones are overwritten.
+    chunk : int
+        Default maximal number of records in a chunk of a query.
+
+    Notes
+    -----
+    - The buffer is the header ``HISTORY_HEADER`` followed by records
+      ``HISTORY_RECORD`` with timestamp, raw and filtered temperature, event,
+      and fan channel index. Missing temperature is NaN.
+    - A file with a different layout or capacity is initialized anew.
+    - Records are expected in order of their timestamps, so that a time
+      range is located by bisection.
+
+    """
+
+    def __init__(self, path=None, capacity=10000, chunk=100):
+        import mmap
+        import struct
+        self.path = path
+        self.capacity = capacity
+        self.chunk = chunk
+        self._lock = threading.Lock()
+        self._header = struct.Struct(HISTORY_HEADER)
+        self._record = struct.Struct(HISTORY_RECORD)
+        size = self._header.size + capacity * self._record.size
+        if path is None:
+            self._fd = None
+            self._buffer = mmap.mmap(-1, size)
+        else:
+            self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            if os.fstat(self._fd).st_size != size:
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, size)
+            self._buffer = mmap.mmap(self._fd, size)
+        magic, capacity, self._head, self._count = \
+            self._header.unpack_from(self._buffer)
+        if magic != HISTORY_MAGIC or capacity != self.capacity \
+                or self._head >= capacity or self._count > capacity:
+            self._head = self._count = 0
+            self._write_header()
+        self._appended = self._count  # Sequence number of the next record
+
+    def __len__(self):
+        return self._count
+
+    def _write_header(self):
+        self._header.pack_into(
+            self._buffer, 0, HISTORY_MAGIC, self.capacity, self._head,
+            self._count)
+
+    def _offset(self, index):
+        """Return offset of a record by its index from the oldest one."""
+        position = (self._head - self._count + index) % self.capacity
+        return self._header.size + position * self._record.size
+
+    def _find(self, timestamp):
+        """Return index of the oldest record not older than a timestamp."""
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._record.unpack_from(
+                    self._buffer, self._offset(middle))[0] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def append(self, timestamp, raw=None, filtered=None, event=HISTORY_SAMPLE,
+               channel=0):
+        """Append a record and overwrite the oldest one at full buffer."""
+        nan = float("nan")
+        with self._lock:
+            self._record.pack_into(
+                self._buffer,
+                self._header.size + self._head * self._record.size,
+                timestamp, nan if raw is None else raw,
+                nan if filtered is None else filtered, event, channel)
+            self._head = (self._head + 1) % self.capacity
+            self._count = min(self._count + 1, self.capacity)
+            self._appended += 1
+            self._write_header()
+
+    def query(self, start=None, end=None, decimate=1, chunk=None):
+        """Generate records of a time range in chunks.
+
+        Arguments
+        ---------
+        start : float
+            Timestamp of the oldest record, None for the oldest one at all.
+        end : float
+            Timestamp of the newest record, None for the newest one at all.
+        decimate : int
+            Only every n-th sample is provided, fan events are provided
+            always.
+        chunk : int
+            Maximal number of records in a chunk, None for the default one.
+
+        Yields
+        ------
+        list of tuple
+            Chunk of records in order of their timestamps. Temperatures are
+            rounded to thousandths, missing ones are None.
+
+        Notes
+        -----
+        - Records are read under the lock one chunk at a time, so that
+          appending is not blocked during the whole query.
+        - Records overwritten during a long query are skipped.
+
+        """
+        chunk = chunk or self.chunk
+        with self._lock:
+            index = 0 if start is None else self._find(start)
+            sequence = self._appended - self._count + index
+        samples = 0
+        while True:
+            records = []
+            with self._lock:
+                # Skip records overwritten since previous chunk
+                oldest = self._appended - self._count
+                index = max(sequence - oldest, 0)
+                while index < self._count and len(records) < chunk:
+                    record = self._record.unpack_from(
+                        self._buffer, self._offset(index))
+                    index += 1
+                    if end is not None and record[0] > end:
+                        index = self._count
+                        break
+                    if record[3] == HISTORY_SAMPLE:
+                        samples += 1
+                        if (samples - 1) % decimate:
+                            continue
+                    records.append((record[0],) + tuple(
+                        None if value != value else round(value, 3)
+                        for value in record[1:3]) + record[3:])
+                finished = index >= self._count
+                sequence = oldest + index
+            if records:
+                yield records
+            if finished:
+                return
+
+    def flush(self):
+        """Write the mapped file to disk."""
+        if self._fd is not None:
+            self._buffer.flush()
+
+    def close(self):
+        """Flush and unmap the buffer."""
+        self.flush()
+        self._buffer.close()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class TimeSeriesStore(object):
+    """Local time-series store of temperature and fan history in SQLite.
+
+    Arguments
+    ---------
+    path : str
+        Path to the SQLite database file.
+    retention_raw : float
+        Time period in seconds for keeping raw samples and fan events.
+    retention_minute : float
+        Time period in seconds for keeping 1-minute rollups. 1-hour rollups
+        are kept forever.
+    batch : int
+        Number of records after which they are committed.
+    commit_period : float
+        Time period in seconds after which records are committed regardless
+        of their number.
+    capacity : int
+        Maximal number of records waiting for the writer thread, further ones
+        are dropped.
+
+    Notes
+    -----
+    - Records are written by a single writer thread in batched transactions
+      of a database in WAL mode with normal synchronization, so that the
+      disk is written rarely and sequentially, which spares SD cards.
+    - Rollups of temperature minimum, maximum, sum, count, and seconds with
+      the primary fan on are aggregated incrementally in memory and merged
+      into their rows at every commit, so that a restart loses nothing but
+      not committed records. Fan on time is accounted up to the recent
+      record.
+    - Queries open their own connection, so that they run concurrently with
+      the writer thread.
+
+    """
+
+    RESOLUTIONS = (60, 3600)  # Resolutions of rollups in seconds
+    GAP = 3600.0  # Longest interval in seconds considered as continuous
+
+    def __init__(self, path, retention_raw=7 * 86400.0,
+                 retention_minute=90 * 86400.0, batch=60,
+                 commit_period=60.0, capacity=10000):
+        self.path = path
+        self.retention_raw = retention_raw
+        self.retention_minute = retention_minute
+        self.batch = batch
+        self.commit_period = commit_period
+        self.commits = 0  # Counter of committed transactions
+        self.dropped = 0  # Counter of records dropped at full queue
+        self._queue = queue.Queue(maxsize=capacity)
+        self._samples = []
+        self._events = []
+        self._rollups = {}  # Aggregates by resolution and bucket start
+        self._fan = None  # Pair of timestamp and state of the primary fan
+        self._purged = 0.0
+        self._connection = self._connect()
+        self._connection.executescript(STORE_SCHEMA)
+        self._thread = threading.Thread(
+            target=self._run, name="Store", daemon=True)
+
+    def _connect(self):
+        import sqlite3
+        connection = sqlite3.connect(
+            self.path, timeout=10.0, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def start(self):
+        """Start the writer thread."""
+        self._thread.start()
+
+    def stop(self):
+        """Stop the writer thread after committing queued records."""
+        self._queue.put(None)
+        self._thread.join(timeout=10.0)
+
+    def _put(self, record):
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def record_sample(self, timestamp, raw, temp, fan):
+        """Queue a temperature sample with current state of primary fan."""
+        self._put((HISTORY_SAMPLE, timestamp, raw, temp, fan))
+
+    def record_event(self, timestamp, channel, state):
+        """Queue a switching of a fan channel."""
+        event = HISTORY_FAN_ON if state else HISTORY_FAN_OFF
+        self._put((event, timestamp, channel, None, state))
+
+    def _aggregate(self, timestamp, temp=None):
+        """Accumulate fan on time up to a timestamp and a temperature.
+
+        Notes
+        -----
+        - Fan on time is not accumulated over a gap longer than ``GAP``,
+          e.g., at setting the system clock, because the state in the gap
+          is unknown.
+
+        """
+        for resolution in self.RESOLUTIONS:
+            if self._fan is not None and self._fan[1] \
+                    and timestamp - self._fan[0] <= self.GAP:
+                start = self._fan[0]
+                while start < timestamp:
+                    bucket = start - start % resolution
+                    end = min(timestamp, bucket + resolution)
+                    self._rollup(resolution, bucket)[4] += end - start
+                    start = end
+            if temp is not None:
+                rollup = self._rollup(
+                    resolution, timestamp - timestamp % resolution)
+                rollup[0] += 1
+                rollup[1] = min(rollup[1], temp)
+                rollup[2] = max(rollup[2], temp)
+                rollup[3] += temp
+
+    def _rollup(self, resolution, bucket):
+        key = (resolution, int(bucket))
+        if key not in self._rollups:
+            self._rollups[key] = [0, float("inf"), float("-inf"), 0.0, 0.0]
+        return self._rollups[key]
+
+    def _track(self, timestamp, state):
+        """Set state of the primary fan accumulated from a timestamp on."""
+        if self._fan is not None:
+            timestamp = max(timestamp, self._fan[0])
+        self._fan = (timestamp, bool(state))
+
+    def _process(self, record):
+        event, timestamp, value, temp, state = record
+        if event == HISTORY_SAMPLE:
+            self._samples.append((timestamp, value, temp))
+            self._aggregate(timestamp, temp)
+            self._track(timestamp, state)
+        else:
+            self._events.append((timestamp, value, int(state)))
+            # Duty cycle is aggregated for the primary fan only
+            if value == 0:
+                self._aggregate(timestamp)
+                self._track(timestamp, state)
+
+    def _commit(self):
+        """Write batched records and merge rollups in one transaction."""
+        rollups = [
+            (resolution, bucket, count,
+             None if count == 0 else low, None if count == 0 else high,
+             total, fan_on)
+            for (resolution, bucket), (count, low, high, total, fan_on)
+            in self._rollups.items()]
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO samples VALUES (?, ?, ?)",
+                self._samples)
+            self._connection.executemany(
+                "INSERT INTO events VALUES (?, ?, ?)", self._events)
+            self._connection.executemany(STORE_MERGE_ROLLUP, rollups)
+            now = clock.time()
+            if now - self._purged >= 3600.0:
+                self._purge(now)
+        self.commits += 1
+        self._samples = []
+        self._events = []
+        self._rollups = {}
+
+    def _purge(self, now):
+        """Delete records older than their retention."""
+        self._purged = now
+        limit = now - self.retention_raw
+        self._connection.execute("DELETE FROM samples WHERE ts < ?", (limit,))
+        self._connection.execute("DELETE FROM events WHERE ts < ?", (limit,))
+        self._connection.execute(
+            "DELETE FROM rollups WHERE resolution = ? AND bucket < ?",
+            (self.RESOLUTIONS[0], now - self.retention_minute))
+
+    def _run(self):
+        import sqlite3
+        deadline = clock.monotonic() + self.commit_period
+        running = True
+        while running:
+            try:
+                record = self._queue.get(
+                    timeout=max(deadline - clock.monotonic(), 0.0))
+                if record is None:
+                    running = False
+                else:
+                    self._process(record)
+            except queue.Empty:
+                pass
+            pending = len(self._samples) + len(self._events)
+            if not running or pending >= self.batch \
+                    or clock.monotonic() >= deadline:
+                try:
+                    if pending or self._rollups:
+                        self._commit()
+                except sqlite3.Error as errmsg:
+                    logger.error("Commit to store failed: %s", errmsg)
+                    metrics_failure("store")
+                deadline = clock.monotonic() + self.commit_period
+        self._connection.close()
+
+    def query(self, start=None, end=None, resolution=0, chunk=100):
+        """Generate records of a time range in chunks.
+
+        Arguments
+        ---------
+        start : float
+            Timestamp of the oldest record, None for the oldest one at all.
+        end : float
+            Timestamp of the newest record, None for the newest one at all.
+        resolution : int
+            Resolution of rollups in seconds, zero for raw samples.
+        chunk : int
+            Maximal number of records in a chunk.
+
+        Yields
+        ------
+        list of tuple
+            Chunk of raw samples with timestamp, raw and filtered
+            temperature, or of rollups with start of a bucket, minimal,
+            maximal, and mean temperature, and duty cycle of the primary fan.
+
+        Raises
+        ------
+        ValueError
+            Unknown resolution.
+
+        """
+        start = float("-inf") if start is None else start
+        end = float("inf") if end is None else end
+        if resolution == 0:
+            sql = STORE_QUERY_SAMPLES
+            parameters = (start, end)
+        elif resolution in self.RESOLUTIONS:
+            sql = STORE_QUERY_ROLLUPS
+            parameters = (resolution, resolution, start, end)
+        else:
+            raise ValueError("Unknown resolution {}".format(resolution))
+        connection = self._connect()
+        try:
+            cursor = connection.execute(sql, parameters)
+            while True:
+                rows = cursor.fetchmany(chunk)
+                if not rows:
+                    return
+                yield rows
+        finally:
+            connection.close()
+
+
+class FleetNode(object):
+    """Compact state of a node of the fleet.
+
+    Arguments
+    ---------
+    value : float
+        The first temperature received from the node.
+
+    Notes
+    -----
+    - The rolling mean and variance are exponentially weighted, so that
+      they need constant memory regardless of the number of messages.
+    - Minimal and maximal temperatures are tracked since the recent
+      publishing of fleet aggregates.
+
+    """
+
+    __slots__ = (
+        "value", "seen", "count", "mean", "variance", "low", "high", "stale")
+
+    def __init__(self, value):
+        self.value = value  # Recent temperature
+        self.seen = None  # Timestamp of the recent message
+        self.count = 1  # Number of received temperatures
+        self.mean = value  # Rolling mean of temperature
+        self.variance = 0.0  # Rolling variance of temperature
+        self.low = value  # Minimal temperature since publishing
+        self.high = value  # Maximal temperature since publishing
+        self.stale = False  # Flag about reported stale node
+
+    def update(self, value, factor):
+        """Register a received temperature."""
+        delta = value - self.mean
+        self.mean += factor * delta
+        self.variance = (1.0 - factor) * (self.variance + factor * delta ** 2)
+        self.value = value
+        self.count += 1
+        if value < self.low:
+            self.low = value
+        elif value > self.high:
+            self.high = value
+
+
+class Fleet(object):
+    """Aggregation of temperatures received from nodes of the fleet.
+
+    Arguments
+    ---------
+    topic_filter : str
+        MQTT topic filter of data of all nodes, the level of its first
+        wildcard ``+`` is the name of a node, e.g., ``+/server/data/#``.
+    level_temp : str
+        Last topic level of messages with temperature as a number.
+    level_telemetry : str
+        Last topic level of messages with batched telemetry.
+    capacity : int
+        Maximal number of tracked nodes.
+    stale : float
+        Time period in seconds without a message after which a node is
+        reported as stale.
+    expire : float
+        Time period in seconds without a message after which a node is
+        forgotten.
+    factor : float
+        Smoothing factor of rolling mean and deviation of temperature.
+
+    Notes
+    -----
+    - Nodes are kept in order of their recent messages, so that stale and
+      expired nodes are at the beginning, and at full capacity the node
+      silent for the longest time is evicted in favor of a new one.
+    - Messages are processed under a lock without any configuration lookup,
+      other topics are ignored.
+
+    """
+
+    def __init__(self, topic_filter, level_temp, level_telemetry,
+                 capacity=1000, stale=60.0, expire=3600.0, factor=0.1):
+        self.level_temp = level_temp
+        self.level_telemetry = level_telemetry
+        self.capacity = capacity
+        self.stale = stale
+        self.expire = expire
+        self.factor = factor
+        self.messages = 0  # Number of aggregated messages
+        self.invalid = 0  # Number of messages without valid temperature
+        self.evicted = 0  # Number of nodes evicted at full capacity
+        self.expired = 0  # Number of forgotten nodes
+        self._nodes = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._published = (clock.time(), 0)  # Time and messages of publishing
+        self.set_filter(topic_filter)
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def set_filter(self, topic_filter):
+        """Set the level of node names from a topic filter."""
+        levels = topic_filter.split("/")
+        if "+" not in levels:
+            raise ValueError(
+                "Topic filter {} without a node level".format(topic_filter))
+        self.topic_filter = topic_filter
+        self._level = levels.index("+")
+
+    def _temperature(self, level, payload):
+        """Return temperature from a message payload or None."""
+        if level == self.level_temp:
+            return float(payload)
+        if level != self.level_telemetry:
+            return None
+        if isinstance(payload, str) or payload[:1] == b"{":
+            return json.loads(payload)["temp"]
+        return Telemetry.decode(payload)["temp"]
+
+    def update(self, topic, payload):
+        """Register a message received from a node.
+
+        Arguments
+        ---------
+        topic : str
+            Topic of the message.
+        payload : bytes or str
+            Payload of the message.
+
+        """
+        levels = topic.split("/")
+        try:
+            value = self._temperature(levels[-1], payload)
+            if value is None:
+                return
+            value = float(value)
+            name = levels[self._level]
+        except (ValueError, TypeError, KeyError, IndexError):
+            value = None
+        now = clock.time()
+        with self._lock:
+            if value is None or value != value:
+                self.invalid += 1
+                return
+            self.messages += 1
+            node = self._nodes.get(name)
+            if node is None:
+                if len(self._nodes) >= self.capacity:
+                    self._nodes.popitem(last=False)
+                    self.evicted += 1
+                node = self._nodes[name] = FleetNode(value)
+            else:
+                self._nodes.move_to_end(name)
+                node.update(value, self.factor)
+            node.seen = now
+
+    def aggregate(self, now=None):
+        """Calculate fleet aggregates and changes of node states.
+
+        Arguments
+        ---------
+        now : float
+            Current timestamp, default the current time.
+
+        Returns
+        -------
+        tuple
+            Dictionary of aggregates and dictionary with lists of nodes
+            which became stale or alive again since the previous call, or
+            None without changes.
+
+        Notes
+        -----
+        - Aggregates contain numbers of nodes and messages, temperature
+          statistics of alive nodes, and list ``[temperature, mean,
+          deviation, minimum, maximum, age]`` for every node.
+        - Minimal and maximal temperatures of nodes start again from their
+          recent temperatures.
+
+        """
+        if now is None:
+            now = clock.time()
+        stale = []
+        alive = []
+        temps = []
+        nodes = {}
+        with self._lock:
+            while self._nodes:
+                name, node = next(iter(self._nodes.items()))
+                if now - node.seen <= self.expire:
+                    break
+                del self._nodes[name]
+                self.expired += 1
+            for name, node in self._nodes.items():
+                is_stale = now - node.seen > self.stale
+                if is_stale != node.stale:
+                    node.stale = is_stale
+                    (stale if is_stale else alive).append(name)
+                if not is_stale:
+                    temps.append((node.value, name))
+                nodes[name] = [
+                    node.value, round(node.mean, 3),
+                    round(node.variance ** 0.5, 3), node.low, node.high,
+                    round(now - node.seen, 1)]
+                node.low = node.high = node.value
+            published, messages = self._published
+            self._published = (now, self.messages)
+            messages = self.messages - messages
+            aggregates = {
+                "ts": round(now, 3),
+                "nodes": len(nodes),
+                "alive": len(temps),
+                "stale": sorted(name for name, node in self._nodes.items()
+                                if node.stale),
+                "messages": messages,
+                "rate": round(messages / max(now - published, 1e-3), 1),
+                "invalid": self.invalid,
+                "evicted": self.evicted,
+                "expired": self.expired,
+                "temp": None,
+                "node": nodes,
+            }
+        if temps:
+            aggregates["temp"] = {
+                "min": min(temps)[0],
+                "max": max(temps)[0],
+                "mean": round(sum(temp for temp, _ in temps) / len(temps), 3),
+                "hottest": max(temps)[1],
+            }
+        changes = None
+        if stale or alive:
+            changes = {"ts": round(now, 3), "stale": stale, "alive": alive}
+        return aggregates, changes
+
+
+###############################################################################
+# General actions
+###############################################################################
+def action_fan(command, value=None):
+    """Perform command for the fan.
+
+    Arguments
+    ---------
+    command : str
+        Action name to be realized.
+    value
+        Any value that the action should be realized with.
+
+    Notes
+    -----
+    - With the fan actor the command is just queued and realized by the
+      actor thread along with other queued commands, otherwise right away.
+
+    """
+    action_fan_channel(None, command, value)
+
+
+@instrumented
+def action_fan_channel(name, command, value=None):
+    """Perform command for a fan channel.
+
+    Arguments
+    ---------
+    name : str
+        Name of the fan channel or None for the primary fan.
+    command : str
+        Action name to be realized.
+    value
+        Any value that the action should be realized with.
+
+    """
+    if fan_actor is not None:
+        fan_actor.submit(name, command, value)
+        return
+    changes = fan_coalesce([(name, command, value)], {})
+    for name, change in changes.items():
+        fan_publish(name, *fan_apply(name, change))
+
+
+def fan_state(name):
+    """Return flag about a fan channel switched on."""
+    if name is None:
+        return bool(pins.state(pi.PIN_FAN))
+    return bool(pins.state(fan_channels.pins[fan_channels.index(name)]))
+
+
+def fan_coalesce(commands, desired):
+    """Coalesce fan commands into a change per fan channel.
+
+    Arguments
+    ---------
+    commands : list of tuple
+        Triplets of fan channel name, command, and value in order of
+        receiving them.
+    desired : dict
+        Already desired, but not yet realized states of fan channels.
+
+    Returns
+    -------
+    dict
+        Changes of fan channels with desired state under key ``state``,
+        and percentages under keys ``reset``, ``perc_on``, ``perc_off``.
+
+    Notes
+    -----
+    - Switching commands result in a single desired state, e.g., a pair of
+      toggles cancels out.
+    - The last percentage wins, a reset drops percentages received before
+      it.
+
+    """
+    changes = {}
+    for name, command, value in commands:
+        if name is not None and (
+                fan_channels is None or name not in fan_channels.names):
+            logger.warning("Unknown fan %s for command %s", name, command)
+            continue
+        change = changes.setdefault(name, {})
+        if command in [CMD_FAN_ON, CMD_FAN_OFF, CMD_FAN_TOGGLE]:
+            state = change.get("state", desired.get(name))
+            if state is None:
+                state = fan_state(name)
+            if command == CMD_FAN_TOGGLE:
+                state = not state
+            else:
+                state = command == CMD_FAN_ON
+            change["state"] = state
+        elif command in [CMD_FAN_PERCON, CMD_FAN_PERCOFF]:
+            try:
+                value = abs(float(value))
+            except (TypeError, ValueError):
+                logger.error("Fan command %s failed", command)
+                continue
+            key = "perc_on" if command == CMD_FAN_PERCON else "perc_off"
+            change[key] = value
+        elif command == RESET:
+            change.pop("perc_on", None)
+            change.pop("perc_off", None)
+            change["reset"] = True
+    return dict((name, change) for name, change in changes.items() if change)
+
+
+def fan_apply(name, change, switch_allowed=True):
+    """Realize a coalesced change of a fan channel.
+
+    Arguments
+    ---------
+    name : str
+        Name of the fan channel or None for the primary fan.
+    change : dict
+        Change of the fan channel from coalescing.
+    switch_allowed : bool
+        Flag about allowed switching of the fan with respect to the minimal
+        switching interval.
+
+    Returns
+    -------
+    tuple of bool
+        Flags about switched fan and about updated percentages.
+
+    """
+    switched = False
+    updated = False
+    index = None if name is None else fan_channels.index(name)
+    # Percentages
+    if "reset" in change or "perc_on" in change or "perc_off" in change:
+        try:
+            if name is None:
+                perc_on, perc_off = pi.FAN_PERC_ON_CUR, pi.FAN_PERC_OFF_CUR
+                if change.get("reset"):
+                    perc_on, perc_off = pi.FAN_PERC_ON_DEF, pi.FAN_PERC_OFF_DEF
+                setup_trigger_fan(
+                    fan_perc_on=change.get("perc_on", perc_on),
+                    fan_perc_off=change.get("perc_off", perc_off))
+                logger.info(
+                    "Updated fan percentages ON=%s%%, OFF=%s%%",
+                    pi.FAN_PERC_ON_CUR, pi.FAN_PERC_OFF_CUR)
+            else:
+                perc_on = fan_channels.perc_on[index]
+                perc_off = fan_channels.perc_off[index]
+                if change.get("reset"):
+                    perc_on = fan_channels.perc_on_def[index]
+                    perc_off = fan_channels.perc_off_def[index]
+                setup_fan_channel_limits(
+                    index,
+                    perc_on=change.get("perc_on", perc_on),
+                    perc_off=change.get("perc_off", perc_off))
+                logger.info(
+                    "Updated fan %s percentages ON=%s%%, OFF=%s%%", name,
+                    fan_channels.perc_on[index], fan_channels.perc_off[index])
+            updated = True
+        except Exception as errmsg:
+            logger.error("Fan %s percentages failed: %s", name, errmsg)
+    # Switching
+    state = change.get("state")
+    if state is not None and switch_allowed:
+        pin = pi.PIN_FAN if name is None else fan_channels.pins[index]
+        command = CMD_FAN_ON if state else CMD_FAN_OFF
+        try:
+            # Suppress useless command changing pin to the state it has
+            if state != bool(pins.state(pin)):
+                pins.write(pin, state)
+                switched = True
+                timestamp = clock.time()
+                if telemetry is not None:
+                    telemetry.switched = round(timestamp, 3)
+                if history is not None:
+                    history.append(
+                        timestamp,
+                        event=HISTORY_FAN_ON if state else HISTORY_FAN_OFF,
+                        channel=index or 0)
+                if store is not None:
+                    store.record_event(timestamp, index or 0, state)
+            if switched and name is None:
+                logger.info("Fan set to %s", command)
+            elif switched:
+                logger.info("Fan %s set to %s", name, command)
+        except Exception as errmsg:
+            logger.error(
+                "Fan %s command %s failed: %s.", name, command, errmsg)
+    return switched, updated
+
+
+def fan_publish_batch(published):
+    """Publish state of fan channels changed by a batch of commands."""
+    for name, switched, updated in published:
+        fan_publish(name, switched, updated)
+
+
+def fan_publish(name, switched, updated):
+    """Publish state of a fan channel after realizing its change.
+
+    Notes
+    -----
+    - With sink workers the updates are just queued for them, so that a slow
+      cloud service does not block the thread realizing fan commands.
+    - MQTT and Blynk get just the latest fan state, while ThingSpeak gets
+      every fan switching as an event with the fan state captured now, so
+      that rapid switchings are all recorded in the channel.
+    - The function ``fan_publisher`` publishes instead of sinks if it is
+      set, e.g., in simulations without cloud services.
+
+    """
+    if fan_publisher is not None:
+        fan_publisher(name, switched, updated)
+        return
+    if name is None:
+        if switched:
+            sink_publish("mqtt", "fan_status", mqtt_publish_fan_status)
+            sink_publish(
+                "thingspeak", None,
+                thingspeak_publish, *thingspeak_fields(True))
+            sink_publish("blynk", "fan_status", blynk_publish_fan_status)
+        if updated:
+            sink_publish("mqtt", "fan_limits", mqtt_publish_fan_limits)
+            sink_publish("blynk", "fan_limits", blynk_publish_fan_limits)
+        return
+    index = fan_channels.index(name)
+    if switched:
+        sink_publish(
+            "mqtt", ("fan_status", name),
+            mqtt_publish_fan_channel_status, index)
+    if updated:
+        sink_publish(
+            "mqtt", ("fan_limits", name),
+            mqtt_publish_fan_channel_limits, index)
+
+
+def reconcile_pins():
+    """Reconcile the shadow register of pins with the hardware.
+
+    Notes
+    -----
+    - Fans switched externally, i.e., not by this script, are logged and
+      their status is published, so that all platforms show real states.
+
+    """
+    for pin in pins.reconcile():
+        state = CMD_FAN_ON if pins.state(pin) else CMD_FAN_OFF
+        if pin == pi.PIN_FAN:
+            name = None
+        elif fan_channels is not None and pin in fan_channels.pins:
+            name = fan_channels.names[fan_channels.pins.index(pin)]
+        else:
+            logger.warning("Pin %s changed externally to %s", pin, state)
+            continue
+        logger.warning(
+            "Fan %s changed externally to %s", name or pin, state)
+        fan_publish(name, True, False)
+
+
+def evaluate_crossing(value):
+    """Switch fans by limits crossed at the current sample.
+
+    Arguments
+    ---------
+    value : float
+        Current filtered temperature of the primary fan.
+
+    Notes
+    -----
+    - Limits are precomputed absolute temperatures, so that the evaluation
+      is just a comparison in the measurement path.
+
+    """
+    now = clock.monotonic()
+    if fan_channels is None:
+        if value is None:
+            return
+        state = pins.state(pi.PIN_FAN)
+        if not state and value >= pi.FAN_TEMP_ON_CUR:
+            candidates = [(None, CMD_FAN_ON)]
+        elif state and value <= pi.FAN_TEMP_OFF_CUR:
+            candidates = [(None, CMD_FAN_OFF)]
+        else:
+            candidates = []
+        for index, command in crossing.confirm(candidates, now):
+            action_fan(command)
+        return
+    temps = [fan_filter.result() for fan_filter in fan_channels.filters]
+    states = [pins.state(pin) for pin in fan_channels.pins]
+    candidates = fan_channels.evaluate(temps, states)
+    for index, command in crossing.confirm(candidates, now):
+        action_fan_channel(fan_channels.names[index], command)
+
+
+def adapt_sampling(value):
+    """Adapt measurement period to distance of temperature to fan limits.
+
+    Arguments
+    ---------
+    value : float
+        Current filtered temperature of the primary fan.
+
+    """
+    if pins.state(pi.PIN_FAN):
+        distance = abs(value - pi.FAN_TEMP_OFF_CUR)
+    else:
+        distance = abs(value - pi.FAN_TEMP_ON_CUR)
+    if fan_channels is not None:
+        for fan_filter, pin, limit_on, limit_off in zip(
+                fan_channels.filters, fan_channels.pins,
+                fan_channels.limits_on, fan_channels.limits_off):
+            temp = fan_filter.result()
+            if temp is None:
+                continue
+            limit = limit_off if pins.state(pin) else limit_on
+            distance = min(distance, abs(temp - limit))
+    period = sampling.period
+    if sampling.update(clock.monotonic(), value, distance) == period:
+        return
+    factor = sampling.factor(filter_factor())
+    for zone_filter in set([filter] + list(filters.values())):
+        if isinstance(zone_filter, modFilter.StatFilterExponential):
+            zone_filter.factor = factor
+    timers["Timer_temp"]["schedule"].set_period(sampling.period)
+    logger.debug(
+        "Measurement period %ss, filter factor %s", sampling.period, factor)
+
+
+def predict_fan(value):
+    """Switch the fan on by temperature trend before crossing its limit.
+
+    Arguments
+    ---------
+    value : float
+        Current filtered temperature.
+
+    Notes
+    -----
+    - The trend and throttle events are tracked in both control modes, so
+      that hysteresis and predictive control can be compared.
+    - Switching the fan off is left to the hysteresis triggers.
+
+    """
+    fan_on = pins.state(pi.PIN_FAN)
+    predictor.update(clock.monotonic(), value)
+    predictor.account(value, fan_on, pi.FAN_TEMP_THROTTLE)
+    if pi.FAN_CONTROL != CONTROL_PREDICTIVE or fan_on or value is None:
+        return
+    if value < pi.FAN_TEMP_ON_CUR \
+            and predictor.forecast() >= pi.FAN_TEMP_ON_CUR:
+        predictor.switched()
+        logger.info(
+            "Predicted temperature %s°C in %ss",
+            round(predictor.forecast(), 3), predictor.horizon)
+        action_fan(CMD_FAN_ON)
+
+
+def action_script(command):
+    """Perform command for this script itself.
+
+    Arguments
+    ---------
+    command : str
+        Received command to be realized: ``{"EXIT"}``.
+
+    """
+    # Stop script
+    if command == "EXIT":
+        global script_run
+        script_run = False
+        script_wakeup()
+
+
+###############################################################################
+# MQTT actions
+###############################################################################
+def mqtt_publish_option(message, option, section):
+    """Publish to a MQTT topic defined by a configuration option.
+
+    Arguments
+    ---------
+    message : str
+        Message to be published.
+    option : str
+        Configuration option of the topic.
+    section : str
+        Configuration section of the topic.
+
+    Raises
+    ------
+    ValueError
+        The topic is not configured.
+    OSError
+        The MQTT client failed to publish.
+
+    Notes
+    -----
+    - The topic and its QoS are taken from the configuration snapshot, so
+      that changed topics are used right after reloading the configuration.
+
+    """
+    topic = config_snapshot.topic(option, section)
+    if topic is None:
+        raise ValueError(
+            "Topic option {}:[{}] not configured".format(option, section))
+    mqtt_publish_raw(message, topic, config_snapshot.qos(option, section))
+
+
+def mqtt_client():
+    """Return the underlying MQTT client of the broker object.
+
+    Notes
+    -----
+    - The broker object publishes and subscribes only topics of its own
+      configuration, which is not reloaded at runtime. Topics changed by
+      reloading and topics derived from configured ones are published and
+      subscribed with the client directly, which is the only place of
+      reaching the private attribute of the broker object.
+
+    """
+    return mqtt._client
+
+
+def mqtt_publish_raw(message, topic, qos=0, properties=None):
+    """Publish to a MQTT topic by its full name.
+
+    Arguments
+    ---------
+    properties : object
+        MQTT v5 properties of the publishing, if any.
+
+    Raises
+    ------
+    OSError
+        The MQTT client failed to publish.
+
+    """
+    if properties is None:
+        result = mqtt_client().publish(topic, message, qos)
+    else:
+        result = mqtt_client().publish(
+            topic, message, qos, properties=properties)
+    errcode = getattr(result, "rc", 0)
+    if errcode:
+        raise OSError(errcode, "MQTT publishing failed")
+
+
+def mqtt_timestamp_properties(timestamp):
+    """Return MQTT v5 publish properties with an original timestamp.
+
+    Notes
+    -----
+    - The timestamp in seconds since the epoch is the user property
+      ``timestamp``. Clients connected by older protocol versions do not
+      send properties at all.
+    - None is returned for a MQTT client library without properties.
+
+    """
+    try:
+        from paho.mqtt.packettypes import PacketTypes
+        from paho.mqtt.properties import Properties
+    except ImportError:
+        return None
+    properties = Properties(PacketTypes.PUBLISH)
+    properties.UserProperty = ("timestamp", str(timestamp))
+    return properties
+
+
+@instrumented
+def mqtt_publish_temp():
+    """Publish SoC temperature to a MQTT topic."""
+    message = filter.result()
+    option = "server_data_temp"
+    section = mqtt.GROUP_TOPICS
+    if not mqtt.get_connected():
+        spool_publish(message, option, section)
+        return
+    try:
+        mqtt_publish_option(message, option, section)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Published temperature %s°C to MQTT topic %s.",
+                filter.result(), topic_name(option, section))
+    except Exception as errmsg:
+        logger.error(
+            "Temperature publishing to MQTT topic option %s:[%s] failed: %s.",
+            option, section, errmsg)
+        metrics_failure("mqtt")
+        spool_publish(message, option, section)
+
+
+@instrumented
+def mqtt_publish_fan_status():
+    """Publish fan status to the MQTT status topic."""
+    cfg_option = "server_status_fan"
+    cfg_section = mqtt.GROUP_TOPICS
+    if pins.state(pi.PIN_FAN):
+        message = STATUS_FAN_ON
+    else:
+        message = STATUS_FAN_OFF
+    if not mqtt.get_connected():
+        spool_publish(message, cfg_option, cfg_section, state=True)
+        return
+    try:
+        mqtt_publish_option(message, cfg_option, cfg_section)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Published fan status %s to MQTT topic %s.",
+                message, topic_name(cfg_option, cfg_section),
+            )
+    except Exception as errmsg:
+        logger.error(
+            "Publishing fan status %s to MQTT topic %s failed: %s.",
+            message,
+            topic_name(cfg_option, cfg_section),
+            errmsg,
+        )
+        metrics_failure("mqtt")
+        spool_publish(message, cfg_option, cfg_section, state=True)
+
+
+@instrumented
+def mqtt_publish_fan_percon():
+    """Publish fan temperature percentage ON to the MQTT status topic."""
+    cfg_option = "server_status_fan_percon"
+    cfg_section = mqtt.GROUP_TOPICS
+    message = str(pi.FAN_PERC_ON_CUR)
+    if not mqtt.get_connected():
+        spool_publish(message, cfg_option, cfg_section, state=True)
+        return
+    try:
+        mqtt_publish_option(message, cfg_option, cfg_section)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Published fan percentage ON=%s%% to MQTT topic %s.",
+                pi.FAN_PERC_ON_CUR, topic_name(cfg_option, cfg_section))
+    except Exception as errmsg:
+        logger.error(
+            "Publishing fan percentage ON=%s%% to MQTT topic %s failed: %s.",
+            pi.FAN_PERC_ON_CUR, topic_name(cfg_option, cfg_section),
+            errmsg)
+        metrics_failure("mqtt")
+        spool_publish(message, cfg_option, cfg_section, state=True)
+
+
+@instrumented
+def mqtt_publish_fan_percoff():
+    """Publish fan temperature percentage OFF to the MQTT status topic."""
+    cfg_option = "server_status_fan_percoff"
+    cfg_section = mqtt.GROUP_TOPICS
+    message = str(pi.FAN_PERC_OFF_CUR)
+    if not mqtt.get_connected():
+        spool_publish(message, cfg_option, cfg_section, state=True)
+        return
+    try:
+        mqtt_publish_option(message, cfg_option, cfg_section)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Published fan percentage OFF=%s%% to MQTT topic %s.",
+                pi.FAN_PERC_OFF_CUR, topic_name(cfg_option, cfg_section))
+    except Exception as errmsg:
+        logger.error(
+            "Publishing fan percentage OFF=%s%% to MQTT topic %s failed: %s.",
+            pi.FAN_PERC_OFF_CUR, topic_name(cfg_option, cfg_section),
+            errmsg)
+        metrics_failure("mqtt")
+        spool_publish(message, cfg_option, cfg_section, state=True)
+
+
+def mqtt_publish_fan_limits():
+    """Publish fan temperature percentages to the MQTT status topic."""
+    mqtt_publish_fan_percon()
+    mqtt_publish_fan_percoff()
+
+
+def mqtt_publish_topic(message, topic, option, section):
+    """Publish a state to a MQTT topic derived from a configured topic.
+
+    Arguments
+    ---------
+    message : str
+        Message to be published.
+    topic : str
+        Full name of the topic, which is not a configuration option.
+    option : str
+        Configuration option of the topic the derived one is based on.
+    section : str
+        Configuration section of the topic the derived one is based on.
+
+    Notes
+    -----
+    - Derived topics are not configuration options, so that they are not
+      checked against the configuration snapshot, but they are published
+      with QoS of the original topic.
+    - Failed or disconnected publishing is spooled as a state message
+      of the derived topic.
+
+    """
+    if not mqtt.get_connected():
+        spool_publish(message, option, section, state=True, topic=topic)
+        return
+    try:
+        mqtt_publish_raw(message, topic, config_snapshot.qos(option, section))
+        logger.debug("Published %s to MQTT topic %s.", message, topic)
+    except Exception as errmsg:
+        logger.error(
+            "Publishing %s to MQTT topic %s failed: %s.",
+            message, topic, errmsg)
+        metrics_failure("mqtt")
+        spool_publish(message, option, section, state=True, topic=topic)
+
+
+def fan_channel_topic(option, name, suffix=None, snapshot=None):
+    """Derive a topic of a fan channel from a configured fan topic.
+
+    Arguments
+    ---------
+    snapshot : ConfigSnapshot
+        Configuration snapshot with the fan topic. If not provided, the
+        current one is used.
+
+    """
+    topic = "/".join([
+        (snapshot or config_snapshot).topic(option, mqtt.GROUP_TOPICS), name])
+    if suffix:
+        topic = "/".join([topic, suffix])
+    return topic
+
+
+@instrumented
+def mqtt_publish_fan_channel_status(index):
+    """Publish status of a fan channel to its MQTT status topic."""
+    name = fan_channels.names[index]
+    if name is None:
+        mqtt_publish_fan_status()
+        return
+    if pins.state(fan_channels.pins[index]):
+        message = STATUS_FAN_ON
+    else:
+        message = STATUS_FAN_OFF
+    option = "server_status_fan"
+    mqtt_publish_topic(
+        message, fan_channel_topic(option, name), option, mqtt.GROUP_TOPICS)
+
+
+def mqtt_publish_fan_channel_limits(index):
+    """Publish temperature percentages of a fan channel to MQTT."""
+    name = fan_channels.names[index]
+    if name is None:
+        mqtt_publish_fan_limits()
+        return
+    option = "server_status_fan"
+    mqtt_publish_topic(
+        str(fan_channels.perc_on[index]),
+        fan_channel_topic(option, name, "percon"),
+        option, mqtt.GROUP_TOPICS)
+    mqtt_publish_topic(
+        str(fan_channels.perc_off[index]),
+        fan_channel_topic(option, name, "percoff"),
+        option, mqtt.GROUP_TOPICS)
+
+
+def mqtt_publish_fan_channels():
+    """Publish statuses and percentages of all additional fan channels."""
+    if fan_channels is None:
+        return
+    for index, name in enumerate(fan_channels.names):
+        if name is not None:
+            mqtt_publish_fan_channel_status(index)
+            mqtt_publish_fan_channel_limits(index)
+
+
+def telemetry_values():
+    """Collect all current values for the batched telemetry."""
+    channels = {}
+    if fan_channels is not None:
+        for name, fan_filter, pin in zip(
+                fan_channels.names, fan_channels.filters, fan_channels.pins):
+            if name is not None:
+                channels[name] = [fan_filter.result(), pins.state(pin)]
+    return {
+        "ts": round(clock.time(), 3),
+        "ts_temp": telemetry.sampled,
+        "ts_fan": telemetry.switched,
+        "temp": filter.result(),
+        "fan": pins.state(pi.PIN_FAN),
+        "percon": pi.FAN_PERC_ON_CUR,
+        "percoff": pi.FAN_PERC_OFF_CUR,
+        "channels": channels,
+    }
+
+
+@instrumented
+def mqtt_publish_telemetry():
+    """Publish all current values in one message to the telemetry topic.
+
+    Notes
+    -----
+    - The telemetry is a snapshot superseded by the next one, so that it is
+      neither spooled nor retried while disconnected from the broker.
+
+    """
+    if telemetry is None or not mqtt.get_connected():
+        return
+    cfg_option = "server_data_telemetry"
+    cfg_section = mqtt.GROUP_TOPICS
+    try:
+        message = telemetry.encode(telemetry_values())
+        mqtt_publish_option(message, cfg_option, cfg_section)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Published telemetry of %s bytes to MQTT topic %s.",
+                len(message), topic_name(cfg_option, cfg_section))
+    except Exception as errmsg:
+        logger.error(
+            "Publishing telemetry to MQTT topic %s failed: %s.",
+            topic_name(cfg_option, cfg_section), errmsg)
+        metrics_failure("mqtt")
+
+
+@instrumented
+def mqtt_publish_history(request):
+    """Publish history records requested by a query in chunks.
+
+    Arguments
+    ---------
+    request : dict
+        Query with optional keys ``id`` echoed in replies, ``start`` and
+        ``end`` timestamps, ``decimate`` factor of samples, ``resolution``
+        of records from the time-series store.
+
+    Notes
+    -----
+    - Every chunk is published as a separate JSON message with the query
+      identifier, sequence number, flag about the last chunk, and records
+      as lists of timestamp, raw and filtered temperature, event, and fan
+      channel index. The last chunk is published even if empty.
+    - With resolution the records are read from the time-series store,
+      either raw samples or rollups with start of a bucket, minimal,
+      maximal, and mean temperature, and fan duty cycle.
+    - Only one chunk of records is held in memory at a time.
+
+    """
+    if not mqtt.get_connected():
+        logger.warning("History query %s dropped, disconnected", request["id"])
+        return
+    cfg_option = "server_data_history"
+    cfg_section = mqtt.GROUP_TOPICS
+    sequence = 0
+    try:
+        if request["resolution"] is None:
+            chunks = history.query(
+                request["start"], request["end"], request["decimate"])
+        else:
+            # Chunks of the history buffer if any, otherwise of the store
+            kwargs = {} if history is None else {"chunk": history.chunk}
+            chunks = store.query(
+                request["start"], request["end"], request["resolution"],
+                **kwargs)
+        chunk = next(chunks, None)
+        while True:
+            following = next(chunks, None)
+            mqtt_publish_option(json.dumps({
+                "id": request["id"],
+                "seq": sequence,
+                "last": following is None,
+                "records": chunk or [],
+            }, separators=(",", ":")), cfg_option, cfg_section)
+            sequence += 1
+            if following is None:
+                break
+            chunk = following
+        logger.debug(
+            "Published history query %s in %s chunks to MQTT topic %s.",
+            request["id"], sequence, topic_name(cfg_option, cfg_section))
+    except Exception as errmsg:
+        logger.error(
+            "Publishing history query %s to MQTT topic %s failed: %s.",
+            request["id"], topic_name(cfg_option, cfg_section), errmsg)
+        metrics_failure("mqtt")
+
+
+@instrumented
+def mqtt_publish_fleet():
+    """Publish fleet aggregates and changes of node states.
+
+    Notes
+    -----
+    - Aggregates are calculated even while disconnected from the broker,
+      so that changes of node states are not missed.
+    - Aggregates are a snapshot superseded by the next one, so that they
+      are neither spooled nor retried, while changes of node states are
+      alerts spooled for later publishing.
+
+    """
+    if fleet is None:
+        return
+    aggregates, changes = fleet.aggregate()
+    if changes is not None:
+        if changes["stale"]:
+            logger.warning(
+                "Fleet nodes stale: %s", ", ".join(changes["stale"]))
+        if changes["alive"]:
+            logger.info(
+                "Fleet nodes alive again: %s", ", ".join(changes["alive"]))
+    for message, cfg_option, alert in [
+        (aggregates, "server_data_fleet", False),
+        (changes, "server_status_fleet", True),
+    ]:
+        cfg_section = mqtt.GROUP_TOPICS
+        if message is None:
+            continue
+        message = json.dumps(message, separators=(",", ":"))
+        if not mqtt.get_connected():
+            if alert:
+                spool_publish(message, cfg_option, cfg_section)
+            continue
+        try:
+            mqtt_publish_option(message, cfg_option, cfg_section)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "Published fleet message of %s bytes to MQTT topic %s.",
+                    len(message), topic_name(cfg_option, cfg_section))
+        except Exception as errmsg:
+            logger.error(
+                "Publishing fleet message to MQTT topic %s failed: %s.",
+                topic_name(cfg_option, cfg_section), errmsg)
+            metrics_failure("mqtt")
+            if alert:
+                spool_publish(message, cfg_option, cfg_section)
+
+
+def mqtt_publish_metrics():
+    """Publish summary of metrics to the MQTT status topic."""
+    if metrics is None or not mqtt.get_connected():
+        return
+    cfg_option = "server_status_metrics"
+    cfg_section = mqtt.GROUP_TOPICS
+    try:
+        mqtt_publish_option(
+            json.dumps(metrics.summary()), cfg_option, cfg_section)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Published metrics to MQTT topic %s.",
+                topic_name(cfg_option, cfg_section))
+    except Exception as errmsg:
+        logger.error(
+            "Publishing metrics to MQTT topic %s failed: %s.",
+            topic_name(cfg_option, cfg_section), errmsg)
+        metrics_failure("mqtt")
+
+
+def spool_publish(message, option, section, state=False, topic=None):
+    """Store publishing to a MQTT topic into the spool for later replay.
+
+    Arguments
+    ---------
+    message
+        Message to be published.
+    option : str
+        Configuration option of the topic.
+    section : str
+        Configuration section of the topic.
+    state : bool
+        Flag about a state message superseded by a newer one.
+    topic : str
+        Full name of a topic derived from the configured one.
+
+    """
+    if spool is None:
+        return
+    try:
+        sync = spool.append(option, section, message, state, topic=topic)
+        logger.debug(
+            "Spooled message %s for MQTT topic option %s", message, option)
+    except Exception as errmsg:
+        logger.error("Spooling message %s failed: %s", message, errmsg)
+        return
+    if sync:
+        sink_publish("spool", "sync", spool_sync)
+
+
+def spool_sync():
+    """Sync the spool file to disk."""
+    try:
+        spool.sync()
+    except Exception as errmsg:
+        logger.error("Syncing spool file failed: %s", errmsg)
+
+
+def spool_replay_step():
+    """Replay the oldest spooled record to its MQTT topic.
+
+    Returns
+    -------
+    bool
+        Flag about continuing replay.
+
+    Notes
+    -----
+    - Spooled records are republished to their original topics with the
+      original timestamp in the MQTT v5 user property ``timestamp``, so that
+      subscribers can tell outdated values from current ones.
+    - With the replay topic ``spool`` the records are published to the
+      dedicated spool topic as JSON with original topic and timestamp
+      instead, e.g., for brokers without MQTT v5.
+
+    """
+    if spool is None or not mqtt.get_connected():
+        return False
+    records = spool.peek(1)
+    if not records:
+        return False
+    record = records[0]
+    option, section = record["option"], record["section"]
+    topic = record.get("topic") or topic_name(option, section)
+    try:
+        if spool.replay_topic == REPLAY_SPOOL:
+            message = json.dumps({
+                "topic": topic,
+                "timestamp": record["timestamp"],
+                "message": record["message"],
+            })
+            mqtt_publish_option(
+                message, "server_data_spool", mqtt.GROUP_TOPICS)
+        elif topic is None:
+            logger.warning(
+                "Spooled message for not configured topic %s:[%s] dropped",
+                option, section)
+        else:
+            mqtt_publish_raw(
+                record["message"], topic, config_snapshot.qos(option, section),
+                mqtt_timestamp_properties(record["timestamp"]))
+    except Exception as errmsg:
+        logger.error("Replaying spooled message failed: %s", errmsg)
+        return False
+    spool.remove(1)
+    return True
+
+
+def spool_replay():
+    """Replay spooled records at controlled rate in a thread."""
+    count = 0
+    try:
+        while script_run and spool_replay_step():
+            count += 1
+            clock.sleep(1.0 / spool.replay_rate)
+    finally:
+        spool.replaying = False
+    logger.debug("Replayed %s spooled messages, remaining %s",
+                 count, len(spool))
+
+
+async def async_spool_replay():
+    """Replay spooled records at controlled rate in the event loop."""
+    import asyncio
+    count = 0
+    try:
+        while script_run and spool_replay_step():
+            count += 1
+            await asyncio.sleep(1.0 / spool.replay_rate)
+    finally:
+        spool.replaying = False
+    logger.debug("Replayed %s spooled messages, remaining %s",
+                 count, len(spool))
+
+
+def spool_replay_start():
+    """Start replaying spooled records after connection to MQTT broker."""
+    if spool is None or spool.replaying or not len(spool):
+        return
+    spool.replaying = True
+    spool.compact()
+    logger.info("Replay of %s spooled messages started", len(spool))
+    if runtime == RUNTIME_ASYNCIO and aioloop is not None:
+        aioloop.create_task(async_spool_replay())
+    else:
+        threading.Thread(
+            target=spool_replay, name="Spool", daemon=True).start()
+
+
+def mqtt_message_log(message, payload=None, handler=None):
+    """Log receiving from a MQTT topic.
+
+    Arguments
+    ---------
+    message : str
+        An instance of ``MQTTMessage``.
+        This is a class with members `topic`, `payload`, `qos`, `retain`.
+    payload : str
+        Already decoded message payload. If not provided, it is decoded from
+        the message.
+    handler : str
+        Name of the handler processing the message.
+
+    Returns
+    -------
+    bool
+        Flag about present message payload.
+
+    See Also
+    --------
+    gbj_pythonlib_sw.mqtt
+        Module for MQTT processing.
+
+    """
+    if message.payload is None:
+        return False
+    # Avoid formatting without debug logging
+    if not logger.isEnabledFor(logging.DEBUG):
+        return True
+    logger.debug(
+        "Message from MQTT topic %s with qos %s and retain %s",
+        message.topic, message.qos, message.retain)
+    if payload is None:
+        payload = message.payload.decode("utf-8")
+    logger.debug("%s: %s", handler, payload)
+    return True
+
+
+def mqtt_route(message, fallback):
+    """Dispatch a received MQTT message to its handler by routing table.
+
+    Arguments
+    ---------
+    message : object
+        An instance of ``MQTTMessage``.
+    fallback : function
+        Handler of a message from a topic without an exact route, which
+        is used if no topic filter from the routing table matches either.
+
+    Notes
+    -----
+    - The payload is decoded just once and handed over to the handler along
+      with the command precompiled in the routing table.
+    - A binary payload, e.g., of the telemetry, is handed over undecoded.
+
+    """
+    if message.payload is None:
+        return
+    try:
+        payload = message.payload.decode("utf-8")
+    except UnicodeDecodeError:
+        payload = message.payload
+    route = mqtt_routes.get(message.topic)
+    if route is None:
+        for topic_filter, filter_handler in mqtt_routes_filters:
+            if mqtt_topic_matches(topic_filter, message.topic):
+                fallback = filter_handler
+                break
+        route = (fallback, None)
+    handler, command = route
+    mqtt_message_log(message, payload, handler.__name__)
+    handler(message.topic, payload, command)
+
+
+###############################################################################
+# MQTT message handlers
+###############################################################################
+def mqtt_receive_temp(topic, payload, command=None):
+    """Process received temperature."""
+    value = float(payload)
+    logger.debug("Received temperature %s°C", value)
+
+
+def mqtt_receive_spool(topic, payload, command=None):
+    """Process received replayed spooled message."""
+    logger.debug("Received spooled message %s", payload)
+
+
+def mqtt_receive_telemetry(topic, payload, command=None):
+    """Process received batched telemetry."""
+    logger.debug("Received telemetry of %s bytes", len(payload))
+
+
+def mqtt_receive_history(topic, payload, command=None):
+    """Process received reply to a history query."""
+    logger.debug("Received history chunk of %s bytes", len(payload))
+
+
+def mqtt_receive_fleet(topic, payload, command=None):
+    """Process received fleet aggregates."""
+    logger.debug("Received fleet aggregates of %s bytes", len(payload))
+
+
+def mqtt_receive_fleet_node(topic, payload, command=None):
+    """Process received data of a node of the fleet."""
+    if fleet is not None:
+        fleet.update(topic, payload)
+
+
+def mqtt_receive_data_unknown(topic, payload, command=None):
+    """Process received data from an unexpected topic."""
+    logger.warning("Received unknown data %s from topic %s", payload, topic)
+
+
+def mqtt_receive_unfiltered(topic, payload, command=None):
+    """Process received message from a topic without a filter callback."""
+
+
+def mqtt_receive_command(topic, payload, command=None):
+    """Process received general command for the script."""
+    logger.debug("Received general command %s from topic %s", payload, topic)
+    action_script(payload)
+
+
+def mqtt_receive_command_test(topic, payload, command=None):
+    """Process received test command."""
+    logger.debug("Received test command %s from topic %s", payload, topic)
+
+
+def mqtt_receive_command_fan(topic, payload, command=None):
+    """Process received fan command."""
+    logger.debug("Received fan command %s from topic %s", payload, topic)
+    action_fan(payload)
+
+
+def mqtt_receive_command_fan_value(topic, payload, command=None):
+    """Process received fan command with value as the payload."""
+    logger.debug(
+        "Received fan command %s with value %s from topic %s",
+        command, payload, topic)
+    action_fan(command, payload)
+
+
+def mqtt_receive_command_fan_channel(topic, payload, command=None):
+    """Process received command for a fan channel."""
+    name, fan_command = command
+    logger.debug(
+        "Received fan %s command %s with value %s from topic %s",
+        name, fan_command or payload, payload, topic)
+    if fan_command is None:
+        action_fan_channel(name, payload)
+    else:
+        action_fan_channel(name, fan_command, payload)
+
+
+def mqtt_receive_command_history(topic, payload, command=None):
+    """Process received query of the temperature history.
+
+    Notes
+    -----
+    - The payload is a JSON object with optional keys ``id``, ``start``,
+      ``end``, and ``decimate``. Timestamps not greater than zero are
+      relative to now in seconds, e.g., ``{"start": -3600}`` is the recent
+      hour. An empty payload queries the whole history.
+    - The key ``resolution`` in seconds queries the time-series store,
+      zero for raw samples, 60 or 3600 for rollups.
+    - Replies are published by the MQTT sink worker, so that a large query
+      does not block receiving messages.
+
+    """
+    try:
+        query = json.loads(payload) if payload.strip() else {}
+        now = clock.time()
+        request = {"id": query.get("id")}
+        for key in ["start", "end"]:
+            value = query.get(key)
+            if value is not None:
+                value = float(value)
+                value = now + value if value <= 0.0 else value
+            request[key] = value
+        request["decimate"] = max(int(query.get("decimate", 1)), 1)
+        request["resolution"] = query.get("resolution")
+        if request["resolution"] is None:
+            if history is None:
+                raise ValueError("no history buffer")
+        else:
+            request["resolution"] = int(request["resolution"])
+            if store is None:
+                raise ValueError("no time-series store")
+            if request["resolution"] not in (0,) + store.RESOLUTIONS:
+                raise ValueError("unknown resolution")
+    except (AttributeError, TypeError, ValueError) as errmsg:
+        logger.error("Invalid history query %s: %s", payload, errmsg)
+        return
+    sink_publish("mqtt", None, mqtt_publish_history, request)
+
+
+def mqtt_receive_command_unknown(topic, payload, command=None):
+    """Process received command from an unexpected topic."""
+    logger.warning("Received unknown command %s from topic %s", payload, topic)
+
+
+def thingspeak_fields(fan_status=False):
+    """Collect current values for publishing to ThingSpeak.
+
+    Arguments
+    ---------
+    fan_status : bool
+        Flag determining whether current fan state should be published
+        as a ThingSpeak channel status.
+
+    Returns
+    -------
+    tuple
+        Values of channel fields by field numbers and channel status.
+
+    Notes
+    -----
+    - Values are collected by the owner of the script state right away,
+      while the blocking publishing of them can be done later elsewhere.
+    - The fan field is included just at a change of the fan state since
+      the recent collecting, so that every fan switching is recorded once.
+
+    """
+    fields = {thingspeak.FIELD_TEMP: filter.result()}
+    # Changed fan state since recent publishing
+    fan_state_cur = pins.state(pi.PIN_FAN)
+    if not hasattr(thingspeak, "fan_state_old"):
+        thingspeak.fan_state_old = fan_state_cur
+    if fan_state_cur != thingspeak.fan_state_old:
+        fields[thingspeak.FIELD_FAN] = fan_state_cur
+        logger.debug(
+            "Fan state change %s -> %s for ThingSpeak field%s",
+            thingspeak.fan_state_old, fan_state_cur, thingspeak.FIELD_FAN)
+        thingspeak.fan_state_old = fan_state_cur
+    # Fan status
+    status = None
+    if fan_status:
+        if fan_state_cur:
+            status = STATUS_FAN_ON
+        else:
+            status = STATUS_FAN_OFF
+        status += ": {}°C {}".format(
+            fields[thingspeak.FIELD_TEMP],
+            time.ctime()
+            )
+    return fields, status
+
+
+@instrumented
+def thingspeak_publish(fields, status=None):
+    """Publish collected values to ThingSpeak.
+
+    Arguments
+    ---------
+    fields : dict
+        Values of channel fields by field numbers.
+    status : str
+        Channel status.
+
+    Notes
+    -----
+    - In bulk mode the update is just buffered with current timestamp
+      and it is sent by the ThingSpeak timer within a bulk update.
+
+    """
+    # Buffering for bulk update
+    if thingspeak_bulk is not None:
+        thingspeak_bulk.add(
+            fields, status, protected=thingspeak.FIELD_FAN in fields)
+        logger.debug(
+            "Buffered %s for ThingSpeak bulk update", fields)
+        return
+    # Publication to ThingSpeak
+    try:
+        logger.debug("Publish to ThingSpeak")
+        if thingspeak.publish(fields=fields, status=status):
+            logger.debug(
+                "Published temperature %s°C to ThingSpeak field%s",
+                fields[thingspeak.FIELD_TEMP], thingspeak.FIELD_TEMP)
+            if thingspeak.FIELD_FAN in fields:
+                logger.debug(
+                    "Published fan state %s to ThingSpeak field%s",
+                    fields[thingspeak.FIELD_FAN], thingspeak.FIELD_FAN)
+            if status is not None and len(status) > 0:
+                logger.debug(
+                    "Published channel status %s to ThingSpeak",
+                    status)
+    except Exception as errmsg:
+        logger.error(
+            "Publishing to ThingSpeak failed: %s",
+            errmsg)
+        metrics_failure("thingspeak")
+
+
+@instrumented
+def thingspeak_flush():
+    """Send buffered ThingSpeak updates as a bulk update."""
+    if thingspeak_bulk is None:
+        return
+    try:
+        count = thingspeak_bulk.flush()
+        if count:
+            logger.debug(
+                "Published %s updates to ThingSpeak in bulk", count)
+    except Exception as errmsg:
+        logger.error(
+            "Bulk update of %s updates to ThingSpeak failed: %s",
+            len(thingspeak_bulk), errmsg)
+        metrics_failure("thingspeak")
+
+
+@instrumented
+def blynk_publish_fan_status():
+    """Publish fan status to Blynk mobile application."""
+    global blynk
+    if blynk is None:
+        return
+    if pins.state(pi.PIN_FAN):
+        fan_status = ON
+        led_value = 255
+    else:
+        fan_status = OFF
+        led_value = 0
+    try:
+        blynk.virtual_write(blynk.VPIN_FAN_LED, led_value)
+        logger.debug("Published fan status %s to Blynk.", fan_status)
+    except Exception:
+        logger.error("Publishing fan status to Blynk failed.")
+        metrics_failure("blynk")
+
+
+@instrumented
+def blynk_publish_fan_percon():
+    """Publish fan temperature percentage ON to Blynk mobile application."""
+    global blynk
+    if blynk is None:
+        return
+    try:
+        blynk.virtual_write(blynk.VPIN_FAN_PERCON, pi.FAN_PERC_ON_CUR)
+        logger.debug("Published fan percentages ON=%s%% to Blynk.",
+                     pi.FAN_PERC_ON_CUR)
+    except Exception:
+        logger.error("Publishing fan percentage ON to Blynk failed.")
+        metrics_failure("blynk")
+
+
+@instrumented
+def blynk_publish_fan_percoff():
+    """Publish fan temperature percentage OFF to Blynk mobile application."""
+    global blynk
+    if blynk is None:
+        return
+    try:
+        blynk.virtual_write(blynk.VPIN_FAN_PERCOFF, pi.FAN_PERC_OFF_CUR)
+        logger.debug("Published fan percentages OFF=%s%% to Blynk.",
+                     pi.FAN_PERC_OFF_CUR)
+    except Exception:
+        logger.error("Publishing fan percentage OFF to Blynk failed.")
+        metrics_failure("blynk")
+
+
+def blynk_publish_fan_limits():
+    """Publish fan temperature percentages to Blynk mobile application."""
+    blynk_publish_fan_percon()
+    blynk_publish_fan_percoff()
+
+
+###############################################################################
+# Callback functions
+###############################################################################
+@instrumented
+def cbTimer_temp_measure(*arg, **kwargs):
+    """Measure current CPU temperature."""
+    # blynk_publish()
+    exec_last = kwargs.pop("exec_last", False)
+    if sensors is None:
+        raw = pi.measure_temperature()
+        value = filter.result(raw)
+    else:
+        # The filter of the primary zone is the control one
+        values = sensors.read()
+        for name, value in zip(sensors.names, values):
+            if value is not None:
+                filters[name].result(value)
+        raw = values[0]
+        value = filter.result()
+    logger.debug("Measured temperature %s°C", value)
+    timestamp = clock.time()
+    if telemetry is not None:
+        telemetry.sampled = round(timestamp, 3)
+    if history is not None:
+        history.append(timestamp, raw, value)
+    if store is not None:
+        store.record_sample(timestamp, raw, value, pins.state(pi.PIN_FAN))
+    if thingspeak_bulk is not None:
+        # Every sample is buffered, updates of the same second are merged
+        thingspeak_publish(*thingspeak_fields())
+    if "first_sample" not in startup_times:
+        startup_mark("first_sample")
+    if pins.due(clock.monotonic()):
+        reconcile_pins()
+    if predictor is not None:
+        predict_fan(value)
+    if crossing is not None:
+        evaluate_crossing(value)
+    if sampling is not None and value is not None:
+        adapt_sampling(value)
+    if exec_last:
+        # global script_run
+        # script_run = False
+        pass
+
+
+@instrumented
+def cbTimer_temp_publish(*arg, **kwargs):
+    """Publish current CPU temperature."""
+    # Temperature is published within the telemetry only
+    per_topic = telemetry is None or telemetry.per_topic
+    if per_topic and policy_temp.check(filter.result()):
+        logger.debug(
+            "Publish temperature %s°C",
+            filter.result()
+        )
+        mqtt_publish_temp()
+    elif per_topic:
+        logger.debug(
+            "Suppressed temperature %s°C, totally %s suppressed",
+            filter.result(), policy_temp.suppressed)
+
+
+@instrumented
+def cbTimer_temp_triggers(*arg, **kwargs):
+    """Execute CPU temperature triggers."""
+    if fan_channels is None:
+        trigger.exec_triggers(filter.result(), ids=["fanon", "fanoff"])
+        return
+    temps = [fan_filter.result() for fan_filter in fan_channels.filters]
+    states = [pins.state(pin) for pin in fan_channels.pins]
+    for index, command in fan_channels.evaluate(temps, states):
+        action_fan_channel(fan_channels.names[index], command)
+
+
+@instrumented
+def cbTimer_thingspeak(*arg, **kwargs):
+    """Prepare publishing to ThingSpeak.
+
+    Returns
+    -------
+    function
+        Blocking publishing of collected values or of the bulk update,
+        which is run by the timer outside of the script state.
+
+    """
+    if thingspeak_bulk is not None:
+        return thingspeak_flush
+    if policy_thingspeak.check(filter.result()):
+        return functools.partial(thingspeak_publish, *thingspeak_fields())
+    logger.debug(
+        "Suppressed ThingSpeak temperature %s°C, totally %s suppressed",
+        filter.result(), policy_thingspeak.suppressed)
+
+
+@instrumented
+def cbTimer_telemetry(*arg, **kwargs):
+    """Publish batched telemetry."""
+    mqtt_publish_telemetry()
+
+
+def cbTimer_fleet(*arg, **kwargs):
+    """Publish fleet aggregates."""
+    mqtt_publish_fleet()
+
+
+def cbTimer_metrics(*arg, **kwargs):
+    """Publish metrics."""
+    mqtt_publish_metrics()
+
+
+@instrumented
+def cbTrigger_fan(*args, **kwargs):
+    """Execute command for the fan."""
+    command = kwargs.pop("cmd", None)
+    if command is None:
+        return
+    action_fan(command)
+
+
+@instrumented
+def cbMqtt_on_connect(client, userdata, flags, rc):
+    """Process actions when the broker responds to a connection request.
+
+    Arguments
+    ---------
+    client : object
+        MQTT client instance for this callback.
+    userdata
+        The private user data.
+    flags : dict
+        Response flags sent by the MQTT broker.
+    rc : int
+        The connection result (result code).
+
+    See Also
+    --------
+    gbj_pythonlib_sw.mqtt._on_connect()
+        Description of callback arguments for proper utilizing.
+
+    """
+    if rc == 0:
+        logger.debug("Connected to %s: %s", str(mqtt), userdata)
+        setup_mqtt_filters()
+        sink_publish("mqtt", "fan_status", mqtt_publish_fan_status)
+        sink_publish("mqtt", "fan_limits", mqtt_publish_fan_limits)
+        sink_publish("mqtt", "fan_channels", mqtt_publish_fan_channels)
+        spool_replay_start()
+    else:
+        logger.error("Connection to MQTT broker failed: %s", userdata)
+
+
+@instrumented
+def cbMqtt_on_disconnect(client, userdata, rc):
+    """Process actions when the client disconnects from the broker.
+
+    Arguments
+    ---------
+    client : object
+        MQTT client instance for this callback.
+    userdata
+        The private user data.
+    rc : int
+        The connection result (result code).
+
+    See Also
+    --------
+    gbj_pythonlib_sw.mqtt._on_connect()
+        Description of callback arguments for proper utilizing.
+
+    """
+    logger.warning("Disconnected from %s: %s", str(mqtt), userdata)
+
+
+def cbMqtt_on_subscribe(client, userdata, mid, granted_qos):
+    """Process actions when the broker responds to a subscribe request.
+
+    Arguments
+    ---------
+    client : object
+        MQTT client instance for this callback.
+    userdata
+        The private user data.
+    mid : int
+        The message ID from the subscribe request.
+    granted_qos : int
+        The list of integers that give the QoS level the broker has granted
+        for each of the different subscription requests.
+
+    """
+    # logger.debug("Subscribed to MQTT topic with message id %d", mid)
+    pass
+
+
+@instrumented
+def cbMqtt_on_message(client, userdata, message):
+    """Process actions when a non-filtered message has been received.
+
+    Arguments
+    ---------
+    client : object
+        MQTT client instance for this callback.
+    userdata
+        The private user data.
+    message : object
+        An instance of ``MQTTMessage``.
+        This is a class with members `topic`, `payload`, `qos`, `retain`.
+
+    Notes
+    -----
+    - The topic that the client subscribes to and the message does not match
+      an existing topic filter callback.
+    - Use message_callback_add() to define a callback that will be called for
+      specific topic filters. This function serves as fallback when none
+      topic filter matched.
+
+    """
+    mqtt_route(message, mqtt_receive_unfiltered)
+
+
+@instrumented
+def cbMqtt_on_message_fleet(client, userdata, message):
+    """Process data of a node of the fleet from the fleet topic filter.
+
+    Arguments
+    ---------
+    client : object
+        MQTT client instance for this callback.
+    userdata
+        The private user data.
+    message : object
+        An instance of ``MQTTMessage``.
+        This is a class with members `topic`, `payload`, `qos`, `retain`.
+
+    Notes
+    -----
+    - The callback is executed by the runtime like other filter callbacks,
+      but without routing and logging of the message, because thousands
+      of messages per second are expected.
+
+    """
+    if fleet is not None and message.payload is not None:
+        fleet.update(message.topic, message.payload)
+
+
+@instrumented
+def cbMqtt_on_message_data(client, userdata, message):
+    """Process server data send through a MQTT topic(s).
+
+    Arguments
+    ---------
+    client : object
+        MQTT client instance for this callback.
+    userdata
+        The private user data.
+    message : object
+        An instance of ``MQTTMessage``.
+        This is a class with members `topic`, `payload`, `qos`, `retain`.
+
+    """
+    mqtt_route(message, mqtt_receive_data_unknown)
+
+
+@instrumented
+def cbMqtt_on_message_command(client, userdata, message):
+    """Process server command at receiving a message from the command topic(s).
+
+    Arguments
+    ---------
+    client : object
+        MQTT client instance for this callback.
+    userdata
+        The private user data.
+    message : object
+        An instance of ``MQTTMessage``.
+        This is a class with members `topic`, `payload`, `qos`, `retain`.
+
+    Notes
+    -----
+    - The topic that the client subscribes to and the message match the topic
+      filter for server commands.
+    - The message is dispatched by the precompiled routing table.
+
+    """
+    mqtt_route(message, mqtt_receive_command_unknown)
+
+
+@instrumented
+def cbBlynk_on_connect():
+    """Process actions when the script is connected to Blynk cloud."""
+    # Update mobile application
+    sink_publish("blynk", "fan_status", blynk_publish_fan_status)
+    sink_publish("blynk", "fan_limits", blynk_publish_fan_limits)
+    logger.debug("Blynk mobile application synchronized")
+
+
+###############################################################################
+# Configuration reload
+###############################################################################
+def config_reload():
+    """Reload the configuration file and apply its valid changes.
+
+    Notes
+    -----
+    - The file is parsed and validated into a new snapshot first. An invalid
+      file is rejected and the running state is not touched.
+    - Only changed sections are applied, i.e., fan limits and triggers are
+      re-armed, the measurement timer is rescheduled, and MQTT routes are
+      recompiled with resubscribing of changed topic filters.
+    - Options outside of the reloadable sections need restart, as well as
+      fan pin names, which keep their running values until then.
+    - Objects of changed sections are built from the new configuration
+      first. If any of them fails, the change is rejected as a whole.
+    - The snapshot and the built objects are swapped in holding the state
+      lock, so that timers, the fan actor, and MQTT handlers never see
+      a partially applied configuration. In asyncio runtime the reload runs
+      in the event loop.
+
+    """
+    try:
+        with open(cmdline.config.name) as config_file:
+            config_new = modConfig.Config(config_file)
+        snapshot = ConfigSnapshot(config_new)
+    except Exception as errmsg:
+        logger.error("Configuration change rejected: %s", errmsg)
+        return
+    changed = snapshot.changed(config_snapshot)
+    if not changed:
+        logger.debug("Configuration file without reloadable changes")
+        return
+    with state_lock:
+        try:
+            config_apply(config_new, snapshot, changed)
+        except Exception as errmsg:
+            logger.error("Configuration change rejected: %s", errmsg)
+            return
+    logger.info(
+        "Configuration reloaded: %s", ", ".join(sorted(changed)))
+
+
+def config_apply(config_new, snapshot, changed):
+    """Swap the configuration for a new one and apply its changed sections.
+
+    Arguments
+    ---------
+    config_new : object
+        Configuration object of the reloaded file.
+    snapshot : ConfigSnapshot
+        Parsed and validated snapshot of the reloaded configuration.
+    changed : set
+        Names of sections with changed options.
+
+    Raises
+    ------
+    Exception
+        Any error of building objects of changed sections. The running state
+        is not changed then.
+
+    Notes
+    -----
+    - Objects of all changed sections are built before anything is swapped
+      in, so that a failure does not leave a partially applied state.
+
+    """
+    global config, config_snapshot
+    previous = config_snapshot
+    for section in sorted(changed):
+        pin_old = previous.value("pin_fan_name", section)
+        pin_new = snapshot.value("pin_fan_name", section)
+        if pin_old is not None and pin_old != pin_new:
+            logger.warning(
+                "Option pin_fan_name:[%s] changed from %s to %s,"
+                " restart required", section, pin_old, pin_new)
+    # Build objects of changed sections
+    staged = {}
+    if any(section.split(":")[0] == "Fan" for section in changed):
+        staged.update(config_build_fan(config_new))
+    if "TimerTemperature" in changed:
+        staged.update(config_build_timer_temp(config_new))
+    routes_changed = changed & set([mqtt.GROUP_TOPICS, mqtt.GROUP_FILTERS])
+    if routes_changed or "fan_channels" in staged:
+        staged["mqtt_routes"] = build_mqtt_routes(
+            snapshot, staged.get("fan_channels", fan_channels))
+    # Swap all at once
+    config, config_snapshot = config_new, snapshot
+    if "fan_settings" in staged:
+        config_apply_fan(staged)
+    if "timer_temp" in staged:
+        config_apply_timer_temp(staged)
+    if "mqtt_routes" in staged:
+        config_apply_routes(staged["mqtt_routes"])
+        if routes_changed and mqtt.get_connected():
+            mqtt_resubscribe_filters(previous)
+
+
+def config_build_fan(cfg):
+    """Build fan objects from a reloaded configuration.
+
+    Notes
+    -----
+    - Current fan percentages, e.g., set by MQTT or Blynk, are reset to the
+      default ones only if the default ones changed.
+
+    """
+    settings = build_fan_settings(cfg)
+    if (settings["FAN_PERC_ON_DEF"], settings["FAN_PERC_OFF_DEF"]) \
+            != (pi.FAN_PERC_ON_DEF, pi.FAN_PERC_OFF_DEF):
+        settings["FAN_PERC_ON_CUR"] = settings["FAN_PERC_ON_DEF"]
+        settings["FAN_PERC_OFF_CUR"] = settings["FAN_PERC_OFF_DEF"]
+    return {
+        "fan_settings": settings,
+        "fan_channels": build_fan_channels(cfg, settings),
+        "predictor": build_predictor(cfg),
+    }
+
+
+def config_apply_fan(staged):
+    """Swap in fan objects built from a reloaded configuration.
+
+    Notes
+    -----
+    - Triggers are re-armed right away with the current limits, so that
+      they never disagree with the limits of the GPIO object.
+
+    """
+    global fan_channels, predictor
+    setup_pi_fan(staged["fan_settings"])
+    fan_channels = staged["fan_channels"]
+    predictor = staged["predictor"]
+    setup_trigger_fan()
+    fan_publish(None, False, True)
+    if fan_channels is not None:
+        for name in fan_channels.names[1:]:
+            fan_publish(name, False, True)
+
+
+def config_build_timer_temp(cfg):
+    """Build measurement timer objects from a reloaded configuration."""
+    detector = build_crossing(cfg)
+    definition = build_timer_temp(cfg, "Timer_temp", detector)
+    return {
+        "timer_temp": definition,
+        "policies": build_policies(cfg),
+        "crossing": detector,
+        "sampling": build_sampling(cfg, definition["period"]),
+        "filter_factor": filter_factor(cfg),
+    }
+
+
+def config_apply_timer_temp(staged):
+    """Swap in measurement timer objects built from a reloaded file."""
+    global policy_temp, policy_thingspeak, crossing, sampling
+    policy_temp, policy_thingspeak = staged["policies"]
+    crossing = staged["crossing"]
+    sampling = staged["sampling"]
+    definition = timers["Timer_temp"]
+    reloaded = staged["timer_temp"]
+    definition["schedule"].set_period(reloaded["period"])
+    definition["period"] = reloaded["period"]
+    definition["prescalers"] = reloaded["prescalers"]
+    # Adaptive sampling starts again from the configured period
+    for zone_filter in set([filter] + list(filters.values())):
+        if isinstance(zone_filter, modFilter.StatFilterExponential):
+            zone_filter.factor = staged["filter_factor"]
+
+
+def config_apply_routes(routes):
+    """Swap in routing tables built from a reloaded configuration."""
+    global mqtt_routes, mqtt_routes_filters
+    mqtt_routes, mqtt_routes_filters = routes
+    setup_fleet_filter()
+
+
+###############################################################################
+# Setup functions
+###############################################################################
+def setup_cmdline():
+    """Define command line arguments."""
+    config_file = os.path.splitext(os.path.abspath(__file__))[0] + ".ini"
+    log_folder = "/var/log"
+
+    parser = argparse.ArgumentParser(
+        description="Tester, version " + __version__
+    )
+    # Position arguments
+    parser.add_argument(
+        "config",
+        type=argparse.FileType("r"),
+        nargs="?",
+        default=config_file,
+        help="Configuration INI file, default: " + config_file
+    )
+    # Options
+    parser.add_argument(
+        "-V", "--version",
+        action="version",
+        version="%(prog)s " + __version__,
+        help="Current version of the script."
+    )
+    parser.add_argument(
+        "-v", "--verbose",
+        choices=["debug", "warning", "info", "error", "critical"],
+        default="warning",
+        help="Level of logging to console."
+    )
+    parser.add_argument(
+        "-l", "--loglevel",
+        choices=["debug", "warning", "info", "error", "critical"],
+        default="debug",
+        help="Level of logging to log file."
+    )
+    parser.add_argument(
+        "-d", "--logdir",
+        default=log_folder,
+        help="Folder of a log file, default " + log_folder
+    )
+    parser.add_argument(
+        "--logsize",
+        type=int,
+        default=1048576,
+        help="Size of a log file in bytes for rotation, 0 without rotation,"
+             " default 1048576"
+    )
+    parser.add_argument(
+        "--logwhen",
+        choices=["S", "M", "H", "D", "midnight"],
+        help="Time interval for rotation of a log file instead of its size."
+    )
+    parser.add_argument(
+        "--logbackups",
+        type=int,
+        default=3,
+        help="Number of rotated log files, default 3"
+    )
+    parser.add_argument(
+        "--logqueue",
+        type=int,
+        default=10000,
+        help="Capacity of the queue of log records, default 10000"
+    )
+    parser.add_argument(
+        "-c", "--configuration",
+        action="store_true",
+        help="""Print configuration parameters in form of INI file content."""
+    )
+    # Process command line arguments
+    global cmdline
+    cmdline = parser.parse_args()
+
+
+def setup_logger():
+    """Configure logging facility.
+
+    Notes
+    -----
+    - Log records are passed through a bounded queue to a listener thread
+      writing them to the log file, so that file I/O never stalls callers.
+    - The log file is rotated by size or by time. The log file of previous
+      run is rotated at start instead of overwriting it.
+
+    """
+    global logger, log_handler, log_listener
+    # Set logging to file for module and script logging
+    log_file = "/".join([cmdline.logdir, os.path.basename(__file__) + ".log"])
+    if cmdline.logwhen:
+        file_handler = logging.handlers.TimedRotatingFileHandler(
+            log_file,
+            when=cmdline.logwhen,
+            backupCount=cmdline.logbackups,
+        )
+    else:
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_file,
+            maxBytes=cmdline.logsize,
+            backupCount=cmdline.logbackups,
+        )
+    if os.path.getsize(log_file) > 0:
+        file_handler.doRollover()
+    file_handler.setFormatter(logging.Formatter(
+        "%(asctime)s - %(levelname)-8s - %(name)-20s: %(message)s"))
+    log_handler = LogQueueHandler(cmdline.logqueue)
+    log_handler.setFormatter(logging.Formatter("%(message)s"))
+    logging.basicConfig(
+        level=getattr(logging, cmdline.loglevel.upper()),
+        handlers=[log_handler],
+    )
+    log_listener = logging.handlers.QueueListener(
+        log_handler.queue, file_handler)
+    log_listener.start()
+    # Set console logging
+    formatter = logging.Formatter(
+        "%(levelname)-8s - %(name)-20s: %(message)s")
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setLevel(getattr(logging, cmdline.verbose.upper()))
+    console_handler.setFormatter(formatter)
+    logger = logging.getLogger("{} {}".format(
+        os.path.basename(__file__), __version__))
+    logger.addHandler(console_handler)
+    logger.warning("Script started from file %s", os.path.abspath(__file__))
+
+
+def shutdown_logger():
+    """Write out queued log records and stop the log listener."""
+    if log_handler is not None and log_handler.dropped:
+        logger.warning("Dropped %s log records", log_handler.dropped)
+    if log_listener is not None:
+        log_listener.stop()
+
+
+def setup_config():
+    """Define configuration file management."""
+    global config, config_snapshot
+    config = modConfig.Config(cmdline.config)
+    # Construct configuration file content
+    if cmdline.configuration:
+        config.get_content()
+    config_snapshot = ConfigSnapshot(config)
+
+
+def setup_config_watch():
+    """Define watching of the configuration file for reloading it.
+
+    Notes
+    -----
+    - The watcher is started by the script loop, so that changes are not
+      applied during the setup.
+
+    """
+    global config_watcher
+    if not config_flag("config_watch", "Runtime", True):
+        return
+    path = getattr(cmdline.config, "name", None)
+    if not path or not os.path.isfile(path):
+        return
+    config_watcher = ConfigWatcher(path, runtime_callback(config_reload))
+    logger.debug("Setup watching of configuration file %s", path)
+
+
+def setup_metrics():
+    """Define instrumentation of callbacks and sinks.
+
+    Notes
+    -----
+    - Metrics are exposed in Prometheus text format by a local HTTP endpoint
+      if its port is configured, and published to the MQTT status topic by
+      the metrics timer if its period is configured.
+
+    """
+    global metrics
+    cfg_section = "Metrics"
+    if not config_flag("enabled", cfg_section, True):
+        metrics = None
+        return
+    metrics = Metrics()
+    metrics.gauge(
+        "log_dropped", lambda: log_handler.dropped if log_handler else None)
+    metrics.gauge(
+        "policy_temp_suppressed",
+        lambda: policy_temp.suppressed if policy_temp else None)
+    metrics.gauge(
+        "policy_thingspeak_suppressed",
+        lambda: policy_thingspeak.suppressed if policy_thingspeak else None)
+    metrics.gauge(
+        "spool_records", lambda: len(spool) if spool else None)
+    metrics.gauge(
+        "spool_dropped", lambda: spool.dropped if spool else None)
+    metrics.gauge(
+        "thingspeak_bulk_updates",
+        lambda: len(thingspeak_bulk) if thingspeak_bulk else None)
+    metrics.gauge(
+        "thingspeak_bulk_dropped",
+        lambda: thingspeak_bulk.dropped if thingspeak_bulk else None)
+    metrics.gauge(
+        "gpio_reads", lambda: pins.reads if pins else None)
+    metrics.gauge(
+        "gpio_external_changes", lambda: pins.external if pins else None)
+    metrics.gauge(
+        "startup_first_sample_seconds",
+        lambda: startup_times.get("first_sample"))
+    metrics.gauge(
+        "startup_ready_seconds", lambda: startup_times.get("ready"))
+    port = config.option("http_port", cfg_section)
+    if not port:
+        return
+    host = config.option("http_host", cfg_section, "localhost")
+    import http.server
+    handler = type("MetricsHandler", (
+        MetricsHandler, http.server.BaseHTTPRequestHandler), {})
+    try:
+        server = http.server.ThreadingHTTPServer((host, int(port)), handler)
+        server.daemon_threads = True
+    except Exception as errmsg:
+        logger.error(
+            "Metrics endpoint %s:%s cannot be started: %s", host, port, errmsg)
+        return
+    threading.Thread(
+        target=server.serve_forever, name="Metrics", daemon=True).start()
+    logger.debug("Setup metrics: endpoint = http://%s:%s/metrics", host, port)
+
+
+def setup_pi():
+    """Define GPIO control.
+
+    Notes
+    -----
+    - The board object is created by the factory ``board_factory`` if it
+      is set, e.g., to a simulated board.
+    - Operational pin names are stored in the object as attributes.
+    - Default fan percentage limits are stored in the object as attributes.
+    - States of pins are read through the shadow register reconciled with
+      the hardware by the temperature measurement timer.
+
+    """
+    global pi, pins
+    pi = (board_factory or modOrangePi.OrangePiOne)()
+    interval = float(config.option("pin_reconcile", "Fan", 10.0))
+    pins = PinShadow(pi, max(min(interval, 3600.0), 0.0))
+    pi.PIN_FAN = config.option("pin_fan_name", "Fan")
+    # pi.PIN_LED = config.option("pin_led_name", "Fan")
+    setup_pi_fan()
+
+
+def setup_pi_fan(settings=None):
+    """Define fan limits and control mode stored in the GPIO object.
+
+    Arguments
+    ---------
+    settings : dict
+        Fan settings built from a reloaded configuration. If not provided,
+        they are built from the current configuration with current fan
+        percentages reset to the default ones.
+
+    """
+    if settings is None:
+        settings = build_fan_settings(config)
+        settings["FAN_PERC_ON_CUR"] = settings["FAN_PERC_ON_DEF"]
+        settings["FAN_PERC_OFF_CUR"] = settings["FAN_PERC_OFF_DEF"]
+    for name, value in settings.items():
+        setattr(pi, name, value)
+    logger.debug(
+        "Setup fan control: mode = %s, throttle = %s%%",
+        pi.FAN_CONTROL, pi.FAN_PERC_THROTTLE)
+
+
+def build_fan_settings(cfg):
+    """Build fan limits and control mode from a configuration.
+
+    Returns
+    -------
+    dict
+        Values of fan attributes of the GPIO object by their names.
+
+    """
+    settings = {}
+    # Temperature percentage for fan ON
+    settings["FAN_PERC_ON_DEF"] = abs(float(cfg.option(
+        "percentage_maxtemp_on", "Fan", 85.0)))
+    settings["FAN_PERC_ON_MIN"] = 80.0
+    settings["FAN_PERC_ON_MAX"] = 95.0
+    # Temperature percentage for fan OFF
+    settings["FAN_PERC_OFF_DEF"] = abs(float(cfg.option(
+        "percentage_maxtemp_off", "Fan", 75.0)))
+    settings["FAN_PERC_OFF_MIN"] = 60.0
+    settings["FAN_PERC_OFF_MAX"] = 75.0
+    # Fan control mode
+    control = cfg.option("control", "Fan", CONTROL_HYSTERESIS).lower()
+    if control not in [CONTROL_HYSTERESIS, CONTROL_PREDICTIVE]:
+        control = CONTROL_HYSTERESIS
+    settings["FAN_CONTROL"] = control
+    # Temperature percentage of throttling the SoC
+    settings["FAN_PERC_THROTTLE"] = abs(float(cfg.option(
+        "percentage_maxtemp_throttle", "Fan", 100.0)))
+    settings["FAN_TEMP_THROTTLE"] = pi.convert_percentage_temperature(
+        settings["FAN_PERC_THROTTLE"])
+    return settings
+
+
+def setup_mqtt():
+    """Define MQTT management."""
+    global mqtt, mqtt_filters_snapshot
+    mqtt = modMQTT.MqttBroker(config)
+    # Snapshot with topic filters subscribed by the broker object
+    mqtt_filters_snapshot = config_snapshot
+
+
+def connect_mqtt():
+    """Connect to the MQTT broker."""
+    mqtt.connect(
+        username=config.option("username", mqtt.GROUP_BROKER),
+        password=config.option("password", mqtt.GROUP_BROKER),
+        connect=runtime_callback(cbMqtt_on_connect),
+        disconnect=runtime_callback(cbMqtt_on_disconnect),
+        subscribe=runtime_callback(cbMqtt_on_subscribe),
+        message=runtime_callback(cbMqtt_on_message),
     )
-    parser.add_argument(
-        "-l", "--loglevel",
-        choices=["debug", "warning", "info", "error", "critical"],
-        default="debug",
-        help="Level of logging to log file."
+
+
+def setup_spool():
+    """Define spooling of MQTT publishing while disconnected from broker.
+
+    Notes
+    -----
+    - The spool is active only if its file is configured.
+    - The spool is set up before connecting to the broker, so that records
+      left by previous run are replayed after connection.
+
+    """
+    global spool
+    cfg_section = "MQTTspool"
+    path = config.option("spool_file", cfg_section)
+    if not path:
+        return
+    capacity = int(config.option("capacity", cfg_section, 10000))
+    capacity = max(capacity, 1)
+    sync_count = int(config.option("sync_count", cfg_section, 10))
+    sync_count = max(sync_count, 1)
+    sync_period = float(config.option("sync_period", cfg_section, 5.0))
+    replay_rate = float(config.option("replay_rate", cfg_section, 10.0))
+    replay_rate = max(min(replay_rate, 1000.0), 0.1)
+    replay_topic = config.option(
+        "replay_topic", cfg_section, REPLAY_ORIGINAL).lower()
+    if replay_topic not in [REPLAY_ORIGINAL, REPLAY_SPOOL]:
+        replay_topic = REPLAY_ORIGINAL
+    try:
+        spool = PublishSpool(
+            path,
+            capacity=capacity,
+            sync_count=sync_count,
+            sync_period=sync_period,
+            replay_rate=replay_rate,
+            replay_topic=replay_topic,
+        )
+    except Exception as errmsg:
+        logger.error("Spool file %s cannot be used: %s", path, errmsg)
+        return
+    logger.debug(
+        "Setup spool: file = %s, capacity = %s, records = %s",
+        path, capacity, len(spool))
+
+
+def setup_mqtt_filters():
+    """Define MQTT topic filters and subscribe to them.
+
+    Notes
+    -----
+    - The function is called in on_connect callback function after successful
+      connection to a MQTT broker.
+    - The routing table of incoming topics is rebuilt along with subscribing.
+
+    """
+    setup_mqtt_routes()
+    callbacks = {
+        "server_filter_data": runtime_callback(cbMqtt_on_message_data),
+        "server_filter_command": runtime_callback(cbMqtt_on_message_command),
+    }
+    if topic_name("server_filter_fleet", mqtt.GROUP_FILTERS):
+        callbacks["server_filter_fleet"] = runtime_callback(
+            cbMqtt_on_message_fleet)
+    mqtt.callback_filters(**callbacks)
+    try:
+        mqtt.subscribe_filters()
+    except Exception as errcode:
+        logger.error(
+            "MQTT subscribtion to topic filters failed with error code %s",
+            errcode)
+    mqtt_resubscribe_filters(mqtt_filters_snapshot)
+
+
+def mqtt_resubscribe_filters(previous):
+    """Resubscribe topic filters changed against a configuration snapshot.
+
+    Arguments
+    ---------
+    previous : object
+        Configuration snapshot with subscribed topic filters.
+
+    Notes
+    -----
+    - Messages from resubscribed filters are routed by the general message
+      callback, because filter callbacks of the broker object are bound to
+      its initial configuration.
+
+    """
+    section = mqtt.GROUP_FILTERS
+    for option in CONFIG_SCHEMA[section]:
+        topic_old = previous.topic(option, section)
+        topic_new = config_snapshot.topic(option, section)
+        qos = config_snapshot.qos(option, section)
+        if topic_old == topic_new and previous.qos(option, section) == qos:
+            continue
+        try:
+            if topic_old:
+                mqtt_client().unsubscribe(topic_old)
+            if topic_new:
+                mqtt_client().subscribe(topic_new, qos)
+            logger.info(
+                "Resubscribed MQTT topic filter %s: %s -> %s",
+                option, topic_old, topic_new)
+        except Exception as errmsg:
+            logger.error(
+                "Resubscribing MQTT topic filter %s failed: %s",
+                option, errmsg)
+
+
+def setup_mqtt_routes():
+    """Compile routing table of incoming MQTT topics to message handlers.
+
+    Notes
+    -----
+    - Exact topics are resolved from the configuration just once, so that
+      dispatching a message is a single dictionary lookup.
+    - Topic filters serve as wildcard fallbacks for topics without a route.
+
+    """
+    global mqtt_routes, mqtt_routes_filters
+    routes, routes_filters = build_mqtt_routes(config_snapshot, fan_channels)
+    # Swap whole tables at once for message callbacks running meanwhile
+    mqtt_routes, mqtt_routes_filters = routes, routes_filters
+    setup_fleet_filter()
+    logger.debug(
+        "Setup MQTT routes: topics = %s, filters = %s",
+        len(mqtt_routes), len(mqtt_routes_filters))
+
+
+def build_mqtt_routes(snapshot, channels):
+    """Build routing tables of MQTT topics from a configuration snapshot.
+
+    Arguments
+    ---------
+    snapshot : ConfigSnapshot
+        Configuration snapshot with topics and topic filters.
+    channels : FanChannels
+        Fan channels with their command topics or None.
+
+    Returns
+    -------
+    tuple
+        Dictionary of handlers with their arguments by exact topics and list
+        of pairs of a topic filter and its handler.
+
+    """
+    routes = {}
+    for option, handler, command in [
+        ("server_data_temp", mqtt_receive_temp, None),
+        ("server_data_spool", mqtt_receive_spool, None),
+        ("server_data_telemetry", mqtt_receive_telemetry, None),
+        ("server_data_history", mqtt_receive_history, None),
+        ("server_data_fleet", mqtt_receive_fleet, None),
+        ("server_command", mqtt_receive_command, None),
+        ("server_command_test", mqtt_receive_command_test, None),
+        ("server_command_history", mqtt_receive_command_history, None),
+        ("server_command_fan", mqtt_receive_command_fan, None),
+        ("server_command_fan_percon", mqtt_receive_command_fan_value,
+            CMD_FAN_PERCON),
+        ("server_command_fan_percoff", mqtt_receive_command_fan_value,
+            CMD_FAN_PERCOFF),
+    ]:
+        topic = snapshot.topic(option, mqtt.GROUP_TOPICS)
+        if topic:
+            routes[topic] = (handler, command)
+    for name in (channels.names if channels else []):
+        if name is None:
+            continue
+        for suffix, command in [
+            (None, None),
+            ("percon", CMD_FAN_PERCON),
+            ("percoff", CMD_FAN_PERCOFF),
+        ]:
+            topic = fan_channel_topic(
+                "server_command_fan", name, suffix, snapshot)
+            routes[topic] = (mqtt_receive_command_fan_channel, (name, command))
+    routes_filters = []
+    for option, handler in [
+        ("server_filter_data", mqtt_receive_data_unknown),
+        ("server_filter_command", mqtt_receive_command_unknown),
+        ("server_filter_fleet", mqtt_receive_fleet_node),
+    ]:
+        topic_filter = snapshot.topic(option, mqtt.GROUP_FILTERS)
+        if topic_filter:
+            routes_filters.append((topic_filter, handler))
+    return routes, routes_filters
+
+
+def setup_fleet_filter():
+    """Let the node level of the fleet follow a reloaded topic filter."""
+    topic_filter = topic_name("server_filter_fleet", mqtt.GROUP_FILTERS)
+    if fleet is not None and topic_filter:
+        try:
+            fleet.set_filter(topic_filter)
+        except ValueError as errmsg:
+            logger.error("Fleet topic filter not changed: %s", errmsg)
+
+
+def setup_thingspeak():
+    """Define ThingSpeak management."""
+    global thingspeak
+    thingspeak = modMQTT.ThingSpeak(config)
+    thingspeak.FIELD_TEMP = int(config.option("field_temp",
+                                              thingspeak.GROUP_BROKER, 1))
+    thingspeak.FIELD_FAN = int(config.option("field_fan",
+                                             thingspeak.GROUP_BROKER, 2))
+    setup_thingspeak_bulk()
+
+
+def setup_thingspeak_bulk():
+    """Define buffering of ThingSpeak updates for bulk update.
+
+    Notes
+    -----
+    - In bulk mode temperature samples are buffered at every publishing
+      of the temperature to MQTT and fan changes at every fan action.
+    - The ThingSpeak timer sends the buffer as one bulk update per window.
+
+    """
+    global thingspeak_bulk
+    cfg_section = thingspeak.GROUP_BROKER
+    mode = config.option("publish_mode", cfg_section, "single").lower()
+    if mode != "bulk":
+        thingspeak_bulk = None
+        return
+    url = config.option(
+        "bulk_url", cfg_section,
+        "https://api.thingspeak.com/channels/{}/bulk_update.json".format(
+            config.option("channel_id", cfg_section)))
+    window = max(float(config.option("period_publish", cfg_section, 60.0)),
+                 thingspeak.get_publish_delay())
+    capacity = int(config.option("bulk_capacity", cfg_section, 960))
+    capacity = max(min(capacity, 960), 1)
+    thingspeak_bulk = ThingSpeakBulk(
+        url,
+        config.option("write_api_key", cfg_section),
+        window=window,
+        capacity=capacity,
+        timeout=float(config.option("bulk_timeout", cfg_section, 10.0)),
     )
-    parser.add_argument(
-        "-d", "--logdir",
-        default=log_folder,
-        help="Folder of a log file, default " + log_folder
+    logger.debug(
+        "Setup ThingSpeak bulk update: url = %s, window = %ss, capacity = %s",
+        url, window, capacity)
+
+
+def filter_factor(cfg=None):
+    """Return sanitized smoothing factor of filters at configured period.
+
+    Arguments
+    ---------
+    cfg : object
+        Configuration with the factor. If not provided, the current one is
+        used.
+
+    """
+    factor = float((cfg or config).option(
+        "filter_factor", "TimerTemperature", FILTER_FACTOR))
+    return max(min(factor, 1.0), 0.01)
+
+
+def register_filter(name, factory, **params):
+    """Register a type of smoothing filters.
+
+    Arguments
+    ---------
+    name : str
+        Name of the filter type used in the option ``type`` of filter
+        sections.
+    factory : callable
+        Function or class creating the filter, it accepts the argument
+        ``decimals`` and all parameters as keyword arguments.
+    params : dict
+        Default values of parameters configurable in filter sections. The
+        type of a default value is the type of the parameter.
+
+    """
+    filter_registry[name] = (factory, params)
+
+
+def setup_filter_registry():
+    """Register built-in types of smoothing filters."""
+    register_filter(
+        FILTER_EXPONENTIAL,
+        lambda decimals: FilterExponential(
+            decimals=decimals, factor=filter_factor()))
+    register_filter(FILTER_MEDIAN, FilterMedian, window=5)
+    register_filter(
+        FILTER_KALMAN, FilterKalman,
+        process_noise=0.01, measurement_noise=1.0)
+    register_filter(FILTER_TRIMMED, FilterTrimmedMean, window=5, trim=0.2)
+
+
+def create_filter(zone=None):
+    """Create an object with statistical smoothing and filtering.
+
+    Arguments
+    ---------
+    zone : str
+        Name of a temperature zone, whose filter is defined in the section
+        ``Filter:<zone>``. Options missing in it are taken from the section
+        ``Filter``, which defines the filter of the primary zone.
+
+    Notes
+    -----
+    - The factor of the exponential filter is defined by the option
+      ``filter_factor`` of the section ``TimerTemperature``, so that
+      adaptive sampling can follow it.
+
+    """
+    sections = ["Filter:" + zone, "Filter"] if zone else ["Filter"]
+
+    def option(name, default):
+        for section in sections:
+            value = config.option(name, section)
+            if value is not None:
+                return type(default)(value)
+        return default
+
+    name = option("type", FILTER_EXPONENTIAL).strip().lower()
+    if name not in filter_registry:
+        logger.warning(
+            "Unknown filter type %s of zone %s, using %s",
+            name, zone, FILTER_EXPONENTIAL)
+        name = FILTER_EXPONENTIAL
+    factory, params = filter_registry[name]
+    kwargs = {param: option(param, default)
+              for param, default in params.items()}
+    logger.debug(
+        "Setup filter: zone = %s, type = %s, parameters = %s",
+        zone, name, kwargs)
+    return factory(decimals=3, **kwargs)
+
+
+def setup_filter():
+    """Define statistical smoothing and filtering."""
+    global filter
+    if not filter_registry:
+        setup_filter_registry()
+    filter = create_filter()
+
+
+def setup_sensors():
+    """Define reading of temperature zones.
+
+    Notes
+    -----
+    - Without configured zones the temperature is measured by the GPIO
+      object from the SoC zone.
+    - Zones are listed as comma separated pairs ``name:path``. The value
+      ``auto`` discovers all thermal zones, the value of hwmon option
+      ``auto`` discovers all hwmon temperature inputs.
+    - The first zone is the primary one controlling the fan with the script
+      filter, each other zone gets its own filter.
+
+    """
+    global sensors, filters
+    cfg_section = "Sensors"
+    zones = []
+    for option, pattern in [
+        ("zones", "/sys/class/thermal/thermal_zone*/temp"),
+        ("hwmon", "/sys/class/hwmon/hwmon*/temp*_input"),
+    ]:
+        value = (config.option(option, cfg_section) or "").strip()
+        if value.lower() == "auto":
+            for path in sorted(glob.glob(pattern)):
+                folder, file = path.split("/")[-2:]
+                if file != "temp":
+                    folder += "_" + file.replace("_input", "")
+                zones.append((folder, path))
+        elif value:
+            for item in value.split(","):
+                name, _, path = item.strip().partition(":")
+                zones.append((name.strip(), path.strip()))
+    if not zones:
+        return
+    try:
+        sensors = SensorReader(zones)
+    except OSError as errmsg:
+        logger.error("Temperature zones cannot be opened: %s", errmsg)
+        return
+    filters = {}
+    for i, name in enumerate(sensors.names):
+        filters[name] = filter if i == 0 else create_filter(name)
+        if metrics is not None:
+            metrics.gauge(
+                "zone_{}_temperature".format(name),
+                functools.partial(filters[name].result))
+    logger.debug("Setup sensors: zones = %s", ", ".join(
+        "{}:{}".format(name, path) for name, path in zones))
+
+
+def setup_trigger():
+    """Define triggers for evaluating value limits."""
+    global trigger
+    trigger = modTrigger.Trigger()
+    setup_trigger_fan()
+
+
+def sanitize_fan_percentages(fan_perc_on, fan_perc_off):
+    """Limit fan percentages to their valid ranges and order.
+
+    Returns
+    -------
+    tuple of float
+        Sanitized percentages for fan ON and OFF.
+
+    """
+    fan_perc_on = max(min(float(fan_perc_on), pi.FAN_PERC_ON_MAX),
+                      pi.FAN_PERC_ON_MIN)
+    fan_perc_off = max(min(float(fan_perc_off), pi.FAN_PERC_OFF_MAX),
+                       pi.FAN_PERC_OFF_MIN)
+    if fan_perc_off > fan_perc_on:
+        fan_perc_off, fan_perc_on = fan_perc_on, fan_perc_off
+    return fan_perc_on, fan_perc_off
+
+
+def setup_trigger_fan(fan_perc_on=None, fan_perc_off=None):
+    """Define triggers for controlling fan by SoC temperature.
+
+    Arguments
+    ---------
+    fan_perc_on : float
+        Percentage of maximal temperature for turning fan on.
+    fan_perc_off : float
+        Percentage of maximal temperature for turning fan off.
+
+    """
+    # Sanitize parameters
+    pi.FAN_PERC_ON_CUR, pi.FAN_PERC_OFF_CUR = sanitize_fan_percentages(
+        fan_perc_on or pi.FAN_PERC_ON_CUR,
+        fan_perc_off or pi.FAN_PERC_OFF_CUR)
+    if fan_channels is not None:
+        setup_fan_channel_limits(
+            fan_channels.index(None),
+            pi.FAN_PERC_ON_CUR, pi.FAN_PERC_OFF_CUR)
+    pi.FAN_TEMP_ON_CUR = pi.convert_percentage_temperature(
+        pi.FAN_PERC_ON_CUR)
+    pi.FAN_TEMP_OFF_CUR = pi.convert_percentage_temperature(
+        pi.FAN_PERC_OFF_CUR)
+    # Set triggers
+    logger.debug(
+        "Setup fan triggers: %s = %s%%, %s = %s%%",
+        ON, pi.FAN_PERC_ON_CUR,
+        OFF, pi.FAN_PERC_OFF_CUR)
+    trigger.set_trigger(
+        id="fanon",
+        mode=modTrigger.UPPER,
+        value=pi.FAN_TEMP_ON_CUR,
+        callback=cbTrigger_fan,
+        cmd=CMD_FAN_ON,     # Arguments to callback
     )
-    parser.add_argument(
-        "-c", "--configuration",
-        action="store_true",
-        help="""Print configuration parameters in form of INI file content."""
+    trigger.set_trigger(
+        id="fanoff",
+        mode=modTrigger.LOWER,
+        value=pi.FAN_TEMP_OFF_CUR,
+        callback=cbTrigger_fan,
+        cmd=CMD_FAN_OFF,     # Arguments to callback
     )
-    # Process command line arguments
-    global cmdline
-    cmdline = parser.parse_args()
 
 
-def setup_logger():
-    """Configure logging facility."""
-    global logger
-    # Set logging to file for module and script logging
-    log_file = "/".join([cmdline.logdir, os.path.basename(__file__) + ".log"])
-    logging.basicConfig(
-        level=getattr(logging, cmdline.loglevel.upper()),
-        format="%(asctime)s - %(levelname)-8s - %(name)-20s: %(message)s",
-        filename=log_file,
-        filemode="w"
-    )
-    # Set console logging
-    formatter = logging.Formatter(
-        "%(levelname)-8s - %(name)-20s: %(message)s")
-    console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setLevel(getattr(logging, cmdline.verbose.upper()))
-    console_handler.setFormatter(formatter)
-    logger = logging.getLogger("{} {}".format(
-        os.path.basename(__file__), __version__))
-    logger.addHandler(console_handler)
-    logger.warning("Script started from file %s", os.path.abspath(__file__))
+def setup_fans():
+    """Define additional fan channels.
+
+    Notes
+    -----
+    - Channels are listed in the option ``channels`` of the section ``Fan``
+      and each of them is defined in its own section ``Fan:<name>`` with
+      fan pin, temperature zone, and percentages.
+    - With channels the primary fan becomes the channel ``None`` and all
+      channels are evaluated in one batched pass instead of triggers.
+    - Status and command topics of a channel are derived from the fan ones
+      by appending the channel name.
+
+    """
+    global fan_channels
+    channels = build_fan_channels(config)
+    if channels is None and fan_channels is None:
+        return
+    fan_channels = channels
+    if channels is not None:
+        logger.debug(
+            "Setup fan channels: %s", ", ".join(channels.names[1:]))
+    # Routes of channel commands if already connected to the broker
+    if mqtt is not None:
+        setup_mqtt_routes()
+
+
+def build_fan_channels(cfg, settings=None):
+    """Build additional fan channels from a configuration.
+
+    Arguments
+    ---------
+    cfg : object
+        Configuration with the list of fan channels and their sections.
+    settings : dict
+        Fan settings with default percentages of the primary fan. If not
+        provided, the current ones of the GPIO object are used.
+
+    Returns
+    -------
+    FanChannels
+        Fan channels including the primary one, or None without additional
+        channels.
+
+    Notes
+    -----
+    - Running channels keep their pins, because pin changes need restart,
+      and their current percentages unless their default ones changed.
+
+    """
+    names = [name.strip() for name in
+             (cfg.option("channels", "Fan") or "").split(",")
+             if name.strip()]
+    if not names:
+        return None
+    if settings is None:
+        perc_on_def, perc_off_def = pi.FAN_PERC_ON_DEF, pi.FAN_PERC_OFF_DEF
+    else:
+        perc_on_def = settings["FAN_PERC_ON_DEF"]
+        perc_off_def = settings["FAN_PERC_OFF_DEF"]
+    running = {}
+    if fan_channels is not None:
+        running = dict((name, index)
+                       for index, name in enumerate(fan_channels.names))
+    channels = FanChannels()
+    channels.add(None, pi.PIN_FAN, filter, perc_on_def, perc_off_def)
+    for name in names:
+        cfg_section = "Fan:" + name
+        source = cfg.option("sensor", cfg_section)
+        if source and source not in filters:
+            logger.warning(
+                "Unknown zone %s of fan %s, using primary one", source, name)
+        perc_on, perc_off = sanitize_fan_percentages(
+            abs(float(cfg.option(
+                "percentage_maxtemp_on", cfg_section, perc_on_def))),
+            abs(float(cfg.option(
+                "percentage_maxtemp_off", cfg_section, perc_off_def))))
+        pin = cfg.option("pin_fan_name", cfg_section)
+        if name in running:
+            pin = fan_channels.pins[running[name]]
+        channels.add(name, pin, filters.get(source, filter), perc_on, perc_off)
+    for index, name in enumerate(channels.names):
+        perc_on, perc_off = channels.perc_on[index], channels.perc_off[index]
+        old = running.get(name)
+        if old is not None and (perc_on, perc_off) == (
+                fan_channels.perc_on_def[old], fan_channels.perc_off_def[old]):
+            perc_on = fan_channels.perc_on[old]
+            perc_off = fan_channels.perc_off[old]
+        setup_fan_channel_limits(index, perc_on, perc_off, channels)
+    return channels
+
+
+def setup_fan_channel_limits(index, perc_on=None, perc_off=None,
+                             channels=None):
+    """Set sanitized percentages and temperature limits of a fan channel.
+
+    Arguments
+    ---------
+    index : int
+        Index of the fan channel.
+    perc_on, perc_off : float
+        Percentages of maximal temperature for turning the fan on and off.
+        If not provided, the current ones of the channel are used.
+    channels : FanChannels
+        Fan channels being set up. If not provided, the global ones are used.
+
+    """
+    if channels is None:
+        channels = fan_channels
+    perc_on, perc_off = sanitize_fan_percentages(
+        perc_on or channels.perc_on[index],
+        perc_off or channels.perc_off[index])
+    channels.set_limits(
+        index, perc_on, perc_off,
+        pi.convert_percentage_temperature(perc_on),
+        pi.convert_percentage_temperature(perc_off))
+    logger.debug(
+        "Setup fan %s limits: %s = %s%%, %s = %s%%",
+        channels.names[index], ON, perc_on, OFF, perc_off)
+
+
+def setup_sampling(period):
+    """Define adaptive period of temperature measurement.
+
+    Arguments
+    ---------
+    period : float
+        Configured measurement period in seconds.
+
+    """
+    global sampling
+    sampling = build_sampling(config, period)
+    if metrics is not None:
+        metrics.gauge("timer_temp_period_seconds", lambda: sampling.period)
+
+
+def build_sampling(cfg, period):
+    """Build adaptive period of temperature measurement from a configuration.
+
+    Returns
+    -------
+    AdaptiveSampling
+        Adaptive sampling or None for the fixed period.
+
+    """
+    cfg_section = "TimerTemperature"
+    mode = cfg.option("sampling", cfg_section, SAMPLING_FIXED).lower()
+    if mode != SAMPLING_ADAPTIVE:
+        return None
+    period_min = float(cfg.option("period_min", cfg_section, 1.0))
+    period_min = max(min(period_min, period), 0.5)
+    period_max = float(cfg.option("period_max", cfg_section, 60.0))
+    period_max = max(min(period_max, 300.0), period)
+    band = float(cfg.option("sampling_band", cfg_section, 5.0))
+    band = max(band, 0.0)
+    step = float(cfg.option("sampling_step", cfg_section, 0.5))
+    step = max(step, 0.01)
+    logger.debug(
+        "Setup adaptive sampling: period = %s ~ %ss, band = %s°C, "
+        "step = %s°C", period_min, period_max, band, step)
+    return AdaptiveSampling(
+        period, period_min, period_max, band=band, step=step)
+
+
+def setup_publish_sinks():
+    """Define workers publishing status updates to sinks.
+
+    Notes
+    -----
+    - Every sink has its own queue and worker thread, so that fan commands
+      just queue status updates and a slow or failing sink does not delay
+      other ones.
+    - The spool file is synced to disk by its own sink worker, so that
+      spooling does not block the publishing thread.
+
+    """
+    cfg_section = "Publish"
+    publish_sinks.clear()
+    if not config_flag("workers", cfg_section, True):
+        return
+    capacity = int(config.option("queue_size", cfg_section, 100))
+    capacity = max(min(capacity, 10000), 1)
+    sinks = [("mqtt", 1.0), ("thingspeak", 10.0), ("blynk", 5.0)]
+    if spool is not None:
+        sinks.append(("spool", 5.0))
+    for sink, timeout_def in sinks:
+        timeout = float(config.option(
+            "timeout_" + sink, cfg_section, timeout_def))
+        timeout = max(min(timeout, 600.0), 0.1)
+        worker = PublishSink(sink, capacity=capacity, timeout=timeout)
+        publish_sinks[sink] = worker
+        if metrics is not None:
+            for counter in ["replaced", "dropped", "failed", "timeouts"]:
+                metrics.gauge(
+                    "sink_{}_{}".format(sink, counter),
+                    functools.partial(getattr, worker, counter))
+            metrics.gauge("sink_{}_pending".format(sink), worker.__len__)
+        worker.start()
+        logger.debug(
+            "Setup sink %s: queue = %s, timeout = %ss",
+            sink, capacity, timeout)
+
+
+def setup_fan_actor():
+    """Define serializing of fan commands by the fan actor."""
+    global fan_actor
+    cfg_section = "Fan"
+    if not config_flag("actor", cfg_section, True):
+        return
+    capacity = int(config.option("queue_size", cfg_section, 100))
+    capacity = max(min(capacity, 10000), 1)
+    window = float(config.option("coalesce_window", cfg_section, 0.0))
+    window = max(min(window, 5.0), 0.0)
+    switch_interval = float(config.option("switch_interval", cfg_section, 0.0))
+    switch_interval = max(min(switch_interval, 3600.0), 0.0)
+    fan_actor = FanActor(
+        capacity=capacity, window=window, switch_interval=switch_interval)
+    if metrics is not None:
+        metrics.gauge("fan_actor_dropped", lambda: fan_actor.dropped)
+        metrics.gauge("fan_actor_coalesced", lambda: fan_actor.coalesced)
+        metrics.gauge("fan_actor_deferred", lambda: fan_actor.deferred)
+    fan_actor.start()
+    logger.debug(
+        "Setup fan actor: queue = %s, window = %ss, switch interval = %ss",
+        capacity, window, switch_interval)
+
+
+def setup_history():
+    """Define ring buffer of temperature history.
 
+    Notes
+    -----
+    - With a configured file the buffer is memory-mapped to it, so that
+      the history survives restarts of the script.
 
-def setup_config():
-    """Define configuration file management."""
-    global config
-    config = modConfig.Config(cmdline.config)
-    # Construct configuration file content
-    if cmdline.configuration:
-        config.get_content()
+    """
+    global history
+    cfg_section = "History"
+    capacity = int(config.option("capacity", cfg_section, 10000))
+    if capacity <= 0:
+        return
+    capacity = min(capacity, 10000000)
+    path = config.option("history_file", cfg_section)
+    chunk = int(config.option("chunk_size", cfg_section, 100))
+    chunk = max(min(chunk, 10000), 1)
+    try:
+        history = HistoryBuffer(path or None, capacity, chunk)
+    except (OSError, ValueError) as errmsg:
+        logger.error("History buffer %s cannot be mapped: %s", path, errmsg)
+        history = HistoryBuffer(None, capacity, chunk)
+    if metrics is not None:
+        metrics.gauge("history_records", history.__len__)
+    logger.debug(
+        "Setup history: file = %s, capacity = %s, records = %s, chunk = %s",
+        path, capacity, len(history), chunk)
 
 
-def setup_pi():
-    """Define GPIO control.
+def setup_store():
+    """Define local time-series store.
 
     Notes
     -----
-    - Operational pin names are stored in the object as attributes.
-    - Default fan percentage limits are stored in the object as attributes.
+    - The store is active only if its database file is configured.
 
     """
-    global pi
-    pi = modOrangePi.OrangePiOne()
-    pi.PIN_FAN = config.option("pin_fan_name", "Fan")
-    # pi.PIN_LED = config.option("pin_led_name", "Fan")
-    # Temperature percentage for fan ON
-    pi.FAN_PERC_ON_DEF = abs(float(config.option(
-        "percentage_maxtemp_on", "Fan", 85.0)))
-    pi.FAN_PERC_ON_MIN = 80.0
-    pi.FAN_PERC_ON_MAX = 95.0
-    pi.FAN_PERC_ON_CUR = pi.FAN_PERC_ON_DEF
-    # Temperature percentage for fan OFF
-    pi.FAN_PERC_OFF_DEF = abs(float(config.option(
-        "percentage_maxtemp_off", "Fan", 75.0)))
-    pi.FAN_PERC_OFF_MIN = 60.0
-    pi.FAN_PERC_OFF_MAX = 75.0
-    pi.FAN_PERC_OFF_CUR = pi.FAN_PERC_OFF_DEF
+    global store
+    cfg_section = "Store"
+    path = config.option("store_file", cfg_section)
+    if not path:
+        return
+    import sqlite3
+    retention_raw = float(config.option("retention_raw", cfg_section, 7.0))
+    retention_raw = max(min(retention_raw, 3650.0), 0.1)
+    retention_minute = float(
+        config.option("retention_minute", cfg_section, 90.0))
+    retention_minute = max(min(retention_minute, 3650.0), 1.0)
+    batch = int(config.option("batch_size", cfg_section, 60))
+    batch = max(min(batch, 10000), 1)
+    commit_period = float(config.option("commit_period", cfg_section, 60.0))
+    commit_period = max(min(commit_period, 3600.0), 1.0)
+    try:
+        store = TimeSeriesStore(
+            path, retention_raw=retention_raw * 86400.0,
+            retention_minute=retention_minute * 86400.0, batch=batch,
+            commit_period=commit_period)
+    except sqlite3.Error as errmsg:
+        logger.error("Store %s cannot be opened: %s", path, errmsg)
+        return
+    if metrics is not None:
+        metrics.gauge("store_commits", lambda: store.commits)
+        metrics.gauge("store_dropped", lambda: store.dropped)
+    store.start()
+    logger.debug(
+        "Setup store: file = %s, retention = %sd raw, %sd minute, "
+        "batch = %s, commit period = %ss",
+        path, retention_raw, retention_minute, batch, commit_period)
 
 
-def setup_mqtt():
-    """Define MQTT management."""
-    global mqtt
-    mqtt = modMQTT.MqttBroker(config)
-    mqtt.connect(
-        username=config.option("username", mqtt.GROUP_BROKER),
-        password=config.option("password", mqtt.GROUP_BROKER),
-        connect=cbMqtt_on_connect,
-        disconnect=cbMqtt_on_disconnect,
-        subscribe=cbMqtt_on_subscribe,
-        message=cbMqtt_on_message,
-    )
+def setup_telemetry():
+    """Define batched telemetry.
 
+    Notes
+    -----
+    - The telemetry is active only if its publishing period is configured.
+
+    """
+    global telemetry
+    cfg_section = "Telemetry"
+    telemetry = None
+    if float(config.option("period_publish", cfg_section, 0.0)) <= 0.0:
+        return
+    encoding = config.option(
+        "encoding", cfg_section, TELEMETRY_JSON).lower()
+    if encoding not in [TELEMETRY_JSON, TELEMETRY_BINARY]:
+        logger.warning(
+            "Unknown telemetry encoding %s, using %s",
+            encoding, TELEMETRY_JSON)
+        encoding = TELEMETRY_JSON
+    telemetry = Telemetry(
+        encoding=encoding,
+        per_topic=config_flag("per_topic", cfg_section, True))
+    logger.debug(
+        "Setup telemetry: encoding = %s, per topic = %s",
+        encoding, telemetry.per_topic)
 
-def setup_mqtt_filters():
-    """Define MQTT topic filters and subscribe to them.
+
+def setup_fleet():
+    """Define aggregation of temperatures of nodes of the fleet.
 
     Notes
     -----
-    - The function is called in on_connect callback function after successful
-      connection to a MQTT broker.
+    - The fleet is active only if its publishing period and the fleet topic
+      filter with a wildcard level of node names are configured.
+    - Nodes are expected to publish to topics with the same last levels as
+      the temperature and telemetry topics of the script.
 
     """
-    mqtt.callback_filters(
-        server_filter_data=cbMqtt_on_message_data,
-        server_filter_command=cbMqtt_on_message_command,
-    )
+    global fleet
+    cfg_section = "Fleet"
+    fleet = None
+    if float(config.option("period_publish", cfg_section, 0.0)) <= 0.0:
+        return
+    topic_filter = topic_name("server_filter_fleet", mqtt.GROUP_FILTERS)
+    if not topic_filter:
+        logger.warning("Fleet without topic filter server_filter_fleet")
+        return
+    levels = []
+    for option in ["server_data_temp", "server_data_telemetry"]:
+        topic = topic_name(option, mqtt.GROUP_TOPICS)
+        levels.append(topic.rsplit("/", 1)[-1] if topic else None)
+    capacity = int(config.option("capacity", cfg_section, 1000))
+    stale = max(float(config.option("stale", cfg_section, 60.0)), 1.0)
+    expire = float(config.option("expire", cfg_section, 3600.0))
+    factor = float(config.option("factor", cfg_section, 0.1))
     try:
-        mqtt.subscribe_filters()
-    except Exception as errcode:
-        logger.error(
-            "MQTT subscribtion to topic filters failed with error code %s",
-            errcode)
+        fleet = Fleet(
+            topic_filter, levels[0], levels[1],
+            capacity=max(min(capacity, 100000), 1),
+            stale=stale,
+            expire=max(expire, stale),
+            factor=max(min(factor, 1.0), 0.01),
+        )
+    except ValueError as errmsg:
+        logger.error("Fleet cannot be aggregated: %s", errmsg)
+        return
+    if metrics is not None:
+        metrics.gauge("fleet_nodes", fleet.__len__)
+        for counter in ["messages", "invalid", "evicted", "expired"]:
+            metrics.gauge(
+                "fleet_" + counter,
+                functools.partial(getattr, fleet, counter))
+    logger.debug(
+        "Setup fleet: filter = %s, capacity = %s, stale = %ss, expire = %ss",
+        topic_filter, fleet.capacity, fleet.stale, fleet.expire)
 
 
-def setup_thingspeak():
-    """Define ThingSpeak management."""
-    global thingspeak
-    thingspeak = modMQTT.ThingSpeak(config)
-    thingspeak.FIELD_TEMP = int(config.option("field_temp",
-                                              thingspeak.GROUP_BROKER, 1))
-    thingspeak.FIELD_FAN = int(config.option("field_fan",
-                                             thingspeak.GROUP_BROKER, 2))
+def setup_crossing():
+    """Define evaluation of fan limits at every sample.
 
+    Notes
+    -----
+    - In the legacy mode ``prescale`` the fan limits are evaluated by the
+      prescaled timer callback ``cbTimer_temp_triggers`` instead.
 
-def setup_filter():
-    """Define statistical smoothing and filtering."""
-    global filter
-    filter = modFilter.StatFilterExponential(
-        decimals=3,
-        factor=0.2
-    )
-    # filter = gbj_statfilter.StatFilterRunning(
-    #     decimals=3,
-    #     stat_type=gbj_statfilter.MEDIAN,
-    # )
+    """
+    global crossing
+    crossing = build_crossing(config)
+    if metrics is not None:
+        metrics.gauge("crossing_suppressed", lambda: crossing.suppressed)
 
 
-def setup_trigger():
-    """Define triggers for evaluating value limits."""
-    global trigger
-    trigger = modTrigger.Trigger()
-    setup_trigger_fan()
+def build_crossing(cfg):
+    """Build evaluation of fan limits at every sample from a configuration.
 
+    Returns
+    -------
+    CrossingDetector
+        Crossing detector or None in the legacy mode ``prescale``.
 
-def setup_trigger_fan(fan_perc_on=None, fan_perc_off=None):
-    """Define triggers for controlling fan by SoC temperature.
+    """
+    cfg_section = "TimerTemperature"
+    mode = cfg.option("triggers", cfg_section, TRIGGERS_SAMPLE).lower()
+    if mode == TRIGGERS_PRESCALE:
+        logger.debug("Setup fan limits evaluation: mode = %s", mode)
+        return None
+    debounce = int(cfg.option("debounce", cfg_section, 1))
+    debounce = max(min(debounce, 100), 1)
+    dwell = float(cfg.option("dwell", cfg_section, 0.0))
+    dwell = max(min(dwell, 3600.0), 0.0)
+    logger.debug(
+        "Setup fan limits evaluation: mode = %s, debounce = %s, dwell = %ss",
+        TRIGGERS_SAMPLE, debounce, dwell)
+    return CrossingDetector(debounce=debounce, dwell=dwell)
+
+
+def setup_predictor():
+    """Define prediction of temperature trend for the fan."""
+    global predictor
+    predictor = build_predictor(config)
+    if metrics is not None:
+        metrics.gauge("predict_slope", lambda: predictor.slope())
+        metrics.gauge("predict_forecast", lambda: predictor.forecast())
+        metrics.gauge("predict_switches", lambda: predictor.switches)
+        metrics.gauge("throttle_events", lambda: predictor.throttle_events)
+        metrics.gauge("throttle_avoided", lambda: predictor.throttle_avoided)
+
+
+def build_predictor(cfg):
+    """Build prediction of temperature trend from a configuration."""
+    cfg_section = "Fan"
+    window = float(cfg.option("predict_window", cfg_section, 30.0))
+    window = max(min(window, 600.0), 2.0)
+    horizon = float(cfg.option("predict_horizon", cfg_section, 20.0))
+    horizon = max(min(horizon, 600.0), 0.0)
+    logger.debug(
+        "Setup fan prediction: window = %ss, horizon = %ss",
+        window, horizon)
+    return FanPredictor(window=window, horizon=horizon)
+
+
+def setup_policies():
+    """Define publish policies of periodically published temperature.
+
+    Notes
+    -----
+    - Policy of temperature publishing to MQTT is configured in the section
+      of the temperature timer, policy of ThingSpeak timer in the section of
+      ThingSpeak. Both have the same options.
+
+    """
+    global policy_temp, policy_thingspeak
+    policy_temp, policy_thingspeak = build_policies(config)
+
+
+def build_policies(cfg):
+    """Build publish policies from a configuration.
+
+    Returns
+    -------
+    tuple of PublishPolicy
+        Policies of temperature publishing to MQTT and to ThingSpeak.
+
+    """
+    policies = {}
+    for name, cfg_section in [
+        ("temp", "TimerTemperature"),
+        ("thingspeak", thingspeak.GROUP_BROKER),
+    ]:
+        policies[name] = PublishPolicy(
+            deadband=float(cfg.option("deadband", cfg_section, 0.0)),
+            deadband_perc=float(cfg.option(
+                "deadband_perc", cfg_section, 0.0)),
+            interval_min=float(cfg.option(
+                "interval_min", cfg_section, 0.0)),
+            heartbeat=float(cfg.option("heartbeat", cfg_section, 0.0)),
+        )
+        logger.debug("Setup publish policy %s: %s", name, policies[name])
+    return policies["temp"], policies["thingspeak"]
+
+
+def setup_timers(start=True):
+    """Define dictionary of timers.
 
     Arguments
     ---------
-    fan_perc_on : float
-        Percentage of maximal temperature for turning fan on.
-    fan_perc_off : float
-        Percentage of maximal temperature for turning fan off.
+    start : bool
+        Flag about starting timer threads in threads runtime. Without it
+        timers are just defined and their ticks can be driven directly, e.g.,
+        by benchmarks.
+
+    Notes
+    -----
+    - Timers are defined in the runtime independent form and started either
+      as timer threads or as coroutines of the event loop.
 
     """
-    # Sanitize parameters
-    pi.FAN_PERC_ON_CUR = max(min(float(fan_perc_on or pi.FAN_PERC_ON_CUR),
-                                 pi.FAN_PERC_ON_MAX),
-                             pi.FAN_PERC_ON_MIN)
-    pi.FAN_PERC_OFF_CUR = max(min(float(fan_perc_off or pi.FAN_PERC_OFF_CUR),
-                                  pi.FAN_PERC_OFF_MAX),
-                              pi.FAN_PERC_OFF_MIN)
-    if pi.FAN_PERC_OFF_CUR > pi.FAN_PERC_ON_CUR:
-        pi.FAN_PERC_OFF_CUR, pi.FAN_PERC_ON_CUR \
-            = pi.FAN_PERC_ON_CUR, pi.FAN_PERC_OFF_CUR
-    # Set triggers
+    # Timer 01
+    name = "Timer_temp"
+    timers[name] = setup_timer_temp(name)
+    # Timer 02
+    name = "Timer_thingspeak"
+    cfg_section = thingspeak.GROUP_BROKER
+    # Measurement period
+    c_period = float(config.option("period_publish", cfg_section, 60.0))
+    c_period = max(c_period, thingspeak.get_publish_delay())
     logger.debug(
-        "Setup fan triggers: %s = %s%%, %s = %s%%",
-        ON, pi.FAN_PERC_ON_CUR,
-        OFF, pi.FAN_PERC_OFF_CUR)
-    trigger.set_trigger(
-        id="fanon",
-        mode=modTrigger.UPPER,
-        value=pi.convert_percentage_temperature(pi.FAN_PERC_ON_CUR),
-        callback=cbTrigger_fan,
-        cmd=CMD_FAN_ON,     # Arguments to callback
-    )
-    trigger.set_trigger(
-        id="fanoff",
-        mode=modTrigger.LOWER,
-        value=pi.convert_percentage_temperature(pi.FAN_PERC_OFF_CUR),
-        callback=cbTrigger_fan,
-        cmd=CMD_FAN_OFF,     # Arguments to callback
-    )
+        "Setup timer %s: period = %ss",
+        name, c_period)
+    # Definition
+    timers[name] = {
+        "period": c_period,
+        "callback": cbTimer_thingspeak,
+    }
+    # Timer 03
+    name = "Timer_metrics"
+    cfg_section = "Metrics"
+    # Publishing period
+    c_period = float(config.option("period_publish", cfg_section, 0.0))
+    if metrics is not None and c_period > 0.0:
+        c_period = max(c_period, 1.0)
+        logger.debug(
+            "Setup timer %s: period = %ss",
+            name, c_period)
+        # Definition
+        timers[name] = {
+            "period": c_period,
+            "callback": cbTimer_metrics,
+        }
+    # Timer 04
+    name = "Timer_telemetry"
+    cfg_section = "Telemetry"
+    # Publishing period
+    c_period = float(config.option("period_publish", cfg_section, 0.0))
+    if telemetry is not None and c_period > 0.0:
+        c_period = max(c_period, 1.0)
+        logger.debug(
+            "Setup timer %s: period = %ss",
+            name, c_period)
+        # Definition
+        timers[name] = {
+            "period": c_period,
+            "callback": cbTimer_telemetry,
+        }
+    # Timer 05
+    name = "Timer_fleet"
+    cfg_section = "Fleet"
+    # Publishing period
+    c_period = float(config.option("period_publish", cfg_section, 0.0))
+    if fleet is not None and c_period > 0.0:
+        c_period = max(c_period, 1.0)
+        logger.debug(
+            "Setup timer %s: period = %ss",
+            name, c_period)
+        # Definition
+        timers[name] = {
+            "period": c_period,
+            "callback": cbTimer_fleet,
+        }
+    # Schedules
+    for name, definition in timers.items():
+        definition["schedule"] = TimerSchedule(
+            definition["period"],
+            deadline=scheduler == SCHEDULER_DEADLINE,
+            overrun=overrun,
+        )
+        if metrics is not None:
+            setup_timer_metrics(name, definition["schedule"])
+    # Start all timers
+    if start and runtime == RUNTIME_THREADS:
+        setup_timers_threads()
 
 
-def setup_timers():
-    """Define dictionary of timers."""
-    # Timer 01
-    name = "Timer_temp"
+def setup_timer_temp(name):
+    """Define the timer of temperature measurement.
+
+    Returns
+    -------
+    dict
+        Definition of the timer without its schedule.
+
+    Notes
+    -----
+    - The timer is dynamic, i.e., it can change its period at running,
+      with adaptive sampling or with reloading of the configuration.
+
+    """
+    definition = build_timer_temp(config, name, crossing)
+    setup_sampling(definition["period"])
+    definition["dynamic"] = sampling is not None or config_watcher is not None
+    return definition
+
+
+def build_timer_temp(cfg, name, detector):
+    """Build the definition of the measurement timer from a configuration.
+
+    Arguments
+    ---------
+    cfg : object
+        Configuration with the section of the timer.
+    name : str
+        Name of the timer.
+    detector : CrossingDetector
+        Crossing detector evaluating fan limits at every sample or None for
+        evaluating them by a prescaled callback.
+
+    Returns
+    -------
+    dict
+        Definition of the timer without its schedule and dynamic flag.
+
+    """
     cfg_section = "TimerTemperature"
     # Measurement period
-    c_period = float(config.option("period_measure", cfg_section, 5.0))
+    c_period = float(cfg.option("period_measure", cfg_section, 5.0))
     c_period = max(min(c_period, 60.0), 1.0)
     # Publishing prescale
-    c_publish = int(config.option("prescale_publish", cfg_section, 3))
+    c_publish = int(cfg.option("prescale_publish", cfg_section, 3))
     c_publish = max(min(c_publish, 10), 1)
     # Trigger evaluation prescale
-    c_triggers = int(config.option("prescale_triggers", cfg_section, 6))
+    c_triggers = int(cfg.option("prescale_triggers", cfg_section, 6))
     c_triggers = max(min(c_triggers, 1000), 1)
     logger.debug(
         "Setup timer %s: period = %ss, publish = %sx, triggers = %sx",
         name, c_period, c_publish, c_triggers)
     # Definition
-    timer1 = modTimer.Timer(
-        c_period,
-        cbTimer_temp_measure,
-        name=name,
-        # count=9,
-    )
-    timer1.prescaler(c_publish, cbTimer_temp_publish)
-    timer1.prescaler(c_triggers, cbTimer_temp_triggers)
-    modTimer.register_timer(name, timer1)
-    # Timer 02
-    name = "Timer_thingspeak"
-    cfg_section = thingspeak.GROUP_BROKER
-    # Measurement period
-    c_period = float(config.option("period_publish", cfg_section, 60.0))
-    c_period = max(c_period, thingspeak.get_publish_delay())
-    logger.debug(
-        "Setup timer %s: period = %ss",
-        name, c_period)
-    # Definition
-    timer2 = modTimer.Timer(
-        c_period,
-        cbTimer_thingspeak,
-        name=name,
-        # count=9,
-    )
-    modTimer.register_timer(name, timer2)
-    # Start all timers
+    definition = {
+        "period": c_period,
+        "callback": cbTimer_temp_measure,
+        "prescalers": [
+            (c_publish, cbTimer_temp_publish),
+        ],
+    }
+    # Triggers are evaluated at every sample unless in legacy mode
+    if detector is None:
+        definition["prescalers"].append(
+            (c_triggers, cbTimer_temp_triggers))
+    return definition
+
+
+def setup_timer_metrics(name, schedule):
+    """Register lateness statistics of a timer as metrics gauges."""
+    prefix = name.lower()
+    metrics.gauge(prefix + "_lateness_p50_seconds",
+                  lambda: schedule.percentile(0.5))
+    metrics.gauge(prefix + "_lateness_p99_seconds",
+                  lambda: schedule.percentile(0.99))
+    metrics.gauge(prefix + "_skipped", lambda: schedule.skipped)
+
+
+def setup_timers_threads():
+    """Create and start timer threads from timer definitions."""
+    for name, definition in timers.items():
+        # Timer threads of the library cannot change their period
+        if scheduler == SCHEDULER_DEADLINE or definition.get("dynamic"):
+            definition["timer"] = DeadlineTimer(name, definition)
+            definition["timer"].start()
+            continue
+        timer = modTimer.Timer(
+            definition["period"],
+            functools.partial(timer_fire, definition),
+            name=name,
+            # count=9,
+        )
+        for prescale, callback in definition.get("prescalers", []):
+            timer.prescaler(prescale, state_locked(callback))
+        modTimer.register_timer(name, timer)
+        definition["schedule"].start(clock.monotonic())
     modTimer.start_timers()
 
 
+def timer_fire(definition, *args, **kwargs):
+    """Register a tick of a timer thread and execute its callback."""
+    definition["schedule"].fire(clock.monotonic())
+    with state_lock:
+        work = definition["callback"](*args, **kwargs)
+    if work is not None:
+        work()
+    definition["schedule"].done(clock.monotonic())
+
+
 def setup_blynk():
-    """Define Blynk parameters."""
-    global blynk
+    """Define Blynk parameters.
+
+    Notes
+    -----
+    - The Blynk library is imported only if the Blynk authorization token
+      is configured.
+    - The object is published to the global variable only after storing
+      its parameters, because it can be set up in the background.
+
+    """
+    global blynk, modBlynk
     config_group = "Blynk"
-    blynk = modBlynk.Blynk(config.option("blynk_auth", config_group))
-    blynk.on_connect(cbBlynk_on_connect)
+    auth = config.option("blynk_auth", config_group)
+    if not auth:
+        logger.debug("Blynk not configured")
+        return
+    import importlib
+    modBlynk = importlib.import_module("BlynkLib")
+    client = modBlynk.Blynk(auth)
+    client.on_connect(runtime_callback(cbBlynk_on_connect))
     # Store Blynk colors
-    blynk.COLOR_GREEN = "#23C48E"
-    blynk.COLOR_BLUE = "#04C0F8"
-    blynk.COLOR_YELLOW = "#ED9D00"
-    blynk.COLOR_RED = "#D3435C"
-    blynk.COLORDARK_BLUE = "#5F7CD8"
+    client.COLOR_GREEN = "#23C48E"
+    client.COLOR_BLUE = "#04C0F8"
+    client.COLOR_YELLOW = "#ED9D00"
+    client.COLOR_RED = "#D3435C"
+    client.COLORDARK_BLUE = "#5F7CD8"
     # Store virtual pins
-    blynk.VPIN_TEMP = abs(int(config.option("vpin_temp", config_group)))
-    blynk.VPIN_FAN_LED = abs(int(config.option("vpin_fan_led", config_group)))
-    blynk.VPIN_FAN_BTN = abs(int(config.option("vpin_fan_btn", config_group)))
-    blynk.VPIN_FAN_PERCON = abs(int(config.option("vpin_fan_percon",
-                                                  config_group)))
-    blynk.VPIN_FAN_PERCOFF = abs(int(config.option("vpin_fan_percoff",
+    client.VPIN_TEMP = abs(int(config.option("vpin_temp", config_group)))
+    client.VPIN_FAN_LED = abs(int(config.option("vpin_fan_led", config_group)))
+    client.VPIN_FAN_BTN = abs(int(config.option("vpin_fan_btn", config_group)))
+    client.VPIN_FAN_PERCON = abs(int(config.option("vpin_fan_percon",
                                                    config_group)))
+    client.VPIN_FAN_PERCOFF = abs(int(config.option("vpin_fan_percoff",
+                                                    config_group)))
+    blynk = client
 
     @blynk.VIRTUAL_WRITE(blynk.VPIN_FAN_BTN)
+    @runtime_callback
+    @instrumented
     def blynk_fan_button(button_state):
         """Receive command for fan from mobile app.
 
@@ -939,6 +6605,8 @@ def setup_blynk():
         blynk.virtual_write(blynk.VPIN_TEMP, filter.result())
 
     @blynk.VIRTUAL_WRITE(blynk.VPIN_FAN_PERCON)
+    @runtime_callback
+    @instrumented
     def blynk_fan_percon(value):
         """Receive temperature percentage for fan ON from mobile app.
 
@@ -954,6 +6622,8 @@ def setup_blynk():
         action_fan(CMD_FAN_PERCON, value)
 
     @blynk.VIRTUAL_WRITE(blynk.VPIN_FAN_PERCOFF)
+    @runtime_callback
+    @instrumented
     def blynk_fan_percoff(value):
         """Receive temperature percentage for fan OFF from mobile app.
 
@@ -969,45 +6639,275 @@ def setup_blynk():
         action_fan(CMD_FAN_PERCOFF, value)
 
 
+def setup_runtime():
+    """Define runtime mode of the script.
+
+    Notes
+    -----
+    - The threads runtime utilizes timer threads and a blocking script loop.
+    - The asyncio runtime runs measuring, publishing, triggers evaluation,
+      and processing of MQTT and Blynk callbacks as coroutines in a single
+      event loop.
+    - The deadline scheduler fires timers on absolute deadlines, so that
+      long running callbacks do not accumulate drift, in both runtimes.
+
+    """
+    global runtime
+    cfg_section = "Runtime"
+    runtime = config.option("mode", cfg_section, RUNTIME_THREADS).lower()
+    if runtime not in [RUNTIME_THREADS, RUNTIME_ASYNCIO]:
+        logger.warning(
+            "Unknown runtime mode %s, using %s", runtime, RUNTIME_THREADS)
+        runtime = RUNTIME_THREADS
+    global scheduler, overrun
+    scheduler = config.option(
+        "scheduler", cfg_section, SCHEDULER_RELATIVE).lower()
+    if scheduler not in [SCHEDULER_RELATIVE, SCHEDULER_DEADLINE]:
+        logger.warning(
+            "Unknown scheduler %s, using %s", scheduler, SCHEDULER_RELATIVE)
+        scheduler = SCHEDULER_RELATIVE
+    overrun = config.option("overrun", cfg_section, OVERRUN_SKIP).lower()
+    if overrun not in [OVERRUN_SKIP, OVERRUN_CATCHUP]:
+        logger.warning(
+            "Unknown overrun policy %s, using %s", overrun, OVERRUN_SKIP)
+        overrun = OVERRUN_SKIP
+    global startup
+    startup = config.option(
+        "startup", cfg_section, STARTUP_SEQUENTIAL).lower()
+    if startup not in [STARTUP_SEQUENTIAL, STARTUP_FAST]:
+        logger.warning(
+            "Unknown startup mode %s, using %s", startup, STARTUP_SEQUENTIAL)
+        startup = STARTUP_SEQUENTIAL
+    logger.debug(
+        "Setup runtime: mode = %s, scheduler = %s, overrun = %s, "
+        "startup = %s", runtime, scheduler, overrun, startup)
+
+
 def setup():
     """Global initialization."""
-    pass
+    global script_event
+    script_event = threading.Event()
 
 
 def loop():
     """Wait for keyboard or system exit."""
+    if config_watcher is not None:
+        config_watcher.start()
+    if runtime == RUNTIME_ASYNCIO:
+        loop_asyncio()
+        return
     try:
-        global blynk
-        if blynk is None:
-            logger.info("Script loop started")
-            while (script_run):
-                time.sleep(1)
-            logger.warning("Script finished")
-        else:
-            logger.info("Script run by BLYNK")
-            blynk.run()
+        # Blynk blocks in its socket loop, so that it is run in background
+        # in order to let the exit command wake up the loop
+        if blynk is not None and startup != STARTUP_FAST:
+            logger.info("Blynk run in background thread")
+            threading.Thread(
+                target=blynk.run, name="Blynk", daemon=True).start()
+        logger.info("Script loop started")
+        while (script_run):
+            script_event.wait(1)
+        logger.warning("Script finished")
+    except (KeyboardInterrupt, SystemExit):
+        logger.warning("Script cancelled")
+    finally:
+        shutdown()
+
+
+def shutdown():
+    """Stop timers and workers and release resources at the script exit."""
+    if config_watcher is not None:
+        config_watcher.stop()
+    timers_stop()
+    if fan_actor is not None:
+        fan_actor.stop()
+    for worker in publish_sinks.values():
+        worker.stop()
+    timers_report()
+    if spool is not None:
+        spool.close()
+    if history is not None:
+        history.close()
+    if store is not None:
+        store.stop()
+    if sensors is not None:
+        sensors.close()
+    shutdown_logger()
+
+
+def loop_asyncio():
+    """Run the script in the single asyncio event loop until exit."""
+    import asyncio
+    try:
+        logger.info("Script loop started in asyncio runtime")
+        asyncio.run(main_asyncio())
+        logger.warning("Script finished")
     except (KeyboardInterrupt, SystemExit):
         logger.warning("Script cancelled")
     finally:
-        modTimer.stop_timers()
+        shutdown()
+
+
+async def main_asyncio():
+    """Run all coroutines of the script and wait for the script exit.
+
+    Notes
+    -----
+    - The MQTT client keeps its network thread and the Blynk library keeps
+      its blocking socket loop in a daemon thread. Both of them only schedule
+      their callbacks in the event loop, so that all processing happens in it.
+
+    """
+    global aioloop, aioloop_event
+    import asyncio
+    aioloop = asyncio.get_running_loop()
+    aioloop_event = asyncio.Event()
+    tasks = []
+    for name, definition in timers.items():
+        tasks.append(asyncio.ensure_future(async_timer(name, definition)))
+    if blynk is not None and startup != STARTUP_FAST:
+        logger.info("Blynk run in background thread")
+        threading.Thread(target=blynk.run, name="Blynk", daemon=True).start()
+    try:
+        while script_run:
+            await aioloop_event.wait()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        aioloop = None
+
+
+def setup_first_sample():
+    """Measure the first sample right away, which switches fans if needed."""
+    cbTimer_temp_measure()
+    if crossing is None:
+        cbTimer_temp_triggers()
+
+
+def setup_steps():
+    """Return setup steps of the script objects in their order.
+
+    Notes
+    -----
+    - The steps follow reading of the configuration and the runtime mode.
+    - The first sample is measured before starting timers, so that the fan
+      control is live right after the setup.
+
+    """
+    return [
+        setup_pi,
+        setup_spool,
+        setup_mqtt,
+        connect_mqtt,
+        setup_thingspeak,
+        setup_filter,
+        setup_sensors,
+        setup_trigger,
+        setup_fans,
+        setup_predictor,
+        setup_crossing,
+        setup_publish_sinks,
+        setup_fan_actor,
+        setup_policies,
+        setup_telemetry,
+        setup_history,
+        setup_store,
+        setup_fleet,
+        setup_first_sample,
+        setup_timers,
+        setup_blynk,
+        setup,
+    ]
+
+
+def setup_script(fast=False, skip=(), start=True):
+    """Set up the script objects by the ordered setup steps.
+
+    Arguments
+    ---------
+    fast : bool
+        Flag about fast startup, which runs the connection steps in the
+        background after all other steps, so that the fan control is live
+        before any network handshake.
+    skip : iterable
+        Setup steps not to be run, e.g., by tools driving the script.
+    start : bool
+        Flag about starting timers, see ``setup_timers``.
+
+    Notes
+    -----
+    - Objects of MQTT and ThingSpeak are created in both startup modes,
+      so that publishing is spooled or skipped until connections are ready.
+
+    """
+    connections = [connect_mqtt, setup_blynk]
+    deferred = []
+    for step in setup_steps():
+        if step in skip:
+            continue
+        if fast and step in connections:
+            deferred.append(step)
+            continue
+        if step is setup_timers:
+            step(start)
+        else:
+            step()
+    if fast:
+        setup_connections(deferred)
+    else:
+        startup_mark("ready")
 
 
 def main():
     """Fundamental control function."""
+    global startup_begin
+    startup_begin = clock.monotonic()
     setup_cmdline()
     setup_logger()
     setup_config()
-    setup_pi()
-    setup_mqtt()
-    setup_thingspeak()
-    setup_filter()
-    setup_trigger()
-    setup_timers()
-    setup_blynk()
-    setup()
+    setup_runtime()
+    setup_config_watch()
+    setup_metrics()
+    setup_script(fast=(startup == STARTUP_FAST))
     loop()
 
 
+def setup_connections(tasks):
+    """Run connection steps concurrently in background.
+
+    Arguments
+    ---------
+    tasks : list
+        Setup steps connecting to cloud services, e.g., MQTT broker and
+        Blynk.
+
+    """
+    def connect(task):
+        try:
+            task()
+        except Exception as errmsg:
+            logger.error("Startup task %s failed: %s", task.__name__, errmsg)
+
+    def connect_all():
+        workers = [
+            threading.Thread(
+                target=connect, args=(task,), name=task.__name__,
+                daemon=True)
+            for task in tasks
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        if blynk is not None:
+            logger.info("Blynk run in background thread")
+            threading.Thread(
+                target=blynk.run, name="Blynk", daemon=True).start()
+        startup_mark("ready")
+
+    threading.Thread(target=connect_all, name="Startup", daemon=True).start()
+
+
 if __name__ == "__main__":
     if os.getegid() != 0:
         sys.exit('Script must be run as root')
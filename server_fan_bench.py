@@ -0,0 +1,614 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""End-to-end latency benchmarks of the script server_fan.
+
+Script runs the control paths of the script ``server_fan`` against
+a simulated board and in-process stand-ins of the cloud services:
+
+- The board of the script is a simulated one with settable temperature
+  and recorded pin writes.
+- The MQTT broker is replaced by an in-process stand-in recording published
+  messages, ThingSpeak and Blynk by stubs recording their publishing.
+- Timers are not started, their ticks are driven by the benchmark directly.
+- The fan actor runs without the minimal switching interval and benchmarks
+  wait for it realizing queued commands and for sink workers publishing
+  status updates.
+
+Benchmarks measure:
+
+- ``command_fan``: latency from a message in the fan command topic through
+  ``action_fan`` to the GPIO change and to the fan status publishing,
+  and number of GPIO reads per command.
+- ``temperature_crossing``: ticks and time from crossing of the fan ON
+  temperature to the fan switch.
+- ``command_throughput``: messages per second through command handlers.
+- ``filters``: per-sample cost of streaming and batch filtering, lag of
+  a step response, and noise reduction of each registered filter type.
+- ``fleet``: messages per second aggregated from nodes of the fleet.
+
+Results are printed as JSON and can be compared with a baseline result file
+in order to catch regressions between releases.
+
+"""
+__version__ = "0.1.0"
+__status__ = "Beta"
+__author__ = "Libor Gabaj"
+__copyright__ = "Copyright 2018, " + __author__
+__credits__ = [__author__]
+__license__ = "MIT"
+__maintainer__ = __author__
+__email__ = "libor.gabaj@gmail.com"
+
+# Standard library modules
+import time
+import os
+import os.path
+import sys
+import argparse
+import json
+import platform
+import random
+import tempfile
+# Custom library modules
+import server_fan as sf
+
+
+###############################################################################
+# Simulated hardware and stand-ins
+###############################################################################
+class SimulatedBoard(object):
+    """Simulated OrangePi board with settable temperature.
+
+    Notes
+    -----
+    - All pin writes are recorded with their performance counter time.
+    - Pin reads are counted.
+    - The maximal temperature of the simulated SoC is 100°C.
+
+    """
+
+    TEMP_MAX = 100.0
+
+    def __init__(self):
+        self.temperature = 50.0
+        self.writes = []  # Pairs (time, pin, state)
+        self.reads = 0  # Counter of pin reads
+        self._pins = {}
+
+    def pin_on(self, pin):
+        self._pins[pin] = 1
+        self.writes.append((time.perf_counter(), pin, 1))
+
+    def pin_off(self, pin):
+        self._pins[pin] = 0
+        self.writes.append((time.perf_counter(), pin, 0))
+
+    def pin_state(self, pin):
+        self.reads += 1
+        return self._pins.get(pin, 0)
+
+    def is_pin_on(self, pin):
+        return self.pin_state(pin) == 1
+
+    def is_pin_off(self, pin):
+        return self.pin_state(pin) == 0
+
+    def measure_temperature(self):
+        return self.temperature
+
+    def convert_percentage_temperature(self, percentage):
+        return self.TEMP_MAX * percentage / 100.0
+
+    def convert_temperature_percentage(self, temperature):
+        return 100.0 * temperature / self.TEMP_MAX
+
+
+class LocalClient(object):
+    """In-process stand-in of the MQTT client recording publishing."""
+
+    def __init__(self, broker):
+        self.broker = broker
+
+    def publish(self, topic, message, qos=0):
+        self.broker.published.append((time.perf_counter(), topic, message))
+
+
+class LocalBroker(object):
+    """In-process stand-in of the MQTT broker client.
+
+    Arguments
+    ---------
+    config : object
+        Configuration of the script for resolving topics.
+
+    Notes
+    -----
+    - Connection is made synchronously and the connect callback is called
+      immediately.
+    - All published messages are recorded with their performance counter
+      time.
+
+    """
+
+    GROUP_BROKER = "MQTTbroker"
+    GROUP_TOPICS = "MQTTtopics"
+    GROUP_FILTERS = "MQTTfilters"
+
+    def __init__(self, config):
+        self._config = config
+        self._connected = False
+        self.published = []  # Triples (time, topic, message)
+        self._client = LocalClient(self)
+
+    def __str__(self):
+        return "LocalBroker"
+
+    def connect(self, **kwargs):
+        self._connected = True
+        callback = kwargs.get("connect")
+        if callback is not None:
+            callback(None, None, {}, 0)
+
+    def get_connected(self):
+        return self._connected
+
+    def topic_name(self, option, section=None):
+        value = self._config.option(option, section or self.GROUP_TOPICS)
+        if value is None:
+            return None
+        return value.split(",")[0].strip()
+
+    def publish(self, message, option, section=None):
+        self.published.append(
+            (time.perf_counter(), self.topic_name(option, section), message))
+
+    def callback_filters(self, **kwargs):
+        self.filters = kwargs
+
+    def subscribe_filters(self):
+        pass
+
+
+class StubThingSpeak(LocalBroker):
+    """Stub of the ThingSpeak client recording publishing."""
+
+    GROUP_BROKER = "ThingSpeak"
+
+    def get_publish_delay(self):
+        return 15.0
+
+    def publish(self, fields=None, status=None):
+        self.published.append((time.perf_counter(), fields, status))
+        return True
+
+
+class StubBlynk(object):
+    """Stub of the Blynk client recording virtual pin writes."""
+
+    VPIN_TEMP = 1
+    VPIN_FAN_LED = 2
+    VPIN_FAN_BTN = 3
+    VPIN_FAN_PERCON = 4
+    VPIN_FAN_PERCOFF = 5
+
+    def __init__(self):
+        self.writes = []
+
+    def virtual_write(self, pin, value):
+        self.writes.append((time.perf_counter(), pin, value))
+
+
+class Message(object):
+    """Stand-in of MQTT message."""
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload.encode("utf-8")
+        self.qos = 0
+        self.retain = False
+
+
+###############################################################################
+# Helper functions
+###############################################################################
+def percentiles(values):
+    """Return summary statistics of a list of durations in seconds."""
+    values = sorted(values)
+    if not values:
+        return {}
+    return {
+        "count": len(values),
+        "min": values[0],
+        "p50": values[int(0.5 * (len(values) - 1))],
+        "p99": values[int(0.99 * (len(values) - 1))],
+        "max": values[-1],
+        "mean": sum(values) / len(values),
+    }
+
+
+def deviation(values):
+    """Return standard deviation of a list of values."""
+    mean = sum(values) / len(values)
+    return (sum((value - mean) ** 2 for value in values) / len(values)) ** 0.5
+
+
+def setup_script(config_file, logdir, loglevel):
+    """Set up the script with simulated board and stand-ins.
+
+    Returns
+    -------
+    tuple
+        Simulated board and local broker.
+
+    """
+    sys.argv = [sf.__file__, config_file,
+                "-d", logdir, "-l", loglevel, "-v", "critical"]
+    sf.setup_cmdline()
+    sf.setup_logger()
+    sf.setup_config()
+    sf.setup_runtime()
+    board = SimulatedBoard()
+    sf.board_factory = lambda: board
+    sf.modMQTT.MqttBroker = LocalBroker
+    sf.modMQTT.ThingSpeak = StubThingSpeak
+    # Timers are only defined, their ticks are driven by benchmarks
+    sf.setup_script(skip=[sf.setup_blynk], start=False)
+    if sf.fan_actor is not None:
+        # Relay protection would defer repeated switching of benchmarks
+        sf.fan_actor.switch_interval = 0.0
+    sf.blynk = StubBlynk()
+    return board, sf.mqtt
+
+
+def wait_workers():
+    """Wait for the fan actor and sink workers processing queued items."""
+    if sf.fan_actor is not None:
+        sf.fan_actor.wait()
+    for worker in sf.publish_sinks.values():
+        worker.wait()
+
+
+###############################################################################
+# Benchmarks
+###############################################################################
+def bench_command_fan(board, broker, iterations):
+    """Measure latency of fan commands to GPIO change and status publishing.
+
+    Returns
+    -------
+    dict
+        Statistics of latencies to GPIO write and to status publishing,
+        and of GPIO reads per command.
+
+    """
+    topic = broker.topic_name("server_command_fan")
+    topic_status = broker.topic_name("server_status_fan")
+    latency_gpio = []
+    latency_status = []
+    reads = []
+    for i in range(iterations):
+        board.writes = []
+        board.reads = 0
+        broker.published = []
+        start = time.perf_counter()
+        sf.cbMqtt_on_message_command(None, None, Message(topic, sf.TOGGLE))
+        wait_workers()
+        reads.append(board.reads)
+        if board.writes:
+            latency_gpio.append(board.writes[0][0] - start)
+        for published, published_topic, _ in broker.published:
+            if published_topic == topic_status:
+                latency_status.append(published - start)
+                break
+    return {
+        "gpio_seconds": percentiles(latency_gpio),
+        "status_seconds": percentiles(latency_status),
+        "gpio_reads": percentiles(reads),
+    }
+
+
+def bench_temperature_crossing(board, broker, iterations):
+    """Measure ticks and time from temperature crossing to fan switch.
+
+    Returns
+    -------
+    dict
+        Statistics of ticks, configured time, and processing time from
+        crossing of the fan ON temperature to switching the fan on, and
+        ticks from crossing of it by the filtered temperature.
+
+    """
+    definition = sf.timers["Timer_temp"]
+    temp_on = sf.pi.convert_percentage_temperature(sf.pi.FAN_PERC_ON_CUR)
+    temp_off = sf.pi.convert_percentage_temperature(sf.pi.FAN_PERC_OFF_CUR)
+    ticks_list = []
+    detection = []
+    latency = []
+    processing = []
+    tick = 0
+    for i in range(iterations):
+        # Cool down with fan off
+        board.temperature = temp_off - 10.0
+        sf.action_fan(sf.CMD_FAN_OFF)
+        wait_workers()
+        for _ in range(50):
+            tick += 1
+            sf.timer_execute(definition, tick)
+        # Step over the fan ON temperature
+        board.temperature = temp_on + 5.0
+        board.writes = []
+        ticks = 0
+        crossed = None
+        duration = 0.0
+        while not board.writes and ticks < 1000:
+            tick += 1
+            ticks += 1
+            start = time.perf_counter()
+            sf.timer_execute(definition, tick)
+            wait_workers()
+            duration += time.perf_counter() - start
+            if crossed is None and sf.filter.result() >= temp_on:
+                crossed = ticks
+        ticks_list.append(ticks)
+        detection.append(ticks - (crossed or ticks))
+        latency.append(ticks * definition["period"])
+        processing.append(duration)
+    return {
+        "ticks": percentiles(ticks_list),
+        "detection_ticks": percentiles(detection),
+        "latency_seconds": percentiles(latency),
+        "processing_seconds": percentiles(processing),
+    }
+
+
+def bench_command_throughput(board, broker, iterations):
+    """Measure messages per second through command handlers.
+
+    Returns
+    -------
+    dict
+        Number of messages, duration, and rate of processing.
+
+    """
+    messages = [
+        Message(broker.topic_name("server_command_fan_percon"), "90"),
+        Message(broker.topic_name("server_command_fan_percoff"), "70"),
+        Message(broker.topic_name("server_command_fan"), sf.TOGGLE),
+        Message(broker.topic_name("server_command_test"), "test"),
+    ]
+    start = time.perf_counter()
+    for i in range(iterations):
+        sf.cbMqtt_on_message_command(
+            None, None, messages[i % len(messages)])
+    wait_workers()
+    duration = time.perf_counter() - start
+    return {
+        "messages": iterations,
+        "seconds": duration,
+        "messages_per_second": iterations / duration if duration else None,
+    }
+
+
+def bench_fleet(board, broker, iterations):
+    """Measure messages per second aggregated from nodes of the fleet.
+
+    Returns
+    -------
+    dict
+        Number of messages and nodes, duration and rate of processing, and
+        duration of calculating fleet aggregates.
+
+    Notes
+    -----
+    - Messages of temperature and of JSON telemetry from 100 nodes go
+      through the callback of the fleet topic filter.
+
+    """
+    fleet, sf.fleet = sf.fleet, sf.Fleet(
+        "+/server/data/#", "temp", "telemetry", capacity=1000)
+    nodes = 100
+    messages = []
+    for i in range(nodes):
+        topic = "node{:03d}/server/data/".format(i)
+        messages.append(Message(topic + "temp", "{:.1f}".format(40.0 + i)))
+        messages.append(Message(
+            topic + "telemetry", json.dumps({"temp": 40.0 + i, "fan": 0})))
+    count = max(iterations, len(messages))
+    start = time.perf_counter()
+    for i in range(count):
+        sf.cbMqtt_on_message_fleet(None, None, messages[i % len(messages)])
+    duration = time.perf_counter() - start
+    start = time.perf_counter()
+    sf.fleet.aggregate()
+    aggregate = time.perf_counter() - start
+    sf.fleet = fleet
+    return {
+        "messages": count,
+        "nodes": nodes,
+        "seconds": duration,
+        "messages_per_second": count / duration if duration else None,
+        "aggregate_seconds": aggregate,
+    }
+
+
+def bench_filters(board, broker, iterations):
+    """Measure per-sample cost and smoothing of registered filter types.
+
+    Returns
+    -------
+    dict
+        For each filter type seconds per sample of streaming and of batch
+        filtering, samples until the output reaches 90 % of a step of the
+        temperature, and ratio of standard deviations of output and input
+        noise.
+
+    Notes
+    -----
+    - Filters are created with default parameters of their types.
+    - The noise is pseudorandom with a fixed seed, so that runs compare.
+
+    """
+    samples = max(iterations, 100)
+    generator = random.Random(0)
+    noise = [50.0 + generator.gauss(0.0, 1.0) for _ in range(samples)]
+    step = [40.0] * 10 + [50.0] * (samples - 10)
+    results = {}
+    for name in sorted(sf.filter_registry):
+        factory, params = sf.filter_registry[name]
+        stream_filter = factory(decimals=3, **params)
+        start = time.perf_counter()
+        for value in noise:
+            stream_filter.result(value)
+        stream = (time.perf_counter() - start) / samples
+        batch_filter = factory(decimals=3, **params)
+        start = time.perf_counter()
+        output = batch_filter.batch(noise)
+        batch = (time.perf_counter() - start) / samples
+        # Noise after settling of the filter
+        ratio = deviation(output[samples // 10:]) \
+            / deviation(noise[samples // 10:])
+        lag = None
+        for index, value in enumerate(factory(decimals=3, **params).batch(
+                step)[10:]):
+            if value >= 49.0:
+                lag = index
+                break
+        results[name] = {
+            "stream_seconds_per_sample": stream,
+            "batch_seconds_per_sample": batch,
+            "lag_samples": lag,
+            "noise_ratio": ratio,
+        }
+    return results
+
+
+BENCHMARKS = {
+    "command_fan": bench_command_fan,
+    "temperature_crossing": bench_temperature_crossing,
+    "command_throughput": bench_command_throughput,
+    "filters": bench_filters,
+    "fleet": bench_fleet,
+}
+
+# Key metrics for regression check with flag about higher is better
+REGRESSION_KEYS = [
+    ("command_fan", "gpio_seconds", "p50", False),
+    ("command_fan", "status_seconds", "p50", False),
+    ("command_fan", "gpio_reads", "max", False),
+    ("temperature_crossing", "latency_seconds", "p50", False),
+    ("temperature_crossing", "processing_seconds", "p50", False),
+    ("command_throughput", "messages_per_second", None, True),
+    ("fleet", "messages_per_second", None, True),
+]
+
+
+def compare(results, baseline, tolerance):
+    """Compare results with baseline ones.
+
+    Returns
+    -------
+    list of str
+        Descriptions of regressions exceeding the tolerance.
+
+    """
+    regressions = []
+    for bench, key, stat, higher in REGRESSION_KEYS:
+        try:
+            current = results["results"][bench][key]
+            previous = baseline["results"][bench][key]
+            if stat is not None:
+                current, previous = current[stat], previous[stat]
+        except (KeyError, TypeError):
+            continue
+        if not previous or current is None:
+            continue
+        ratio = current / previous
+        if (higher and ratio < 1.0 - tolerance) \
+                or (not higher and ratio > 1.0 + tolerance):
+            regressions.append("{}.{}{}: {} -> {}".format(
+                bench, key, "." + stat if stat else "", previous, current))
+    return regressions
+
+
+def main():
+    """Fundamental control function."""
+    config_file = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "server_fan.ini.sample")
+    parser = argparse.ArgumentParser(
+        description="Benchmarks of server_fan, version " + __version__
+    )
+    parser.add_argument(
+        "-c", "--config",
+        default=config_file,
+        help="Configuration INI file, default: " + config_file
+    )
+    parser.add_argument(
+        "-n", "--iterations",
+        type=int,
+        default=1000,
+        help="Number of iterations of each benchmark."
+    )
+    parser.add_argument(
+        "-b", "--benchmark",
+        choices=sorted(BENCHMARKS),
+        action="append",
+        help="Benchmark to run, default all."
+    )
+    parser.add_argument(
+        "-l", "--loglevel",
+        choices=["debug", "warning", "info", "error", "critical"],
+        default="warning",
+        help="Level of logging to log file of the script."
+    )
+    parser.add_argument(
+        "-o", "--output",
+        help="File for JSON results, default standard output."
+    )
+    parser.add_argument(
+        "--baseline",
+        help="JSON results file of a previous run to compare with."
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Relative tolerance of regressions, default 0.2."
+    )
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory(prefix="server_fan_bench_") as logdir:
+        board, broker = setup_script(args.config, logdir, args.loglevel)
+        results = {
+            "version": sf.__version__,
+            "bench_version": __version__,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "timestamp": time.time(),
+            "iterations": args.iterations,
+            "runtime": sf.runtime,
+            "results": {},
+        }
+        try:
+            for name in args.benchmark or sorted(BENCHMARKS):
+                results["results"][name] = BENCHMARKS[name](
+                    board, broker, args.iterations)
+        finally:
+            # Workers, stores, and the logger release files in the folder
+            sf.shutdown()
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as result_file:
+            result_file.write(output + "\n")
+    else:
+        print(output)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(
+                results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            sys.stderr.write("Regression {}\n".format(regression))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
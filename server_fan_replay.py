@@ -0,0 +1,493 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Accelerated replay of temperature traces through the script server_fan.
+
+Script feeds a temperature trace through the control path of the script
+``server_fan`` on a virtual clock much faster than real time:
+
+- The clock of the script is a virtual one, which is advanced by
+  the measurement period after every tick of the measurement timer, so that
+  filters, triggers, crossing detection, predictive control, and adaptive
+  sampling run exactly as on the board.
+- The board of the script is a simulated one with the SoC temperature from
+  the trace. Publishing of fans and temperature is skipped.
+- Fan commands are realized right away without the fan actor, so that the
+  minimal switching interval of the fan actor is not simulated.
+
+Traces are either recorded ones or synthetic ones:
+
+- A CSV file with time in seconds and temperature in °C per line.
+- A time-series store database of the script with its raw samples.
+- A synthetic thermal model of the SoC with periodic load, which reacts
+  to the fan, unlike recorded traces.
+
+Every replay reports number of fan switchings, time above a temperature
+limit, and duty cycle of the fan. A parameter sweep replays the trace with
+all combinations of configuration values in parallel processes.
+
+"""
+__version__ = "0.1.0"
+__status__ = "Beta"
+__author__ = "Libor Gabaj"
+__copyright__ = "Copyright 2018, " + __author__
+__credits__ = [__author__]
+__license__ = "MIT"
+__maintainer__ = __author__
+__email__ = "libor.gabaj@gmail.com"
+
+# Standard library modules
+import time
+import os
+import os.path
+import sys
+import argparse
+import json
+import math
+import bisect
+import csv
+import sqlite3
+import tempfile
+import itertools
+import configparser
+import multiprocessing
+# Custom library modules
+import server_fan as sf
+
+
+###############################################################################
+# Virtual clock, traces, and simulated hardware
+###############################################################################
+class VirtualClock(object):
+    """Virtual clock of the script instead of the module ``time``.
+
+    Notes
+    -----
+    - Wall, monotonic, and performance time are the same virtual time.
+    - Other functions of the module ``time`` are the original ones.
+
+    """
+
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def perf_counter(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class RecordedTrace(object):
+    """Recorded temperature trace interpolated linearly between points.
+
+    Arguments
+    ---------
+    points : list of tuple
+        Pairs of time in seconds and temperature in °C.
+
+    """
+
+    def __init__(self, points):
+        points = sorted(
+            (float(t), float(temp)) for t, temp in points if temp is not None)
+        if len(points) < 2:
+            raise ValueError("Trace needs at least two points")
+        self.times = [t for t, _ in points]
+        self.temps = [temp for _, temp in points]
+        self.start = self.times[0]
+        self.end = self.times[-1]
+
+    def temperature(self, now, fan_on=False):
+        """Return temperature at a time regardless of the fan."""
+        index = bisect.bisect_right(self.times, now)
+        if index <= 0:
+            return self.temps[0]
+        if index >= len(self.times):
+            return self.temps[-1]
+        t0, t1 = self.times[index - 1], self.times[index]
+        temp0, temp1 = self.temps[index - 1], self.temps[index]
+        return temp0 + (temp1 - temp0) * (now - t0) / (t1 - t0)
+
+    @classmethod
+    def from_csv(cls, path):
+        """Read a trace from a CSV file skipping lines without numbers."""
+        points = []
+        with open(path) as trace_file:
+            for row in csv.reader(trace_file):
+                try:
+                    points.append((float(row[0]), float(row[1])))
+                except (IndexError, ValueError):
+                    continue
+        return cls(points)
+
+    @classmethod
+    def from_store(cls, path):
+        """Read a trace from raw samples of a time-series store."""
+        connection = sqlite3.connect(path)
+        try:
+            points = connection.execute(
+                "SELECT ts, coalesce(raw, temp) FROM samples ORDER BY ts"
+            ).fetchall()
+        finally:
+            connection.close()
+        return cls(points)
+
+
+class ThermalModel(object):
+    """Synthetic first order thermal model of the SoC with periodic load.
+
+    Arguments
+    ---------
+    duration : float
+        Length of the trace in seconds.
+    ambient : float
+        Ambient temperature in °C.
+    idle : float
+        Steady temperature in °C at idle load without the fan.
+    busy : float
+        Steady temperature in °C at busy load without the fan.
+    fan_gain : float
+        Ratio of heat dissipation with the fan to the one without it.
+    time_constant : float
+        Thermal time constant in seconds without the fan.
+    load_period : float
+        Period in seconds of alternating busy and idle load of equal length.
+
+    Notes
+    -----
+    - The temperature is integrated exactly between consecutive queries,
+      so that the result does not depend on the measurement period.
+
+    """
+
+    def __init__(self, duration=86400.0, ambient=30.0, idle=55.0, busy=100.0,
+                 fan_gain=2.0, time_constant=120.0, load_period=1200.0):
+        self.start = 0.0
+        self.end = duration
+        self.ambient = ambient
+        self.idle = idle
+        self.busy = busy
+        self.fan_gain = fan_gain
+        self.time_constant = time_constant
+        self.load_period = load_period
+        self._state = (0.0, idle)
+
+    def temperature(self, now, fan_on=False):
+        """Return temperature at a time with the fan state since last one."""
+        last, temp = self._state
+        half = self.load_period / 2.0
+        while last < now:
+            # Integration up to the nearest change of load
+            phase = last % self.load_period
+            busy = phase < half
+            boundary = last - phase + (half if busy else self.load_period)
+            step = min(now, boundary) - last
+            gain = self.fan_gain if fan_on else 1.0
+            steady = self.ambient + \
+                ((self.busy if busy else self.idle) - self.ambient) / gain
+            temp = steady + (temp - steady) * math.exp(
+                -step * gain / self.time_constant)
+            last += step
+        self._state = (now, temp)
+        return temp
+
+
+class ReplayBoard(object):
+    """Simulated OrangePi board reading temperature from a trace.
+
+    Notes
+    -----
+    - The fan state during a measurement period is the one after the tick
+      at its beginning, which is counted into the statistics.
+    - The maximal temperature of the simulated SoC is 100°C.
+
+    """
+
+    TEMP_MAX = 100.0
+
+    def __init__(self, trace, clock):
+        self.trace = trace
+        self.clock = clock
+        self.temperature = trace.temperature(clock.now)
+        self.switches = 0
+        self._pins = {}
+
+    def pin_on(self, pin):
+        if not self._pins.get(pin):
+            self.switches += 1
+        self._pins[pin] = 1
+
+    def pin_off(self, pin):
+        if self._pins.get(pin):
+            self.switches += 1
+        self._pins[pin] = 0
+
+    def pin_state(self, pin):
+        return self._pins.get(pin, 0)
+
+    def is_pin_on(self, pin):
+        return self.pin_state(pin) == 1
+
+    def is_pin_off(self, pin):
+        return self.pin_state(pin) == 0
+
+    def measure_temperature(self):
+        return self.temperature
+
+    def convert_percentage_temperature(self, percentage):
+        return self.TEMP_MAX * percentage / 100.0
+
+    def convert_temperature_percentage(self, temperature):
+        return 100.0 * temperature / self.TEMP_MAX
+
+
+###############################################################################
+# Helper functions
+###############################################################################
+def load_trace(spec):
+    """Create a trace from its specification.
+
+    Arguments
+    ---------
+    spec : str
+        Path to a CSV file, path to a store database with extension ``.db``,
+        or ``synthetic`` optionally followed by colon separated duration in
+        hours, ambient, idle, and busy temperature, e.g.,
+        ``synthetic:24:30:55:100``.
+
+    """
+    if spec.startswith("synthetic"):
+        names = ["duration", "ambient", "idle", "busy"]
+        values = [float(value) for value in spec.split(":")[1:]]
+        kwargs = dict(zip(names, values))
+        if "duration" in kwargs:
+            kwargs["duration"] *= 3600.0
+        return ThermalModel(**kwargs)
+    if spec.endswith(".db"):
+        return RecordedTrace.from_store(spec)
+    return RecordedTrace.from_csv(spec)
+
+
+def write_config(base_file, overrides, path):
+    """Write a configuration file with overridden options.
+
+    Arguments
+    ---------
+    base_file : str
+        Base configuration INI file.
+    overrides : dict
+        Values of options by pairs of section and option.
+    path : str
+        Path to the written configuration file.
+
+    """
+    parser = configparser.ConfigParser(interpolation=None)
+    parser.optionxform = str
+    parser.read(base_file)
+    for (section, option), value in overrides.items():
+        if section != parser.default_section \
+                and not parser.has_section(section):
+            parser.add_section(section)
+        parser.set(section, option, str(value))
+    with open(path, "w") as config_file:
+        parser.write(config_file)
+
+
+def parse_option(text):
+    """Parse an option ``Section.option=value1,value2`` into its parts."""
+    name, _, values = text.partition("=")
+    section, _, option = name.rpartition(".")
+    if not section or not option or not values:
+        raise argparse.ArgumentTypeError(
+            "Option {} is not in form Section.option=value".format(text))
+    return (section, option), values.split(",")
+
+
+###############################################################################
+# Replay
+###############################################################################
+def replay(job):
+    """Replay a trace through the control path with a configuration.
+
+    Arguments
+    ---------
+    job : tuple
+        Configuration file, trace specification, overridden options for the
+        report, and temperature limit in °C for time above it.
+
+    Returns
+    -------
+    dict
+        Overridden options and statistics of the replay.
+
+    Notes
+    -----
+    - The function runs in a fresh worker process, because the script keeps
+      its state in module globals.
+
+    """
+    config_file, trace_spec, overrides, limit = job
+    trace = load_trace(trace_spec)
+    clock = VirtualClock(trace.start)
+    board = ReplayBoard(trace, clock)
+    sf.clock = clock
+    sf.board_factory = lambda: board
+    sf.fan_publisher = lambda name, switched, updated: None
+    sys.argv = [sf.__file__, config_file,
+                "-d", os.path.dirname(config_file), "-l", "critical",
+                "-v", "critical"]
+    sf.setup_cmdline()
+    sf.setup_logger()
+    sf.setup_config()
+    # Connections, workers, and stores are not simulated
+    sf.setup_script(skip=[
+        sf.connect_mqtt,
+        sf.setup_blynk,
+        sf.setup_spool,
+        sf.setup_sensors,
+        sf.setup_publish_sinks,
+        sf.setup_fan_actor,
+        sf.setup_telemetry,
+        sf.setup_history,
+        sf.setup_store,
+        sf.setup_fleet,
+        sf.setup_first_sample,
+    ], start=False)
+    definition = sf.timers["Timer_temp"]
+    definition["prescalers"] = [
+        (prescale, callback) for prescale, callback in definition["prescalers"]
+        if callback is not sf.cbTimer_temp_publish]
+    definition["schedule"].start(clock.now)
+    started = time.perf_counter()
+    stats = {"samples": 0, "on": 0.0, "above": 0.0, "sum": 0.0}
+    temp_max = None
+    tick = 0
+    while clock.now < trace.end:
+        tick += 1
+        sf.timer_execute(definition, tick)
+        fan_on = board.is_pin_on(sf.pi.PIN_FAN)
+        period = min(definition["schedule"].period, trace.end - clock.now)
+        stats["samples"] += 1
+        stats["sum"] += board.temperature * period
+        if fan_on:
+            stats["on"] += period
+        if board.temperature >= limit:
+            stats["above"] += period
+        if temp_max is None or board.temperature > temp_max:
+            temp_max = board.temperature
+        clock.now += period
+        board.temperature = trace.temperature(clock.now, fan_on)
+    sf.shutdown()
+    duration = trace.end - trace.start
+    return {
+        "options": dict(
+            ("{}.{}".format(*key), value) for key, value in overrides.items()),
+        "samples": stats["samples"],
+        "switches": board.switches,
+        "switches_per_hour": round(board.switches * 3600.0 / duration, 3),
+        "time_above_limit_seconds": round(stats["above"], 3),
+        "duty_cycle": round(stats["on"] / duration, 4),
+        "temp_max": round(temp_max, 3),
+        "temp_mean": round(stats["sum"] / duration, 3),
+        "speedup": round(duration / (time.perf_counter() - started), 1),
+    }
+
+
+def main():
+    """Fundamental control function."""
+    config_file = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "server_fan.ini.sample")
+    parser = argparse.ArgumentParser(
+        description="Replay and parameter sweep of server_fan, version "
+        + __version__
+    )
+    parser.add_argument(
+        "-c", "--config",
+        default=config_file,
+        help="Configuration INI file, default: " + config_file
+    )
+    parser.add_argument(
+        "-t", "--trace",
+        default="synthetic",
+        help="CSV file, store database *.db, or "
+        "synthetic[:hours[:ambient[:idle[:busy]]]], default synthetic."
+    )
+    parser.add_argument(
+        "-s", "--set",
+        type=parse_option,
+        action="append",
+        default=[],
+        help="Overridden option in form Section.option=value."
+    )
+    parser.add_argument(
+        "-w", "--sweep",
+        type=parse_option,
+        action="append",
+        default=[],
+        help="Swept option in form Section.option=value1,value2,..., "
+        "all combinations of swept options are replayed."
+    )
+    parser.add_argument(
+        "--limit",
+        type=float,
+        default=80.0,
+        help="Temperature limit in °C for time above it, default 80.0."
+    )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of parallel processes, default number of CPUs."
+    )
+    parser.add_argument(
+        "--sort",
+        default="switches",
+        help="Result key for sorting replays, default switches."
+    )
+    parser.add_argument(
+        "-o", "--output",
+        help="File for JSON results, default standard output."
+    )
+    args = parser.parse_args()
+    fixed = dict((key, values[-1]) for key, values in args.set)
+    swept = [key for key, _ in args.sweep]
+    with tempfile.TemporaryDirectory(prefix="server_fan_replay_") as workdir:
+        jobs = []
+        for index, combination in enumerate(
+                itertools.product(*[values for _, values in args.sweep])):
+            overrides = dict(fixed)
+            overrides.update(zip(swept, combination))
+            path = os.path.join(workdir, "replay_{}.ini".format(index))
+            write_config(args.config, overrides, path)
+            jobs.append((path, args.trace, overrides, args.limit))
+        # Fresh process for every replay because of module globals
+        with multiprocessing.Pool(
+                processes=max(min(args.jobs, len(jobs)), 1),
+                maxtasksperchild=1) as pool:
+            results = pool.map(replay, jobs, chunksize=1)
+    results.sort(key=lambda result: result.get(args.sort, 0))
+    output = json.dumps({
+        "version": sf.__version__,
+        "replay_version": __version__,
+        "trace": args.trace,
+        "limit": args.limit,
+        "results": results,
+    }, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as result_file:
+            result_file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
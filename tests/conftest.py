@@ -0,0 +1,410 @@
+"""Common fixtures of tests of the script server_fan.
+
+Libraries of the author ``gbj_pythonlib_sw`` and ``gbj_pythonlib_hw`` are
+replaced by in-tree fakes if they are not installed, so that the script can
+be imported and tested in a plain checkout.
+
+"""
+import configparser
+import importlib
+import io
+import logging
+import os.path
+import sys
+import time
+import types
+
+import pytest
+
+sys.path.insert(
+    0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+###############################################################################
+# Fakes of libraries of the author
+###############################################################################
+class FakeConfig(object):
+    """Configuration read from an INI file object."""
+
+    def __init__(self, file):
+        self._parser = configparser.ConfigParser()
+        self._parser.read_file(file)
+
+    def option(self, option, section="DEFAULT", default=None):
+        try:
+            return self._parser.get(section, option)
+        except (configparser.NoSectionError, configparser.NoOptionError):
+            return default
+
+    def options(self, section):
+        return self._parser.options(section)
+
+    def get_content(self):
+        return self._parser
+
+
+class FakeClient(object):
+    """MQTT client recording publishing and subscriptions."""
+
+    def __init__(self):
+        self.published = []  # Triples (topic, message, qos)
+        self.subscribed = []  # Topic filters
+        self.unsubscribed = []  # Topic filters
+
+    def publish(self, topic, message, qos=0, retain=False, properties=None):
+        self.published.append((topic, message, qos))
+
+    def subscribe(self, topic, qos=0):
+        self.subscribed.append(topic)
+
+    def unsubscribe(self, topic):
+        self.unsubscribed.append(topic)
+
+
+class FakeMqttBroker(object):
+    """MQTT broker connection connecting synchronously."""
+
+    GROUP_BROKER = "MQTTbroker"
+    GROUP_TOPICS = "MQTTtopics"
+    GROUP_FILTERS = "MQTTfilters"
+
+    def __init__(self, config):
+        self._config = config
+        self._connected = False
+        self._client = FakeClient()
+        self.published = []  # Pairs (topic, message)
+
+    def __str__(self):
+        return "FakeMqttBroker"
+
+    def connect(self, **kwargs):
+        self._connected = True
+        callback = kwargs.get("connect")
+        if callback is not None:
+            callback(None, None, {}, 0)
+
+    def disconnect(self):
+        self._connected = False
+
+    def get_connected(self):
+        return self._connected
+
+    def topic_name(self, option, section=None):
+        value = self._config.option(option, section or self.GROUP_TOPICS)
+        if value is None:
+            return None
+        return value.split(",")[0].strip()
+
+    def publish(self, message, option, section=None):
+        self.published.append((self.topic_name(option, section), message))
+
+    def callback_filters(self, **kwargs):
+        self.filters = kwargs
+
+    def subscribe_filters(self):
+        pass
+
+
+class FakeThingSpeak(FakeMqttBroker):
+    """ThingSpeak channel recording publishing."""
+
+    GROUP_BROKER = "ThingSpeak"
+
+    def get_publish_delay(self):
+        return 15.0
+
+    def publish(self, fields=None, status=None):
+        self.published.append((fields, status))
+        return True
+
+
+class FakeStatFilterExponential(object):
+    """Exponential smoothing of values."""
+
+    def __init__(self, decimals=None, factor=0.5):
+        self._decimals = decimals
+        self.factor = factor
+        self._value = None
+
+    def result(self, value=None):
+        if value is not None:
+            value = float(value)
+            if self._value is None:
+                self._value = value
+            else:
+                self._value = self.factor * value \
+                    + (1 - self.factor) * self._value
+        if self._value is None:
+            return None
+        return round(self._value, self._decimals)
+
+    def reset(self):
+        self._value = None
+
+
+class FakeTimer(object):
+    """Timer with prescalers, which is never started by tests."""
+
+    def __init__(self, period, callback, name=None, count=None):
+        self.period = period
+        self.callback = callback
+        self.prescalers = []  # Pairs (prescale, callback)
+
+    def prescaler(self, prescale, callback):
+        self.prescalers.append((prescale, callback))
+
+
+class FakeTrigger(object):
+    """Triggers of callbacks by crossing of value limits."""
+
+    UPPER = "upper"
+    LOWER = "lower"
+
+    def __init__(self):
+        self.triggers = {}
+
+    def set_trigger(self, id, mode, value, callback, **kwargs):
+        self.triggers[id] = (mode, value, callback, kwargs)
+
+    def exec_triggers(self, value, ids=None):
+        if value is None:
+            return
+        for id in ids or list(self.triggers):
+            mode, limit, callback, kwargs = self.triggers[id]
+            if (mode == self.UPPER and value >= limit) \
+                    or (mode == self.LOWER and value <= limit):
+                callback(**kwargs)
+
+
+class FakeOrangePiOne(object):
+    """Board with settable temperature and in-memory pins."""
+
+    PIN_FAN = "PA13"
+    PIN_LED = "STATUS_LED"
+    FAN_PERC_ON_DEF = 90.0
+    FAN_PERC_OFF_DEF = 60.0
+    TEMP_MAX = 100.0
+
+    def __init__(self):
+        self.temperature = 50.0
+        self.pins = {}
+
+    def pin_on(self, pin):
+        self.pins[pin] = 1
+
+    def pin_off(self, pin):
+        self.pins[pin] = 0
+
+    def pin_state(self, pin):
+        return self.pins.get(pin, 0)
+
+    def is_pin_on(self, pin):
+        return self.pin_state(pin) == 1
+
+    def is_pin_off(self, pin):
+        return self.pin_state(pin) == 0
+
+    def measure_temperature(self):
+        return self.temperature
+
+    def convert_percentage_temperature(self, percentage):
+        return self.TEMP_MAX * percentage / 100.0
+
+    def convert_temperature_percentage(self, temperature):
+        return 100.0 * temperature / self.TEMP_MAX
+
+
+def fake_module(name, **attributes):
+    """Register a fake module with attributes in imported modules."""
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    sys.modules[name] = module
+    package, _, child = name.rpartition(".")
+    if package:
+        setattr(sys.modules[package], child, module)
+    return module
+
+
+def install_fakes():
+    """Register fakes of libraries of the author not installed."""
+    timers = {}
+    fakes = {
+        "gbj_pythonlib_sw": {
+            "config": dict(Config=FakeConfig),
+            "mqtt": dict(MqttBroker=FakeMqttBroker,
+                         ThingSpeak=FakeThingSpeak),
+            "statfilter": dict(
+                StatFilterExponential=FakeStatFilterExponential),
+            "timer": dict(
+                Timer=FakeTimer,
+                register_timer=timers.__setitem__,
+                start_timers=lambda: None,
+                stop_timers=lambda: None),
+            "trigger": dict(Trigger=FakeTrigger, UPPER=FakeTrigger.UPPER,
+                            LOWER=FakeTrigger.LOWER),
+        },
+        "gbj_pythonlib_hw": {
+            "orangepi": dict(OrangePiOne=FakeOrangePiOne),
+        },
+    }
+    for package, modules in fakes.items():
+        try:
+            importlib.import_module(package)
+        except ImportError:
+            fake_module(package, __path__=[])
+            for name, attributes in modules.items():
+                fake_module("{}.{}".format(package, name), **attributes)
+
+
+install_fakes()
+
+
+###############################################################################
+# Fixtures
+###############################################################################
+CONFIG = """
+[DEFAULT]
+mqtt_topic_server = test/server
+mqtt_topic_server_data = %(mqtt_topic_server)s/data
+mqtt_topic_server_status = %(mqtt_topic_server)s/status
+mqtt_topic_server_command = %(mqtt_topic_server)s/command
+
+[Runtime]
+mode = threads
+config_watch = off
+
+[Publish]
+workers = on
+
+[MQTTbroker]
+host = localhost
+
+[MQTTfilters]
+server_filter_data = %(mqtt_topic_server_data)s/#
+server_filter_command = %(mqtt_topic_server_command)s/#
+
+[MQTTtopics]
+server_data_temp = %(mqtt_topic_server_data)s/temp
+server_data_spool = %(mqtt_topic_server_data)s/spool
+server_command = %(mqtt_topic_server_command)s
+server_command_fan = %(mqtt_topic_server_command)s/fan
+server_command_fan_percon = %(server_command_fan)s/percon
+server_command_fan_percoff = %(server_command_fan)s/percoff
+server_status_fan = %(mqtt_topic_server_status)s/fan
+server_status_fan_percon = %(server_status_fan)s/percon
+server_status_fan_percoff = %(server_status_fan)s/percoff
+
+[Fan]
+pin_fan_name = PA13
+percentage_maxtemp_on = 90
+percentage_maxtemp_off = 70
+actor = on
+switch_interval = 0.0
+
+[TimerTemperature]
+period_measure = 5.0
+
+[ThingSpeak]
+field_temp = 1
+field_fan = 2
+"""
+
+
+def write_config(path, options):
+    """Write the test configuration with options changed or added.
+
+    Arguments
+    ---------
+    path : str
+        Path of the configuration file.
+    options : dict
+        Values of options by pairs of their section and name. The value None
+        removes the option.
+
+    """
+    parser = configparser.ConfigParser(interpolation=None)
+    parser.read_string(CONFIG)
+    for (section, option), value in options.items():
+        if not parser.has_section(section):
+            parser.add_section(section)
+        if value is None:
+            parser.remove_option(section, option)
+        else:
+            parser.set(section, option, str(value))
+    content = io.StringIO()
+    parser.write(content)
+    with open(path, "w") as config_file:
+        config_file.write(content.getvalue())
+
+
+class FakeClock(object):
+    """Settable clock of the script."""
+
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def perf_counter(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def sf():
+    """Script module with its logger and the real clock."""
+    import server_fan
+    server_fan.logger = logging.getLogger("server_fan")
+    yield server_fan
+    server_fan.clock = time
+
+
+@pytest.fixture
+def clock(sf):
+    """Fake clock injected into the script at a whole hour."""
+    fake = FakeClock(1800000000.0)
+    sf.clock = fake
+    return fake
+
+
+@pytest.fixture
+def config_options():
+    """Options changed against the test configuration, none by default."""
+    return {}
+
+
+@pytest.fixture
+def config_path(tmp_path, config_options):
+    """Path of the test configuration file."""
+    path = str(tmp_path / "server_fan.ini")
+    write_config(path, config_options)
+    return path
+
+
+@pytest.fixture
+def script(sf, config_path, monkeypatch):
+    """Script set up from the test configuration in threads runtime.
+
+    Notes
+    -----
+    - The script module is reloaded for fresh global state.
+    - Timers are only defined, their ticks are driven by tests.
+    - The fan actor and sink workers run in their threads.
+
+    """
+    importlib.reload(sf)
+    sf.logger = logging.getLogger("server_fan")
+    monkeypatch.setattr(sys, "argv", [sf.__file__, config_path])
+    sf.setup_cmdline()
+    sf.setup_config()
+    sf.setup_runtime()
+    sf.setup_script(skip=[sf.setup_blynk], start=False)
+    yield sf
+    sf.shutdown()
+    sf.cmdline.config.close()
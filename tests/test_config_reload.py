@@ -0,0 +1,53 @@
+"""Tests of validating and applying of a reloaded configuration."""
+from conftest import write_config
+
+
+def reload(script, config_path, options):
+    write_config(config_path, options)
+    script.config_reload()
+
+
+def fan_triggers(script):
+    return dict((id, trigger[1])
+                for id, trigger in script.trigger.triggers.items())
+
+
+def test_changed_defaults_reset_limits(script, config_path):
+    reload(script, config_path, {("Fan", "percentage_maxtemp_on"): 85})
+    assert script.pi.FAN_PERC_ON_CUR == 85.0
+    # Triggers are re-armed before the reload returns
+    assert fan_triggers(script) == {"fanon": 85.0, "fanoff": 70.0}
+
+
+def test_commanded_limits_kept(script, config_path):
+    script.fan_apply(None, {"perc_on": 92.0})
+    reload(script, config_path, {("Fan", "predict_window"): 60})
+    assert script.predictor.window == 60.0
+    assert script.pi.FAN_PERC_ON_CUR == 92.0
+    assert fan_triggers(script)["fanon"] == 92.0
+
+
+def test_invalid_value_rejected(script, config_path):
+    snapshot = script.config_snapshot
+    reload(script, config_path, {("Fan", "percentage_maxtemp_on"): "abc"})
+    assert script.config_snapshot is snapshot
+    assert script.pi.FAN_PERC_ON_CUR == 90.0
+
+
+def test_failed_section_rejects_all(script, config_path, monkeypatch):
+    config = script.config
+
+    def fail(cfg):
+        raise ValueError("failed")
+
+    monkeypatch.setattr(script, "build_crossing", fail)
+    reload(script, config_path, {
+        ("Fan", "percentage_maxtemp_on"): 85,
+        ("TimerTemperature", "period_measure"): 10,
+        ("MQTTtopics", "server_data_temp"): "test/temp",
+    })
+    assert script.config is config
+    assert script.pi.FAN_PERC_ON_DEF == 90.0
+    assert fan_triggers(script)["fanon"] == 90.0
+    assert script.timers["Timer_temp"]["period"] == 5.0
+    assert "test/temp" not in script.mqtt_routes
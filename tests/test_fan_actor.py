@@ -0,0 +1,83 @@
+"""Tests of coalescing and rate limiting of fan commands by the fan actor."""
+import pytest
+
+
+@pytest.fixture
+def actor(script, clock, monkeypatch):
+    """Fan actor applying batches directly with published changes recorded.
+
+    Notes
+    -----
+    - The actor is not started, so that batches are applied synchronously
+      in the test at the fake time.
+
+    """
+    actor = script.FanActor(switch_interval=10.0)
+    actor.published = []
+    monkeypatch.setattr(
+        script, "fan_publisher",
+        lambda *args: actor.published.append(args))
+    return actor
+
+
+def test_switching_coalesced(script):
+    toggle = (None, script.CMD_FAN_TOGGLE, None)
+    assert script.fan_coalesce([toggle, toggle], {}) \
+        == {None: {"state": False}}
+    assert script.fan_coalesce([toggle], {None: True}) \
+        == {None: {"state": False}}
+    assert script.fan_coalesce(
+        [(None, script.CMD_FAN_ON, None), toggle, toggle], {}) \
+        == {None: {"state": True}}
+
+
+def test_percentages_coalesced(script):
+    commands = [
+        (None, script.CMD_FAN_PERCON, "80"),
+        (None, script.CMD_FAN_PERCON, "85"),
+        (None, script.CMD_FAN_PERCOFF, "60"),
+        (None, script.RESET, None),
+        (None, script.CMD_FAN_PERCOFF, "65"),
+        (None, script.CMD_FAN_PERCON, "abc"),
+        ("unknown", script.CMD_FAN_ON, None),
+    ]
+    assert script.fan_coalesce(commands, {}) \
+        == {None: {"reset": True, "perc_off": 65.0}}
+
+
+def test_batch_switches_once(script, actor):
+    actor._apply([
+        (None, script.CMD_FAN_ON, None),
+        (None, script.CMD_FAN_OFF, None),
+        (None, script.CMD_FAN_ON, None),
+        (None, script.CMD_FAN_PERCON, "95"),
+    ])
+    assert script.fan_state(None)
+    assert script.pi.FAN_PERC_ON_CUR == 95.0
+    assert actor.published == [(None, True, True)]
+
+
+def test_early_switching_deferred(script, actor, clock):
+    actor._apply([(None, script.CMD_FAN_ON, None)])
+    clock.now += 4.0
+    actor._apply([(None, script.CMD_FAN_OFF, None)])
+    assert script.fan_state(None)
+    assert actor.deferred == 1
+    assert actor._timeout(clock.monotonic()) == 6.0
+    # The deferred switching is realized after the interval
+    clock.now += 6.0
+    actor._apply([])
+    assert not script.fan_state(None)
+    assert actor._timeout(clock.monotonic()) is None
+    assert actor.published == [(None, True, False), (None, True, False)]
+
+
+def test_deferred_switching_superseded(script, actor, clock):
+    actor._apply([(None, script.CMD_FAN_ON, None)])
+    clock.now += 4.0
+    actor._apply([(None, script.CMD_FAN_OFF, None)])
+    actor._apply([(None, script.CMD_FAN_ON, None)])
+    clock.now += 6.0
+    actor._apply([])
+    assert script.fan_state(None)
+    assert actor.published == [(None, True, False)]
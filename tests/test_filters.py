@@ -0,0 +1,56 @@
+"""Tests of sliding window smoothing filters against brute force."""
+import random
+import statistics
+
+import pytest
+
+
+def samples(count=500, seed=3):
+    generator = random.Random(seed)
+    # Repeated values exercise removing of duplicates from the window
+    return [round(generator.gauss(50.0, 5.0), 1) for _ in range(count)]
+
+
+def trimmed_mean(window, trim):
+    ordered = sorted(window)
+    cut = int(len(ordered) * trim)
+    kept = ordered[cut:len(ordered) - cut]
+    return sum(kept) / len(kept)
+
+
+@pytest.mark.parametrize("window", [1, 2, 5, 8])
+def test_median(sf, window):
+    values = samples()
+    stream_filter = sf.FilterMedian(window, decimals=6)
+    for index, value in enumerate(values):
+        expected = statistics.median(values[max(index - window + 1, 0):
+                                            index + 1])
+        assert stream_filter.result(value) == pytest.approx(expected)
+
+
+def test_median_heaps_bounded(sf):
+    stream_filter = sf.FilterMedian(5)
+    for value in samples(5000):
+        stream_filter.result(value)
+    assert len(stream_filter._low) + len(stream_filter._high) <= 2 * 5 + 1
+
+
+@pytest.mark.parametrize("window, trim", [(1, 0.2), (5, 0.2), (10, 0.1),
+                                          (7, 0.49)])
+def test_trimmed_mean(sf, window, trim):
+    values = samples()
+    stream_filter = sf.FilterTrimmedMean(window, trim, decimals=6)
+    for index, value in enumerate(values):
+        expected = trimmed_mean(values[max(index - window + 1, 0):index + 1],
+                                min(trim, 0.49))
+        assert stream_filter.result(value) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("factory", ["FilterMedian", "FilterTrimmedMean"])
+def test_batch_equals_stream(sf, factory):
+    values = samples()
+    stream_filter = getattr(sf, factory)(decimals=3)
+    batch_filter = getattr(sf, factory)(decimals=3)
+    assert batch_filter.batch(values) == [
+        stream_filter.result(value) for value in values]
+    assert batch_filter.result() == stream_filter.result()
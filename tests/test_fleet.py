@@ -0,0 +1,60 @@
+"""Tests of aggregation of temperatures of the fleet."""
+import json
+
+import pytest
+
+
+@pytest.fixture
+def fleet(sf, clock):
+    return sf.Fleet("+/server/data/#", "temp", "telemetry", capacity=2,
+                    stale=60.0, expire=3600.0)
+
+
+def send(fleet, node, temp):
+    fleet.update("{}/server/data/temp".format(node), str(temp))
+
+
+def test_eviction_of_longest_silent(fleet, clock):
+    send(fleet, "a", 40.0)
+    clock.now += 1.0
+    send(fleet, "b", 41.0)
+    clock.now += 1.0
+    send(fleet, "a", 42.0)
+    clock.now += 1.0
+    send(fleet, "c", 43.0)
+    aggregates, _ = fleet.aggregate()
+    assert sorted(aggregates["node"]) == ["a", "c"]
+    assert aggregates["evicted"] == 1
+    assert aggregates["messages"] == 4
+    assert aggregates["temp"]["hottest"] == "c"
+
+
+def test_stale_alive_and_expired(fleet, clock):
+    send(fleet, "a", 40.0)
+    send(fleet, "b", 50.0)
+    clock.now += 30.0
+    send(fleet, "b", 51.0)
+    clock.now += 40.0
+    aggregates, changes = fleet.aggregate()
+    assert changes["stale"] == ["a"] and changes["alive"] == []
+    assert aggregates["stale"] == ["a"]
+    assert aggregates["temp"]["min"] == 51.0
+    # Changes are reported just once
+    assert fleet.aggregate()[1] is None
+    send(fleet, "a", 45.0)
+    _, changes = fleet.aggregate()
+    assert changes["alive"] == ["a"]
+    clock.now += 3601.0
+    aggregates, _ = fleet.aggregate()
+    assert aggregates["nodes"] == 0
+    assert aggregates["expired"] == 2
+
+
+def test_telemetry_and_invalid(fleet):
+    fleet.update("a/server/data/telemetry", json.dumps({"temp": 48.5}))
+    fleet.update("b/server/data/temp", "hot")
+    fleet.update("b/server/data/other", "40")
+    aggregates, _ = fleet.aggregate()
+    assert aggregates["node"]["a"][0] == 48.5
+    assert aggregates["invalid"] == 1
+    assert aggregates["nodes"] == 1
@@ -0,0 +1,90 @@
+"""Tests of the ring buffer of temperature history."""
+import pytest
+
+
+def records(history, **kwargs):
+    return [record for chunk in history.query(**kwargs) for record in chunk]
+
+
+def test_overwrites_oldest(sf):
+    history = sf.HistoryBuffer(capacity=5)
+    for second in range(8):
+        history.append(float(second), raw=40.0 + second, filtered=40.5)
+    assert len(history) == 5
+    result = records(history)
+    assert [record[0] for record in result] == [3.0, 4.0, 5.0, 6.0, 7.0]
+    assert result[0] == (3.0, 43.0, 40.5, sf.HISTORY_SAMPLE, 0)
+    history.close()
+
+
+def test_time_range_and_chunks(sf):
+    history = sf.HistoryBuffer(capacity=100, chunk=3)
+    for second in range(20):
+        history.append(float(second), raw=40.0)
+    chunks = list(history.query(start=5.0, end=14.0))
+    assert [len(chunk) for chunk in chunks] == [3, 3, 3, 1]
+    assert [record[0] for chunk in chunks for record in chunk] == [
+        float(second) for second in range(5, 15)]
+    history.close()
+
+
+def test_decimation_keeps_events(sf):
+    history = sf.HistoryBuffer(capacity=100)
+    for second in range(10):
+        history.append(float(second), raw=40.0)
+        if second == 4:
+            history.append(4.5, event=sf.HISTORY_FAN_ON, channel=1)
+    result = records(history, decimate=3)
+    assert [(record[0], record[3]) for record in result] == [
+        (0.0, sf.HISTORY_SAMPLE),
+        (3.0, sf.HISTORY_SAMPLE),
+        (4.5, sf.HISTORY_FAN_ON),
+        (6.0, sf.HISTORY_SAMPLE),
+        (9.0, sf.HISTORY_SAMPLE),
+    ]
+    # Missing temperatures of events are None
+    assert result[2][1:3] == (None, None)
+    history.close()
+
+
+def test_survives_restart(sf, tmp_path):
+    path = str(tmp_path / "history")
+    history = sf.HistoryBuffer(path, capacity=4)
+    for second in range(6):
+        history.append(float(second), raw=40.0)
+    history.close()
+    history = sf.HistoryBuffer(path, capacity=4)
+    assert [record[0] for record in records(history)] == [2.0, 3.0, 4.0, 5.0]
+    history.close()
+    # A different capacity initializes the buffer anew
+    history = sf.HistoryBuffer(path, capacity=8)
+    assert len(history) == 0
+    history.close()
+
+
+@pytest.fixture
+def config_options(tmp_path):
+    """Time-series store without the history buffer."""
+    return {
+        ("History", "capacity"): 0,
+        ("Store", "store_file"): str(tmp_path / "store.db"),
+    }
+
+
+@pytest.fixture
+def queries(script, monkeypatch):
+    """Requests of history queries passed to the MQTT sink."""
+    requests = []
+    monkeypatch.setattr(
+        script, "sink_publish",
+        lambda sink, key, func, request: requests.append(request))
+    return requests
+
+
+def test_store_query_without_history(script, queries):
+    script.mqtt_receive_command_history(
+        "test/server/command/history", '{"id": 1, "resolution": 60}')
+    script.mqtt_receive_command_history(
+        "test/server/command/history", '{"id": 2}')
+    assert [request["id"] for request in queries] == [1]
+    assert queries[0]["resolution"] == 60
@@ -0,0 +1,69 @@
+"""Tests of dispatching of received MQTT messages by routing tables."""
+import types
+
+import pytest
+
+
+@pytest.fixture
+def config_options():
+    """Additional fan channel rear."""
+    return {
+        ("Fan", "channels"): "rear",
+        ("Fan:rear", "pin_fan_name"): "PA14",
+    }
+
+
+@pytest.fixture
+def actions(script, monkeypatch):
+    """Fan actions called by handlers of routed messages."""
+    calls = []
+    monkeypatch.setattr(
+        script, "action_fan", lambda *args: calls.append((None,) + args))
+    monkeypatch.setattr(
+        script, "action_fan_channel", lambda *args: calls.append(args))
+    return calls
+
+
+def message(topic, payload):
+    return types.SimpleNamespace(
+        topic=topic, payload=payload, qos=0, retain=False)
+
+
+def fallback(topic, payload, command=None):
+    fallback.received.append((topic, payload))
+
+
+def route(script, topic, payload):
+    fallback.received = []
+    script.mqtt_route(message(topic, payload), fallback)
+    return fallback.received
+
+
+def test_exact_routes(script, actions):
+    route(script, "test/server/command/fan", b"ON")
+    route(script, "test/server/command/fan/percon", b"85")
+    assert actions == [(None, "ON"), (None, script.CMD_FAN_PERCON, "85")]
+
+
+def test_channel_routes(script, actions):
+    route(script, "test/server/command/fan/rear", b"OFF")
+    route(script, "test/server/command/fan/rear/percoff", b"65")
+    assert actions == [
+        ("rear", "OFF"),
+        ("rear", script.CMD_FAN_PERCOFF, "65"),
+    ]
+
+
+def test_topic_filter_fallback(script, actions, caplog):
+    # Unknown command topic is handled by the handler of its topic filter
+    assert route(script, "test/server/command/unknown", b"X") == []
+    assert "Received unknown command X" in caplog.text
+    # Topic matching no filter is handled by the fallback
+    assert route(script, "test/other", b"Y") == [("test/other", "Y")]
+    assert actions == []
+
+
+def test_empty_payload_ignored(script, actions):
+    assert route(script, "test/other", None) == []
+    route(script, "test/server/command/fan", None)
+    assert actions == []
@@ -0,0 +1,82 @@
+"""Tests of fan-out of status updates to workers of publishing sinks."""
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def sinks(script, monkeypatch):
+    """Sinks of the script replaced by workers not started.
+
+    Notes
+    -----
+    - Updates stay pending in the workers, so that their coalescing can be
+      inspected.
+
+    """
+    for name, worker in list(script.publish_sinks.items()):
+        worker.stop()
+        monkeypatch.setitem(
+            script.publish_sinks, name, script.PublishSink(name))
+    return script.publish_sinks
+
+
+def test_fan_publish_fan_out(script, sinks):
+    for _ in range(2):
+        script.fan_publish(None, True, True)
+    # States are coalesced, switchings are kept for ThingSpeak as events
+    for name, pending, replaced in [
+        ("mqtt", 2, 2),
+        ("thingspeak", 2, 0),
+        ("blynk", 2, 2),
+    ]:
+        assert (len(sinks[name]), sinks[name].replaced) \
+            == (pending, replaced), name
+
+
+def test_latest_state_published(sf):
+    sink = sf.PublishSink("test")
+    published = []
+    sink.submit("state", published.append, 1)
+    sink.submit(None, published.append, "event")
+    sink.submit("state", published.append, 2)
+    sink.start()
+    assert sink.wait()
+    sink.stop()
+    # The newer state is published at the position of the pending one
+    assert published == [2, "event"]
+    assert (sink.published, sink.replaced) == (2, 1)
+
+
+def test_failed_and_slow_sink(sf):
+    slow = sf.PublishSink("slow", capacity=2)
+    other = sf.PublishSink("other")
+    entered = threading.Event()
+    release = threading.Event()
+    published = []
+
+    def block():
+        entered.set()
+        release.wait(5.0)
+
+    def fail():
+        raise OSError("failed")
+
+    slow.submit(None, block)
+    slow.start()
+    other.start()
+    assert entered.wait(5.0)
+    # A blocked sink drops updates at full queue, other sinks still publish
+    for index in range(3):
+        slow.submit(None, published.append, index)
+    other.submit(None, fail)
+    other.submit(None, published.append, "other")
+    assert other.wait()
+    assert published == ["other"]
+    assert (other.failed, other.published) == (1, 1)
+    release.set()
+    assert slow.wait()
+    slow.stop()
+    other.stop()
+    assert published == ["other", 0, 1]
+    assert slow.dropped == 1
@@ -0,0 +1,116 @@
+"""Tests of the persistent spool of MQTT publishing."""
+import json
+import os.path
+
+import pytest
+
+
+@pytest.fixture
+def replay_topic():
+    return "original"
+
+
+@pytest.fixture
+def config_options(tmp_path, replay_topic):
+    return {
+        ("MQTTspool", "spool_file"): str(tmp_path / "script.spool"),
+        ("MQTTspool", "replay_topic"): replay_topic,
+    }
+
+
+def test_append_peek_remove(sf, tmp_path):
+    spool = sf.PublishSpool(str(tmp_path / "spool"))
+    spool.append("server_data_temp", "MQTTtopics", 40.0, timestamp=1.0)
+    spool.append("server_data_temp", "MQTTtopics", 41.0, timestamp=2.0)
+    assert len(spool) == 2
+    assert [record["message"] for record in spool.peek(5)] == [40.0, 41.0]
+    spool.remove(1)
+    assert [record["message"] for record in spool.peek(5)] == [41.0]
+    spool.remove(1)
+    assert len(spool) == 0
+    spool.close()
+    assert os.path.getsize(str(tmp_path / "spool")) == 0
+
+
+def test_records_survive_restart(sf, tmp_path):
+    path = str(tmp_path / "spool")
+    spool = sf.PublishSpool(path, sync_count=2)
+    assert not spool.append("server_data_temp", "MQTTtopics", 40.0)
+    # Appending just reports the due sync for doing it elsewhere
+    assert spool.append(
+        "server_status_fan", "MQTTtopics", "FAN-ON", state=True,
+        topic="node/server/status/fan/rear")
+    spool.sync()
+    # Partially written record at a crash is skipped
+    with open(path, "a") as segment:
+        segment.write('{"timestamp": 1')
+    spool = sf.PublishSpool(path)
+    records = spool.peek(5)
+    assert [record["message"] for record in records] == [40.0, "FAN-ON"]
+    assert records[1]["topic"] == "node/server/status/fan/rear"
+    spool.close()
+
+
+def test_state_records_compacted(sf, tmp_path):
+    spool = sf.PublishSpool(str(tmp_path / "spool"))
+    spool.append("server_status_fan", "MQTTtopics", "FAN-ON", state=True)
+    spool.append("server_status_fan", "MQTTtopics", "FAN-ON", state=True,
+                 topic="node/server/status/fan/rear")
+    spool.append("server_data_temp", "MQTTtopics", 40.0)
+    spool.append("server_status_fan", "MQTTtopics", "FAN-OFF", state=True)
+    spool.compact()
+    assert [(record["message"], record.get("topic"))
+            for record in spool.peek(5)] == [
+        ("FAN-ON", "node/server/status/fan/rear"),
+        (40.0, None),
+        ("FAN-OFF", None),
+    ]
+    spool.close()
+
+
+def test_overflow_drops_oldest(sf, tmp_path):
+    spool = sf.PublishSpool(str(tmp_path / "spool"), capacity=10)
+    for value in range(11):
+        spool.append("server_data_temp", "MQTTtopics", float(value))
+    # A tenth of the capacity is freed at once
+    assert len(spool) == 9
+    assert spool.dropped == 2
+    assert spool.peek(1)[0]["message"] == 2.0
+    spool.close()
+
+
+def spool_offline(script):
+    script.mqtt.disconnect()
+    script.spool_publish(41.5, "server_data_temp", "MQTTtopics")
+    script.spool_publish("FAN-ON", "server_status_fan", "MQTTtopics",
+                         state=True, topic="test/server/status/fan/rear")
+    script.mqtt.connect()
+    script.mqtt_client().published.clear()
+
+
+def test_replay_to_original_topics(script, clock):
+    spool_offline(script)
+    start = clock.now
+    script.spool_replay()
+    assert script.mqtt_client().published == [
+        ("test/server/data/temp", 41.5, 0),
+        ("test/server/status/fan/rear", "FAN-ON", 0),
+    ]
+    assert len(script.spool) == 0
+    # Replay is paced by the clock of the script
+    assert clock.now - start == pytest.approx(2 / script.spool.replay_rate)
+
+
+@pytest.mark.parametrize("replay_topic", ["spool"])
+def test_replay_to_spool_topic(script, clock):
+    spool_offline(script)
+    start = clock.now
+    script.spool_replay()
+    published = script.mqtt_client().published
+    assert [topic for topic, _, _ in published] == [
+        "test/server/data/spool"] * 2
+    assert json.loads(published[0][1]) == {
+        "topic": "test/server/data/temp",
+        "timestamp": start,
+        "message": 41.5,
+    }
@@ -0,0 +1,52 @@
+"""Tests of rollups of the local time-series store."""
+import pytest
+
+
+@pytest.fixture
+def store(sf, clock, tmp_path):
+    store = sf.TimeSeriesStore(str(tmp_path / "store.db"), batch=2)
+    store.start()
+    yield store
+    store.stop()
+
+
+def rows(store, **kwargs):
+    return [row for chunk in store.query(**kwargs) for row in chunk]
+
+
+def test_rollups(store, clock):
+    base = clock.now - 3600.0
+    # Fan is on from the third sample of the first minute on
+    for index, temp in enumerate([40.0, 41.0, 42.0, 43.0, 44.0, 45.0]):
+        store.record_sample(base + 10.0 * index, temp + 0.5, temp, index >= 2)
+    store.record_sample(base + 60.0, 50.0, 50.0, False)
+    store.record_sample(base + 70.0, 52.0, 52.0, False)
+    store.stop()
+    assert len(rows(store)) == 8
+    assert rows(store, start=base + 60.0)[0] == (base + 60.0, 50.0, 50.0)
+    assert rows(store, resolution=60) == [
+        (int(base), 40.0, 45.0, 42.5, round(40.0 / 60.0, 4)),
+        (int(base) + 60, 50.0, 52.0, 51.0, 0.0),
+    ]
+    assert rows(store, resolution=3600) == [
+        (int(base), 40.0, 52.0, 44.625, round(40.0 / 3600.0, 4)),
+    ]
+    # Rollups are merged from several commits
+    assert store.commits >= 4
+
+
+def test_fan_events_duty_cycle(store, clock):
+    base = clock.now - 3600.0
+    store.record_sample(base, 40.0, 40.0, False)
+    store.record_event(base + 15.0, 0, True)
+    store.record_event(base + 45.0, 0, False)
+    # Events of other channels do not count into the duty cycle
+    store.record_event(base + 50.0, 1, True)
+    store.record_sample(base + 59.0, 40.0, 40.0, False)
+    store.stop()
+    assert rows(store, resolution=60)[0][4] == 0.5
+
+
+def test_unknown_resolution(store):
+    with pytest.raises(ValueError):
+        rows(store, resolution=10)
@@ -0,0 +1,173 @@
+"""Tests of the ThingSpeak bulk update buffer against a local stand-in."""
+import http.server
+import json
+import threading
+import urllib.error
+
+import pytest
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    """Bulk update endpoint recording requests and blocking on demand."""
+
+    def do_POST(self):
+        length = int(self.headers["Content-Length"])
+        self.server.requests.append(json.loads(self.rfile.read(length)))
+        self.server.entered.set()
+        self.server.release.wait(5.0)
+        status = self.server.statuses.pop(0) if self.server.statuses else 202
+        self.send_response(status)
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    """Local HTTP stand-in of the ThingSpeak bulk update endpoint."""
+    stand_in = http.server.ThreadingHTTPServer(
+        ("127.0.0.1", 0), StandInHandler)
+    stand_in.requests = []
+    stand_in.statuses = []
+    stand_in.entered = threading.Event()
+    stand_in.release = threading.Event()
+    stand_in.release.set()
+    stand_in.url = "http://127.0.0.1:{}/".format(stand_in.server_address[1])
+    thread = threading.Thread(target=stand_in.serve_forever, daemon=True)
+    thread.start()
+    yield stand_in
+    stand_in.release.set()
+    stand_in.shutdown()
+    stand_in.server_close()
+
+
+def flush_blocked(bulk, server):
+    """Start a forced flush and wait until the stand-in holds its request."""
+    server.entered.clear()
+    server.release.clear()
+    result = {}
+
+    def flush():
+        try:
+            result["sent"] = bulk.flush(force=True)
+        except Exception as error:
+            result["error"] = error
+
+    thread = threading.Thread(target=flush)
+    thread.start()
+    assert server.entered.wait(5.0)
+    return thread, result
+
+
+def fan_fields(state):
+    return {1: 50.0, 2: state}
+
+
+def test_same_second_data_merged(sf, server):
+    bulk = sf.ThingSpeakBulk(server.url, "key")
+    bulk.add({1: 50.0}, timestamp=100)
+    bulk.add({1: 51.0}, timestamp=100)
+    bulk.add({2: 1}, protected=True, timestamp=100)
+    assert bulk.flush(force=True) == 1
+    assert server.requests[0]["write_api_key"] == "key"
+    update = server.requests[0]["updates"][0]
+    assert update["field1"] == 51.0
+    assert update["field2"] == 1
+
+
+def test_same_second_transition_kept(sf, server):
+    bulk = sf.ThingSpeakBulk(server.url, "key")
+    bulk.add(fan_fields(1), protected=True, timestamp=100)
+    bulk.add(fan_fields(0), protected=True, timestamp=100)
+    bulk.add(fan_fields(1), protected=True, timestamp=100)
+    assert bulk.flush(force=True) == 3
+    updates = server.requests[0]["updates"]
+    assert [update["field2"] for update in updates] == [1, 0, 1]
+    assert len(set(update["created_at"] for update in updates)) == 3
+
+
+def test_later_update_keeps_its_second(sf, server):
+    bulk = sf.ThingSpeakBulk(server.url, "key")
+    for state in (1, 0, 1):
+        bulk.add({2: state}, protected=True, timestamp=100)
+    # Not drifted after the updates shifted by the burst
+    bulk.add({1: 51.0}, timestamp=101)
+    bulk.add({1: 52.0}, timestamp=104)
+    assert bulk.flush(force=True) == 4
+    updates = server.requests[0]["updates"]
+    assert [update.get("field1") for update in updates] \
+        == [None, 51.0, None, 52.0]
+    assert [update["field2"] for update in updates[:3]] == [1, 0, 1]
+    assert [update["created_at"][17:19] for update in updates] \
+        == ["40", "41", "42", "44"]
+
+
+def test_flush_detaches_batch(sf, server):
+    bulk = sf.ThingSpeakBulk(server.url, "key")
+    bulk.add(fan_fields(1), protected=True, timestamp=100)
+    thread, result = flush_blocked(bulk, server)
+    # Neither merged into the update in flight nor given its timestamp
+    bulk.add({1: 52.0}, timestamp=100)
+    bulk.add(fan_fields(0), protected=True, timestamp=100)
+    assert len(bulk) == 2
+    server.release.set()
+    thread.join(5.0)
+    assert result == {"sent": 1}
+    assert bulk.flush(force=True) == 2
+    first, second = server.requests
+    assert [update["field2"] for update in first["updates"]] == [1]
+    assert [update["field1"] for update in first["updates"]] == [50.0]
+    assert [update.get("field2") for update in second["updates"]] \
+        == [None, 0]
+    times = [update["created_at"]
+             for request in server.requests for update in request["updates"]]
+    assert times == sorted(times) and len(set(times)) == len(times)
+
+
+def test_failed_flush_put_back(sf, server):
+    bulk = sf.ThingSpeakBulk(server.url, "key")
+    bulk.add(fan_fields(1), protected=True, timestamp=100)
+    server.statuses.append(500)
+    thread, result = flush_blocked(bulk, server)
+    bulk.add(fan_fields(0), protected=True, timestamp=101)
+    server.release.set()
+    thread.join(5.0)
+    assert isinstance(result["error"], urllib.error.HTTPError)
+    assert len(bulk) == 2
+    assert bulk.flush(force=True) == 2
+    updates = server.requests[-1]["updates"]
+    assert [update["field2"] for update in updates] == [1, 0]
+
+
+def test_failed_flush_overflow(sf, server):
+    bulk = sf.ThingSpeakBulk(server.url, "key", capacity=3)
+    bulk.add({1: 40.0}, timestamp=100)
+    bulk.add(fan_fields(1), protected=True, timestamp=101)
+    bulk.add({1: 42.0}, timestamp=102)
+    server.statuses.append(500)
+    thread, result = flush_blocked(bulk, server)
+    for index in range(3):
+        bulk.add({1: 43.0 + index}, timestamp=103 + index)
+    server.release.set()
+    thread.join(5.0)
+    assert "error" in result
+    # The oldest data updates are dropped, the fan switching is kept
+    assert len(bulk) == 3
+    assert bulk.dropped == 3
+    bulk.flush(force=True)
+    updates = server.requests[-1]["updates"]
+    assert [update.get("field2") for update in updates] == [1, None, None]
+    assert [update["field1"] for update in updates] == [50.0, 44.0, 45.0]
+
+
+def test_overflow_keeps_protected(sf, server):
+    bulk = sf.ThingSpeakBulk(server.url, "key", capacity=2)
+    bulk.add(fan_fields(1), protected=True, timestamp=100)
+    bulk.add(fan_fields(0), protected=True, timestamp=101)
+    bulk.add({1: 41.0}, timestamp=102)
+    assert len(bulk) == 3
+    bulk.add({1: 42.0}, timestamp=103)
+    assert len(bulk) == 3
+    assert bulk.dropped == 1